@@ -0,0 +1,217 @@
+"""Benchmark the acquisition loop on the simulated rig.
+
+Runs PMTCheckingEngine against tiled_acquisition.simulation for each
+combination of --resolutions and --frames, each in its own process so that
+peak memory is measured separately, and writes the results as JSON:
+
+    python benchmarks/bench_acquisition.py --frames 10 90 --move-time 0.05 \\
+        --disk-mb-per-s 200 --output bench.json
+
+Latencies are per position, in milliseconds: simulated exposure and readout
+(including writing the SDT placeholder files), and the total of each phase
+recorded by the engine's tracer (setup_event, stage_move, frame, pmt_reset,
+and the rename_sdt_files, create_tile_config and image_write steps that run
+on the background writer). "phases" has the tracer's p50/p95 per span.
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--resolutions", type=int, nargs="+", default=[256, 512, 1024])
+    parser.add_argument("--frames", type=int, nargs="+", default=[1, 10])
+    parser.add_argument("--positions", type=int, default=16)
+    parser.add_argument(
+        "--frame-time", type=float, default=0.0, metavar="S", help="Simulated scan time per frame"
+    )
+    parser.add_argument(
+        "--move-time", type=float, default=0.0, metavar="S", help="Simulated stage move time"
+    )
+    parser.add_argument(
+        "--dropout-rate", type=float, default=0.0, metavar="P", help="PMT trip probability per frame"
+    )
+    parser.add_argument(
+        "--pmt-recovery-time", type=float, default=0.0, metavar="S", help="PMT warm-up after reset"
+    )
+    parser.add_argument(
+        "--pmt-clear-time", type=float, default=0.0, metavar="S", help="Time to clear an overload"
+    )
+    parser.add_argument(
+        "--disk-mb-per-s", type=float, metavar="MB_PER_S", help="Throttle image writes to this bandwidth"
+    )
+    parser.add_argument("--output-format", default="ome-tiff", choices=("ome-tiff", "ome-zarr", "none"))
+    parser.add_argument("--write-queue", type=int, default=2)
+    parser.add_argument(
+        "--frame-workers", type=int, default=0, metavar="N", help="Save in N worker processes"
+    )
+    parser.add_argument(
+        "--volumes",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Spread tiles over N output roots, each its own --disk-mb-per-s disk",
+    )
+    parser.add_argument(
+        "--compress-raw", action="store_true", help="Compress SDT/SPC files in the background"
+    )
+    parser.add_argument("--no-prefetch-moves", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", metavar="FILENAME", help="Write JSON here instead of stdout")
+    parser.add_argument("--single", type=int, nargs=2, metavar=("RESOLUTION", "FRAMES"), help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        import psutil
+
+        return psutil.Process().memory_info().peak_wset / 2**20
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+
+def run_single(options, resolution, n_frames):
+    from tiled_acquisition import main
+    from tiled_acquisition.journal import PositionJournal
+    from tiled_acquisition.backends import OMETiffBackend
+    from tiled_acquisition.simulation import ThrottledBackend, make_simulated_core
+    from tiled_acquisition.striping import StripedBackend
+
+    side = int(np.ceil(np.sqrt(options.positions)))
+    xyzs = [(500.0 * (i % side), 500.0 * (i // side), 0.0) for i in range(options.positions)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv = Path(tmp) / "positions.csv"
+        csv.write_text("".join(f"{x},{y},{z}\n" for x, y, z in xyzs))
+        save = Path(tmp) / "data"
+        save.mkdir()
+        argv = [
+            str(csv),
+            "--config", "simulated",
+            "--save", str(save),
+            "--frames", str(n_frames),
+            "--resolution", str(resolution),
+            "--output", options.output_format,
+            "--write-queue", str(options.write_queue),
+            "--frame-workers", str(options.frame_workers),
+        ]
+        if options.no_prefetch_moves:
+            argv.append("--no-prefetch-moves")
+        if options.compress_raw:
+            argv.append("--compress-raw")
+        if options.volumes > 1:
+            argv += ["--output-roots", *(str(Path(tmp) / f"data{i}") for i in range(1, options.volumes))]
+        args = main.parse_args(argv)
+
+        core = make_simulated_core(
+            resolution=resolution,
+            frame_time=options.frame_time,
+            move_time=options.move_time,
+            dropout_rate=options.dropout_rate,
+            pmt_recovery_time=options.pmt_recovery_time,
+            pmt_clear_time=options.pmt_clear_time,
+            seed=options.seed,
+        )
+        core.setProperty("OSc-LSM", "BH-TCSPC-FLIMFileSaving", "Yes")
+        scanner = core._pydevices["OSc-LSM"]
+        dcc = core._pydevices["DCCModule2"]
+
+        placer = main.make_volume_placer(args)
+        backend = main.make_output_backend(args, xyzs, placer)
+        if options.disk_mb_per_s and placer is not None and options.output_format == "ome-tiff":
+            backend = StripedBackend(
+                {
+                    root: ThrottledBackend(
+                        OMETiffBackend(main.image_dir_for(args, root), args.pixel_size),
+                        options.disk_mb_per_s * 1e6,
+                    )
+                    for root in placer.roots
+                },
+                placer.root_of,
+                placer.observe,
+            )
+        elif options.disk_mb_per_s:
+            backend = ThrottledBackend(backend, options.disk_mb_per_s * 1e6)
+
+        journal = PositionJournal(save)
+        start = time.perf_counter()
+        try:
+            engine = main.run_acquisition(
+                core, args, xyzs, np.arange(len(xyzs)), journal, backend, placer
+            )
+        finally:
+            journal.close()
+        wall = time.perf_counter() - start
+
+    n = len(xyzs)
+    stage = engine.stage_timer
+    phases = engine.tracer.summary()
+    latency = {
+        "expose": scanner.expose_time / n,
+        "readout": scanner.readout_time / n,
+        **{phase: stats["total_s"] / n for phase, stats in phases.items()},
+    }
+    return {
+        "resolution": resolution,
+        "frames": n_frames,
+        "positions": n,
+        "wall_time_s": wall,
+        "positions_per_hour": 3600 * n / wall,
+        "latency_ms": {name: 1000 * value for name, value in latency.items()},
+        "phases": phases,
+        "prefetched_moves": stage.prefetched,
+        "ring_fallbacks": engine.status()["ring_fallbacks"],
+        "pmt_trips": dcc.trips,
+        "pmt_resets": dcc.resets,
+        "pmt_reset_time_s": engine.status()["pmt"]["reset_time_s"],
+        "volumes": engine.status()["volumes"],
+        "compaction": engine.status()["compaction"],
+        "frames_acquired": scanner.frames,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def main():
+    options = parse_args()
+    if options.single:
+        print(json.dumps(run_single(options, *options.single)))
+        return
+
+    settings = {
+        key: value
+        for key, value in vars(options).items()
+        if key not in ("resolutions", "frames", "output", "single")
+    }
+    results = []
+    for resolution in options.resolutions:
+        for n_frames in options.frames:
+            print(f"Resolution {resolution}, {n_frames} frames...", file=sys.stderr)
+            completed = subprocess.run(
+                [sys.executable, *sys.argv, "--single", str(resolution), str(n_frames)],
+                capture_output=True,
+                text=True,
+            )
+            if completed.returncode != 0:
+                print(completed.stderr, file=sys.stderr)
+                sys.exit(f"Benchmark failed at resolution {resolution}, {n_frames} frames")
+            results.append(json.loads(completed.stdout.splitlines()[-1]))
+
+    report = json.dumps({"settings": settings, "results": results}, indent=2)
+    if options.output:
+        Path(options.output).write_text(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
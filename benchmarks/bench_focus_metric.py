@@ -0,0 +1,106 @@
+"""Benchmark the autofocus metrics on synthetic Z stacks.
+
+Builds a stack of --steps images per resolution, blurred with distance from
+a focal plane between two steps, scores it with each metric in
+tiled_acquisition.autofocus (the whole stack at once, as Autofocus.measure
+does, and image by image for comparison), and writes the results as JSON:
+
+    python benchmarks/bench_focus_metric.py --resolutions 64 128 256 --output focus.json
+
+Times are the median of --repeats runs, in milliseconds. "error_um" is the
+distance of the refined peak (best_focus) from the true focal plane.
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--resolutions", type=int, nargs="+", default=[64, 128, 256, 512])
+    parser.add_argument("--steps", type=int, default=9)
+    parser.add_argument(
+        "--z-range", type=float, default=20.0, metavar="UM", help="Sweep range around focus"
+    )
+    parser.add_argument(
+        "--depth-of-field", type=float, default=2.0, metavar="UM", help="Defocus per pixel of blur"
+    )
+    parser.add_argument(
+        "--photons", type=float, default=5.0, help="Mean photons per pixel per frame in focus"
+    )
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", metavar="FILENAME", help="Write JSON here instead of stdout")
+    return parser.parse_args()
+
+
+def synthetic_stack(options, resolution, focus_z, rng):
+    from tiled_acquisition.simulation import box_blur
+
+    texture = box_blur((rng.random((resolution, resolution)) < 0.05).astype(float), 1)
+    texture *= options.photons / texture.mean()
+    zs = np.linspace(-options.z_range / 2, options.z_range / 2, options.steps)
+    stack = np.stack(
+        [
+            rng.poisson(box_blur(texture, int(abs(z - focus_z) / options.depth_of_field)))
+            for z in zs
+        ]
+    ).astype(np.uint16)
+    return zs, stack
+
+
+def median_ms(f, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - start)
+    return 1000 * float(np.median(times))
+
+
+def run(options, resolution, rng):
+    from tiled_acquisition.autofocus import FOCUS_METRICS, best_focus, focus_metric
+
+    step = options.z_range / (options.steps - 1)
+    focus_z = float(rng.uniform(-step / 2, step / 2))
+    zs, stack = synthetic_stack(options, resolution, focus_z, rng)
+    results = []
+    for name in FOCUS_METRICS:
+        metric = focus_metric(name)
+        best = best_focus(zs, metric(stack))
+        results.append(
+            {
+                "metric": name,
+                "resolution": resolution,
+                "steps": options.steps,
+                "stack_ms": median_ms(lambda: metric(stack), options.repeats),
+                "per_image_ms": median_ms(lambda: [metric(image) for image in stack], options.repeats),
+                "error_um": None if best is None else abs(best - focus_z),
+            }
+        )
+    return results
+
+
+def main():
+    options = parse_args()
+    rng = np.random.default_rng(options.seed)
+    results = []
+    for resolution in options.resolutions:
+        print(f"Resolution {resolution}...", file=sys.stderr)
+        results.extend(run(options, resolution, rng))
+
+    settings = {key: value for key, value in vars(options).items() if key not in ("resolutions", "output")}
+    report = json.dumps({"settings": settings, "results": results}, indent=2)
+    if options.output:
+        Path(options.output).write_text(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,7 @@ $zmax = 10494+5
 $input_file = "D:\UserData\HelenWilson\20250814_HDIM\hdim_trial2\thirteenbeads_coverslip_water\locations_hdim_beads.pos"
 $output_file = "D:\UserData\HelenWilson\20250814_HDIM\hdim_trial2\thirteenbeads_coverslip_water\locations_hdim_beads.csv"
 
-python interpolate-z-coords.py `
+uv run --extra focus python interpolate-z-coords.py `
   --zmin $zmin `
   --zmax $zmax `
   --csv `
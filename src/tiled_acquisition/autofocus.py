@@ -0,0 +1,259 @@
+import json
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+from .tracing import write_json_atomic
+
+
+FOCUS_METRICS = ("brenner", "tenengrad")
+FOCUS_CACHE_NAME = "focus_cache.json"
+
+DEFAULT_RANGE = 20.0  # um, centred on the predicted Z
+DEFAULT_STEPS = 9
+DEFAULT_DRIFT_WINDOW = 8
+# Thermal drift and evaporation are slow; a slope is only fitted once the
+# measurements span this long, so that focus noise between measurements
+# seconds apart is not extrapolated
+MIN_DRIFT_SPAN = 60.0  # s
+
+# A sweep whose best score is not at least this much above its worst is
+# treated as out of focus everywhere (blank field, PMT off)
+MIN_CONTRAST = 1.05
+
+
+def _sum_of_squares(a):
+    return np.einsum("...ij,...ij->...", a, a)
+
+
+def brenner(images):
+    # Brenner gradient of an image, or of each image of a (..., Y, X) stack:
+    # squared differences between pixels two apart along X
+    a = np.asarray(images, dtype=np.float32)
+    return _sum_of_squares(a[..., 2:] - a[..., :-2])
+
+
+def tenengrad(images):
+    # Sum of the squared Sobel gradient magnitude, for an image or a stack
+    a = np.asarray(images, dtype=np.float32)
+    gx = (
+        a[..., :-2, 2:] - a[..., :-2, :-2]
+        + 2 * (a[..., 1:-1, 2:] - a[..., 1:-1, :-2])
+        + a[..., 2:, 2:] - a[..., 2:, :-2]
+    )
+    gy = (
+        a[..., 2:, :-2] - a[..., :-2, :-2]
+        + 2 * (a[..., 2:, 1:-1] - a[..., :-2, 1:-1])
+        + a[..., 2:, 2:] - a[..., :-2, 2:]
+    )
+    return _sum_of_squares(gx) + _sum_of_squares(gy)
+
+
+def focus_metric(name):
+    if name == "brenner":
+        return brenner
+    if name == "tenengrad":
+        return tenengrad
+    raise ValueError(f"Unknown focus metric: {name}")
+
+
+def best_focus(zs, scores, min_contrast=MIN_CONTRAST):
+    # Z of the peak score, refined with a parabola through the best point and
+    # its neighbours; None if the peak is at either end of the sweep (focus
+    # may be outside it) or the sweep is flat
+    zs = np.asarray(zs, dtype=float)
+    scores = np.asarray(scores, dtype=float)
+    i = int(np.argmax(scores))
+    if i == 0 or i == len(scores) - 1:
+        return None
+    if scores[i] < min_contrast * max(scores.min(), 1e-12):
+        return None
+    (z0, z1, z2), (s0, s1, s2) = zs[i - 1 : i + 2], scores[i - 1 : i + 2]
+    denominator = (z0 - z1) * (z0 - z2) * (z1 - z2)
+    a = (z2 * (s1 - s0) + z1 * (s0 - s2) + z0 * (s2 - s1)) / denominator
+    b = (z2**2 * (s0 - s1) + z1**2 * (s2 - s0) + z0**2 * (s1 - s2)) / denominator
+    if a >= 0:
+        return float(z1)
+    return float(np.clip(-b / (2 * a), z0, z2))
+
+
+# Running model of focus drift: the offset between measured and planned Z
+# as a function of time, from a least-squares line through the most recent
+# measurements (their median while they span less than min_span seconds),
+# extrapolated no further ahead than they span. Until there are any, `prior`
+# (e.g. the last offset of a previous run) is used; predictions are limited
+# to +/- max_offset.
+class DriftModel:
+    def __init__(
+        self,
+        window=DEFAULT_DRIFT_WINDOW,
+        max_offset=None,
+        prior=0.0,
+        min_span=MIN_DRIFT_SPAN,
+    ):
+        self.__samples = deque(maxlen=window)
+        self.__max_offset = max_offset
+        self.__prior = prior
+        self.__min_span = min_span
+
+    @property
+    def count(self):
+        return len(self.__samples)
+
+    def add(self, t, offset):
+        self.__samples.append((t, offset))
+
+    def predict(self, t=None):
+        if t is None:
+            t = time.time()
+        if not self.__samples:
+            offset = self.__prior
+        else:
+            ts, offsets = np.array(self.__samples).T
+            span = float(np.ptp(ts))
+            if span < self.__min_span:
+                offset = float(np.median(offsets))
+            else:
+                slope, intercept = np.polyfit(ts - ts[-1], offsets, 1)
+                offset = float(intercept + slope * min(t - ts[-1], span))
+        if self.__max_offset is not None:
+            offset = float(np.clip(offset, -self.__max_offset, self.__max_offset))
+        return offset
+
+
+# Measured Z per tile number, kept in a JSON file so that a later run (or
+# --resume) starts from the last measured drift instead of none.
+class FocusCache:
+    def __init__(self, path=None):
+        self.__path = path
+        self.__positions = {}
+        if path is not None:
+            try:
+                with open(path, encoding="utf-8") as f:
+                    self.__positions = {int(k): v for k, v in json.load(f)["positions"].items()}
+            except FileNotFoundError:
+                pass
+
+    def __len__(self):
+        return len(self.__positions)
+
+    def get(self, number):
+        return self.__positions.get(number)
+
+    def record(self, number, z, planned_z, t):
+        self.__positions[number] = {"z": z, "planned_z": planned_z, "time": t}
+        self.save()
+
+    def latest_offset(self, window=DEFAULT_DRIFT_WINDOW):
+        # Median offset of the most recent measurements, or 0 if there are none
+        recent = sorted(self.__positions.values(), key=lambda p: p["time"])[-window:]
+        if not recent:
+            return 0.0
+        return float(np.median([p["z"] - p["planned_z"] for p in recent]))
+
+    def save(self):
+        if self.__path is not None:
+            write_json_atomic(
+                self.__path, {"positions": {str(k): v for k, v in self.__positions.items()}}
+            )
+
+
+# Image-based autofocus for PMTCheckingEngine. At every `every`-th position
+# the engine calls measure(), which snaps short scans at `steps` Z positions
+# over `z_range` around the current Z (with FLIM file saving off, and at
+# `resolution` pixels if the configuration has a "Resolution (pixels)"
+# group), scores them all at once with the focus metric, and moves to the
+# best Z. The difference from the planned Z goes into the drift model, whose
+# prediction the engine adds to the Z of upcoming positions.
+class Autofocus:
+    def __init__(
+        self,
+        core,
+        every,
+        z_range=DEFAULT_RANGE,
+        steps=DEFAULT_STEPS,
+        metric="brenner",
+        resolution=None,
+        cache=None,
+        drift_window=DEFAULT_DRIFT_WINDOW,
+        max_offset=None,
+    ):
+        if steps < 3:
+            raise ValueError("Autofocus needs at least 3 Z steps")
+        self.__core = core
+        self.__every = every
+        self.__z_range = z_range
+        self.__steps = steps
+        self.__metric = focus_metric(metric)
+        self.__resolution = resolution
+        self.__cache = cache if cache is not None else FocusCache()
+        self.drift = DriftModel(drift_window, max_offset, self.__cache.latest_offset(drift_window))
+        self.measurements = 0
+        self.failures = 0
+
+    def due(self, index):
+        return self.__every > 0 and index % self.__every == 0
+
+    def offset(self, t=None):
+        return self.drift.predict(t)
+
+    def measure(self, planned_z, number=None):
+        # Returns the Z moved to, or None if no focus was found (Z is then
+        # left where it was)
+        core = self.__core
+        focus = core.getFocusDevice()
+        z0 = core.getPosition()
+        zs = z0 + np.linspace(-self.__z_range / 2, self.__z_range / 2, self.__steps)
+        images = None
+        with self.__scan_settings():
+            for i, z in enumerate(zs):
+                core.setPosition(float(z))
+                core.waitForDevice(focus)
+                core.snapImage()
+                image = core.getImage()
+                if images is None:
+                    images = np.empty((len(zs), *image.shape), dtype=image.dtype)
+                images[i] = image
+        best = best_focus(zs, self.__metric(images))
+        if best is None:
+            self.failures += 1
+            core.setPosition(z0)
+        else:
+            self.measurements += 1
+            core.setPosition(best)
+            t = time.time()
+            if planned_z is not None:
+                self.drift.add(t, best - planned_z)
+                if number is not None:
+                    self.__cache.record(number, best, planned_z, t)
+        core.waitForDevice(focus)
+        return best
+
+    def summary(self):
+        return {
+            "measurements": self.measurements,
+            "failures": self.failures,
+            "offset_um": self.offset(),
+        }
+
+    @contextmanager
+    def __scan_settings(self):
+        core = self.__core
+        camera = core.getCameraDevice()
+        restore = []
+        if core.hasProperty(camera, "BH-TCSPC-FLIMFileSaving"):
+            saving = core.getProperty(camera, "BH-TCSPC-FLIMFileSaving")
+            core.setProperty(camera, "BH-TCSPC-FLIMFileSaving", "No")
+            restore.append(lambda: core.setProperty(camera, "BH-TCSPC-FLIMFileSaving", saving))
+        group = "Resolution (pixels)"
+        if self.__resolution is not None and core.isGroupDefined(group):
+            resolution = core.getCurrentConfig(group)
+            core.setConfig(group, str(self.__resolution))
+            restore.append(lambda: core.setConfig(group, resolution))
+        try:
+            yield
+        finally:
+            for undo in reversed(restore):
+                undo()
@@ -0,0 +1,236 @@
+import contextlib
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+
+
+OUTPUT_FORMATS = ("ome-tiff", "ome-zarr", "none")
+
+PIXEL_SIZE_UM = 0.7  # FIXME: depends on lens, zoom and resolution
+# Rows of the OME-Zarr stage position array per chunk
+STAGE_POSITION_CHUNK = 1024
+
+
+def tile_name(number):
+    return f"pos_{number:04d}"
+
+
+# An output backend receives each completed position as a uint16 TYX stack
+# (on the background writer thread) and returns the files it wrote, which are
+# recorded in the journal. Backends must not keep a reference to the stack
+# after write_position() returns; its buffer is reused.
+class OutputBackend:
+    def write_position(self, number, event, stack):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class NullBackend(OutputBackend):
+    def write_position(self, number, event, stack):
+        return []
+
+
+# Sends each position to several backends
+class CompositeBackend(OutputBackend):
+    def __init__(self, backends):
+        self.__backends = list(backends)
+
+    def write_position(self, number, event, stack):
+        files = []
+        for backend in self.__backends:
+            files.extend(backend.write_position(number, event, stack))
+        return files
+
+    def close(self):
+        for backend in self.__backends:
+            backend.close()
+
+
+# One OME-TIFF per position, named like the SDT files
+class OMETiffBackend(OutputBackend):
+    def __init__(self, directory, pixel_size=PIXEL_SIZE_UM):
+        self.__directory = Path(directory)
+        self.__directory.mkdir(parents=True, exist_ok=True)
+        self.__pixel_size = pixel_size
+
+    def write_position(self, number, event, stack):
+        fpath = self.__directory / f"{tile_name(number)}.tif"
+        write_ome_tiff(fpath, stack, self.__pixel_size)
+        return [str(fpath)]
+
+
+def write_ome_tiff(fpath, stack, pixel_size=PIXEL_SIZE_UM):
+    from pyometiff import OMETIFFWriter
+
+    metadata_dict = {
+        "PhysicalSizeX" : str(pixel_size),
+        "PhysicalSizeXUnit" : "µm",
+        "PhysicalSizeY" : str(pixel_size),
+        "PhysicalSizeYUnit" : "µm",
+        "PhysicalSizeZ" : "0.0",
+        "PhysicalSizeZUnit" : "µm",
+        "Channels" : {
+            "FLIM" : {
+                "Name" : "FLIM740",
+                "SamplesPerPixel": 90,
+                "ExcitationWavelength": 740,
+                "ExcitationWavelengthUnit": "nm"
+            },
+        }
+    }
+
+    writer = OMETIFFWriter(
+        fpath=str(fpath),
+        dimension_order="TYX",
+        array=stack,
+        metadata=metadata_dict,
+        explicit_tiffdata=False)
+
+    writer.write()
+
+
+# All positions in a single chunked OME-Zarr (Zarr v3) array with axes
+# (p, t, y, x), indexed by tile number. Each position is written into its
+# own slab as it completes, so analysis can open the store while acquisition
+# is still running and read single tiles or frame ranges lazily. Chunks are
+# compressed with Blosc/zstd (bit-shuffled, which suits sparse photon counts)
+# by zarr's thread pool. Stage coordinates of each tile are stored alongside
+# in a (p, 3) array, NaN until the tile is written. The arrays are created
+# with the first tile and the stage positions share chunks, so writes from
+# several writer threads (--output-roots) take turns. write_position()
+# returns the tile's image chunk files, so that the journal can check them on
+# --resume (chunks that are all zero are not stored). n_threads limits zarr's
+# thread pool only while this backend is writing. A position cut short (by a
+# cancel or a PMT abort) fills the first frames of its slab and leaves the
+# rest zero; the store holds n_frames frames per position (if not given, as
+# many as the first tile).
+class OMEZarrBackend(OutputBackend):
+    def __init__(
+        self,
+        path,
+        n_positions,
+        pixel_size=PIXEL_SIZE_UM,
+        chunk_yx=512,
+        clevel=3,
+        n_threads=None,
+        n_frames=None,
+    ):
+        try:
+            import zarr
+        except ImportError as e:
+            raise RuntimeError(
+                "OME-Zarr output requires the zarr package "
+                "(install tiled-acquisition[zarr])"
+            ) from e
+        self.__zarr = zarr
+        self.__n_threads = n_threads
+        self.__path = str(path)
+        self.__n_positions = n_positions
+        self.__n_frames = n_frames
+        self.__pixel_size = pixel_size
+        self.__chunk_yx = chunk_yx
+        self.__clevel = clevel
+        self.__lock = threading.Lock()
+        self.__group = zarr.open_group(self.__path, mode="a", zarr_format=3)
+        self.__images = self.__group.get("0")
+        self.__stage_positions = self.__group.get("stage_positions")
+
+    @property
+    def path(self):
+        return self.__path
+
+    def write_position(self, number, event, stack):
+        with self.__lock, self.__threads():
+            if self.__images is None:
+                n_frames = len(stack) if self.__n_frames is None else self.__n_frames
+                self.__create_arrays((n_frames, *stack.shape[1:]))
+            n_frames, height, width = self.__images.shape[1:]
+            if stack.shape[1:] != (height, width) or len(stack) > n_frames:
+                raise ValueError(
+                    f"Stack shape {stack.shape} does not fit store "
+                    f"{self.__images.shape[1:]}"
+                )
+            self.__images[number, : len(stack)] = stack
+            if len(stack) < n_frames:
+                # Clear what an earlier, complete attempt left there
+                self.__images[number, len(stack) :] = 0
+            self.__stage_positions[number] = [
+                np.nan if v is None else v for v in (event.x_pos, event.y_pos, event.z_pos)
+            ]
+        return [path for path in self.__chunk_paths(number) if os.path.exists(path)]
+
+    def __threads(self):
+        if self.__n_threads is None:
+            return contextlib.nullcontext()
+        return self.__zarr.config.set(
+            {
+                "threading.max_workers": self.__n_threads,
+                "codec_pipeline.max_workers": self.__n_threads,
+            }
+        )
+
+    def __chunk_paths(self, number):
+        _, _, n_y, n_x = self.__images.cdata_shape
+        return [
+            os.path.join(
+                self.__path, "0", self.__images.metadata.encode_chunk_key((number, 0, y, x))
+            )
+            for y in range(n_y)
+            for x in range(n_x)
+        ]
+
+    def __create_arrays(self, stack_shape):
+        zarr = self.__zarr
+        n_frames, height, width = stack_shape
+        self.__images = self.__group.create_array(
+            "0",
+            shape=(self.__n_positions, n_frames, height, width),
+            chunks=(1, n_frames, min(height, self.__chunk_yx), min(width, self.__chunk_yx)),
+            dtype="uint16",
+            fill_value=0,
+            compressors=zarr.codecs.BloscCodec(
+                cname="zstd", clevel=self.__clevel, shuffle="bitshuffle"
+            ),
+            dimension_names=("p", "t", "y", "x"),
+        )
+        self.__stage_positions = self.__group.create_array(
+            "stage_positions",
+            shape=(self.__n_positions, 3),
+            chunks=(min(self.__n_positions, STAGE_POSITION_CHUNK), 3),
+            dtype="float64",
+            fill_value=np.nan,
+        )
+        self.__group.attrs["ome"] = {
+            "version": "0.5",
+            "multiscales": [
+                {
+                    "name": os.path.basename(self.__path.rstrip("/\\")),
+                    "axes": [
+                        {"name": "p", "type": "position"},
+                        {"name": "t", "type": "time"},
+                        {"name": "y", "type": "space", "unit": "micrometer"},
+                        {"name": "x", "type": "space", "unit": "micrometer"},
+                    ],
+                    "datasets": [
+                        {
+                            "path": "0",
+                            "coordinateTransformations": [
+                                {
+                                    "type": "scale",
+                                    "scale": [
+                                        1.0,
+                                        1.0,
+                                        self.__pixel_size,
+                                        self.__pixel_size,
+                                    ],
+                                }
+                            ],
+                        }
+                    ],
+                }
+            ],
+        }
@@ -0,0 +1,56 @@
+import threading
+
+import numpy as np
+
+
+# Preallocated uint16 TYX stacks that are reused from position to position.
+# A stack is acquired by the engine while frames stream in and is released by
+# the background writer once the position has been saved, so the pool needs
+# one buffer per position that can be in flight at once. acquire() blocks when
+# all buffers are in use.
+class StackBufferPool:
+    def __init__(self, n_buffers, dtype=np.uint16):
+        if n_buffers < 1:
+            raise ValueError("Need at least one buffer")
+        self.__n_buffers = n_buffers
+        self.__dtype = dtype
+        self.__shape = None
+        self.__free = []
+        self.__n_allocated = 0
+        self.__cond = threading.Condition()
+
+    @property
+    def shape(self):
+        return self.__shape
+
+    @property
+    def in_use(self):
+        return self.__n_allocated - len(self.__free)
+
+    @property
+    def n_buffers(self):
+        return self.__n_buffers
+
+    def acquire(self, shape):
+        shape = tuple(shape)
+        with self.__cond:
+            if shape != self.__shape:
+                # Frame count or resolution changed; wait for outstanding
+                # buffers so that the old ones can be dropped.
+                self.__cond.wait_for(lambda: len(self.__free) == self.__n_allocated)
+                self.__shape = shape
+                self.__free = []
+                self.__n_allocated = 0
+            if not self.__free and self.__n_allocated < self.__n_buffers:
+                self.__n_allocated += 1
+                return np.empty(shape, dtype=self.__dtype)
+            self.__cond.wait_for(lambda: self.__free)
+            return self.__free.pop()
+
+    def release(self, buffer):
+        with self.__cond:
+            if buffer.shape == self.__shape:
+                self.__free.append(buffer)
+            else:
+                self.__n_allocated -= 1
+            self.__cond.notify_all()
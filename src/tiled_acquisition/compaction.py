@@ -0,0 +1,224 @@
+import concurrent.futures
+import functools
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+
+COMPACTION_MANIFEST_NAME = "compaction_manifest.jsonl"
+COMPACTED_SUFFIX = ".zst"
+# The BH-TCSPC files worth compressing; the JSON sidecar is a few kB
+RAW_EXTENSIONS = (".sdt", ".spc")
+DEFAULT_COMPRESSION_LEVEL = 3
+CHUNK_SIZE = 1 << 20
+# Windows: lowers the CPU, I/O and memory priority of the calling process
+PROCESS_MODE_BACKGROUND_BEGIN = 0x00100000
+
+
+class CompactionError(RuntimeError):
+    pass
+
+
+def import_zstandard():
+    try:
+        import zstandard
+    except ImportError as e:
+        raise RuntimeError(
+            "Compressing raw files requires the zstandard package "
+            "(install tiled-acquisition[compression])"
+        ) from e
+    return zstandard
+
+
+def compacted_path(path):
+    return f"{path}{COMPACTED_SUFFIX}"
+
+
+def uncompacted_name(name):
+    # pos_0000.sdt.zst -> pos_0000.sdt; other names are unchanged
+    return name[: -len(COMPACTED_SUFFIX)] if name.endswith(COMPACTED_SUFFIX) else name
+
+
+def lower_priority():
+    # Process pool initializer: compression only gets the CPU and disk time
+    # the acquisition leaves over. On Linux, a niced process's I/O priority
+    # follows its CPU priority unless set otherwise.
+    if sys.platform == "win32":
+        import ctypes
+
+        kernel32 = ctypes.windll.kernel32
+        kernel32.SetPriorityClass(kernel32.GetCurrentProcess(), PROCESS_MODE_BACKGROUND_BEGIN)
+    else:
+        os.nice(19)
+
+
+def file_sha256(f):
+    digest = hashlib.sha256()
+    while chunk := f.read(CHUNK_SIZE):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def compress_file(path, level=DEFAULT_COMPRESSION_LEVEL, remove=True):
+    # Compresses path to path.zst, reads the result back to check that it
+    # decompresses to the same bytes, then (with remove) deletes the original.
+    # The .zst only gets its final name once verified. Returns the record for
+    # the compaction manifest.
+    zstandard = import_zstandard()
+    target = compacted_path(path)
+    partial = f"{target}.tmp"
+    digest = hashlib.sha256()
+    size = 0
+    compressor = zstandard.ZstdCompressor(level=level, write_checksum=True)
+    try:
+        with open(path, "rb") as source, open(partial, "wb") as out:
+            with compressor.stream_writer(
+                out, size=os.path.getsize(path), closefd=False
+            ) as writer:
+                while chunk := source.read(CHUNK_SIZE):
+                    digest.update(chunk)
+                    size += len(chunk)
+                    writer.write(chunk)
+            out.flush()
+            os.fsync(out.fileno())
+        sha256 = digest.hexdigest()
+        with open_compacted(partial) as f:
+            if file_sha256(f) != sha256:
+                raise CompactionError(f"{partial} does not decompress to {path}")
+        os.replace(partial, target)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    if remove:
+        os.remove(path)
+    return {
+        "file": str(path),
+        "compressed": target,
+        "size": size,
+        "compressed_size": os.path.getsize(target),
+        "sha256": sha256,
+    }
+
+
+def open_compacted(path):
+    # Opens a raw file for reading whether or not it has been compacted yet:
+    # path itself, or path.zst (or a .zst given directly) decompressed as it
+    # is read. The decompressing reader reads sequentially and can seek
+    # forwards, but not backwards.
+    path = str(path)
+    if not path.endswith((COMPACTED_SUFFIX, f"{COMPACTED_SUFFIX}.tmp")):
+        if os.path.exists(path) or not os.path.exists(compacted_path(path)):
+            return open(path, "rb")
+        path = compacted_path(path)
+    zstandard = import_zstandard()
+    return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+
+
+def verify_compacted(path, sha256):
+    with open_compacted(path) as f:
+        return file_sha256(f) == sha256
+
+
+def read_compaction_manifest(directory):
+    # {original path: record} of every file compacted
+    path = Path(directory) / COMPACTION_MANIFEST_NAME
+    records = {}
+    if not path.exists():
+        return records
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            records[record["file"]] = record
+    return records
+
+
+# Compresses the raw BH-TCSPC files of saved positions in a pool of
+# low-priority worker processes, and appends a record of each (original and
+# compressed size, SHA-256 of the original) to the compaction manifest once
+# the compressed file has been verified. submit() never blocks; files queue
+# up in the pool if compression falls behind, and stay uncompressed on disk
+# until it catches up. A file that fails is left uncompressed and reported;
+# errors are raised from close(), after everything else has been done.
+class Compactor:
+    def __init__(
+        self, manifest, n_workers=1, level=DEFAULT_COMPRESSION_LEVEL, remove=True, context="spawn"
+    ):
+        import_zstandard()
+        self.__level = level
+        self.__remove = remove
+        self.__pool = concurrent.futures.ProcessPoolExecutor(
+            n_workers,
+            mp_context=multiprocessing.get_context(context),
+            initializer=lower_priority,
+        )
+        self.__lock = threading.Lock()
+        self.__file = open(manifest, "a", encoding="utf-8")
+        self.__pending = 0
+        self.__files = 0
+        self.__bytes_in = 0
+        self.__bytes_out = 0
+        self.__errors = []
+
+    @property
+    def pending(self):
+        return self.__pending
+
+    def submit(self, number, paths):
+        for path in paths:
+            with self.__lock:
+                self.__pending += 1
+            future = self.__pool.submit(compress_file, str(path), self.__level, self.__remove)
+            future.add_done_callback(functools.partial(self.__done, number))
+
+    def summary(self):
+        with self.__lock:
+            return {
+                "files": self.__files,
+                "pending": self.__pending,
+                "failed": len(self.__errors),
+                "bytes_in": self.__bytes_in,
+                "bytes_out": self.__bytes_out,
+                "ratio": self.__bytes_in / self.__bytes_out if self.__bytes_out else None,
+            }
+
+    def close(self):
+        if self.__file is None:
+            return
+        self.__pool.shutdown(wait=True)
+        self.__file.close()
+        self.__file = None
+        if self.__errors:
+            first = self.__errors[0]
+            raise CompactionError(
+                f"{len(self.__errors)} file(s) could not be compressed; first error: {first!r}"
+            ) from first
+
+    def __done(self, number, future):
+        # On the pool's management thread
+        with self.__lock:
+            self.__pending -= 1
+            try:
+                record = future.result()
+            except Exception as e:
+                self.__errors.append(e)
+                print(
+                    f"Warning: compressing a file of position {number} failed: {e!r}",
+                    file=sys.stderr,
+                )
+                return
+            self.__files += 1
+            self.__bytes_in += record["size"]
+            self.__bytes_out += record["compressed_size"]
+            record.update(number=number, time=time.time())
+            self.__file.write(json.dumps(record) + "\n")
+            self.__file.flush()
+            os.fsync(self.__file.fileno())
@@ -0,0 +1,161 @@
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+from .journal import read_journal
+from .tracing import TRACE_SUMMARY_NAME, read_trace_summary
+
+
+# Rough figures for the SLIM rig, used when no previous run is given as a
+# profile; a profile from a run with the same settings is far better
+REFERENCE_RESOLUTION = 256
+DEFAULT_FRAME_TIME = 1.0  # s per frame at the reference resolution
+DEFAULT_POSITION_OVERHEAD = 0.5  # s per position besides scanning and travel
+SDT_TIME_BINS = 256
+DEFAULT_PHOTONS_PER_PIXEL = 0.1  # per frame; sets the size of SPC files
+SPC_BYTES_PER_PHOTON = 4
+# Bytes per file at the reference resolution and one frame
+DEFAULT_FILE_SIZES = {
+    "sdt": REFERENCE_RESOLUTION**2 * SDT_TIME_BINS * 2 + 16384,
+    "spc": round(REFERENCE_RESOLUTION**2 * DEFAULT_PHOTONS_PER_PIXEL * SPC_BYTES_PER_PHOTON),
+    "json": 4096,
+    "tif": REFERENCE_RESOLUTION**2 * 2 + 16384,
+}
+# How each file's size scales: exponents of (pixels, frames). The SDT holds
+# one decay histogram per pixel however many frames are accumulated; photon
+# streams and image stacks grow with both.
+FILE_SCALING = {"sdt": (1, 0), "spc": (1, 1), "json": (0, 0), "tif": (1, 1), "zarr": (1, 1)}
+
+
+def format_duration(seconds):
+    if seconds < 120:
+        return f"{seconds:.1f} s"
+    if seconds < 2 * 3600:
+        return f"{seconds / 60:.1f} min"
+    if seconds < 2 * 86400:
+        return f"{seconds / 3600:.1f} h"
+    return f"{seconds / 86400:.1f} days"
+
+
+def format_bytes(n):
+    for unit in ("B", "kB", "MB", "GB"):
+        if abs(n) < 1000:
+            return f"{n:.1f} {unit}" if unit != "B" else f"{n:.0f} B"
+        n /= 1000
+    return f"{n:.1f} TB"
+
+
+# Per-position costs for estimating a run, scaled to the frame count and
+# resolution being planned: the time per frame, the fixed time per position
+# besides scanning and stage travel, and the size of each kind of file. By
+# default rough constants; from_run() takes them from a previous
+# acquisition's save directory (frame and setup times from its trace
+# summary, file sizes from its journal).
+class TimingProfile:
+    def __init__(
+        self,
+        frame_time=DEFAULT_FRAME_TIME,
+        position_overhead=DEFAULT_POSITION_OVERHEAD,
+        file_sizes=None,
+        frames=1,
+        resolution=REFERENCE_RESOLUTION,
+        source="built-in defaults",
+    ):
+        self.frame_time = frame_time
+        self.position_overhead = position_overhead
+        self.file_sizes = dict(DEFAULT_FILE_SIZES if file_sizes is None else file_sizes)
+        self.frames = frames
+        self.resolution = resolution
+        self.source = source
+
+    @classmethod
+    def from_run(cls, directory):
+        summary = read_trace_summary(Path(directory) / TRACE_SUMMARY_NAME)
+        starts, positions = read_journal(directory)
+        if summary is None and not positions:
+            raise ValueError(f"{directory} has no trace summary or journal to take a profile from")
+        start = starts[-1] if starts else {}
+        frames = start.get("frames", 1)
+        resolution = start.get("resolution", REFERENCE_RESOLUTION)
+        phases = (summary or {}).get("phases", {})
+
+        frame_time = DEFAULT_FRAME_TIME * (resolution / REFERENCE_RESOLUTION) ** 2
+        if "frame" in phases:
+            frame_time = phases["frame"]["p50_ms"] / 1e3
+        overhead = DEFAULT_POSITION_OVERHEAD
+        per_position = ((summary or {}).get("throughput") or {}).get("seconds_per_position")
+        if per_position:
+            # Stage moves are estimated separately, from the planned path
+            move = phases.get("stage_move", {}).get("p50_ms", 0.0) / 1e3
+            overhead = max(0.0, per_position - frames * frame_time - move)
+
+        sizes = {}
+        for record in positions.values():
+            for path, size in record["files"].items():
+                sizes.setdefault(Path(path).suffix.lstrip(".").lower(), []).append(size)
+        # Measured sizes replace the defaults at the profile's own settings
+        pixel_ratio = (resolution / REFERENCE_RESOLUTION) ** 2
+        file_sizes = {
+            ext: size * pixel_ratio ** FILE_SCALING[ext][0] * frames ** FILE_SCALING[ext][1]
+            for ext, size in DEFAULT_FILE_SIZES.items()
+        }
+        file_sizes.update(
+            {ext: float(np.median(s)) for ext, s in sizes.items() if ext in FILE_SCALING}
+        )
+        return cls(frame_time, overhead, file_sizes, frames, resolution, str(directory))
+
+    def frame_time_for(self, resolution):
+        return self.frame_time * (resolution / self.resolution) ** 2
+
+    def position_time(self, frames, resolution):
+        return frames * self.frame_time_for(resolution) + self.position_overhead
+
+    def file_size(self, ext, frames, resolution):
+        pixels, frame_power = FILE_SCALING[ext]
+        size = self.file_sizes.get(ext, self.file_sizes.get("tif", 0))
+        scale = (resolution / self.resolution) ** (2 * pixels) * (frames / self.frames) ** frame_power
+        return size * scale
+
+
+def output_files(args):
+    # (directory, extension, share of the tiles) of each file written per
+    # position; tiles spread over --output-roots split evenly between them
+    files = []
+    save = str(args.save).rstrip("/\\") if args.save is not None else None
+    if save is None:
+        return files
+    roots = [save, *(str(root).rstrip("/\\") for root in args.output_roots)]
+    share = 1 / len(roots)
+    for root in roots:
+        if args.config:
+            files.extend((root, ext, share) for ext in ("sdt", "spc", "json"))
+        if args.output == "ome-tiff":
+            image_dir = args.image_dir if args.image_dir and root == save else f"{root}_tif"
+            files.append((image_dir, "tif", share))
+    if args.output == "ome-zarr":
+        # Uncompressed size; Blosc usually does much better on photon counts
+        files.append((args.image_dir or f"{save}.ome.zarr", "zarr", 1))
+    return files
+
+
+def existing_ancestor(path):
+    path = Path(path).absolute()
+    while not path.exists() and path != path.parent:
+        path = path.parent
+    return path
+
+
+def disk_requirements(needed):
+    # Groups {directory: bytes} by the volume each directory will be on;
+    # returns [(a directory on it, bytes needed, bytes free)]
+    volumes = {}
+    for directory, n in needed.items():
+        anchor = existing_ancestor(directory)
+        device = os.stat(anchor).st_dev
+        if device in volumes:
+            volumes[device][1] += n
+        else:
+            volumes[device] = [str(anchor), n]
+    return [(anchor, n, shutil.disk_usage(anchor).free) for anchor, n in volumes.values()]
@@ -0,0 +1,414 @@
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+from pymmcore_plus.mda import MDAEngine
+from useq import MDAEvent
+
+from .buffers import StackBufferPool
+from .compaction import RAW_EXTENSIONS
+from .eta import ThroughputEstimator
+from .shared_frames import FrameWorkerError
+from .main import (
+    create_tile_config,
+    make_sdt_prefix,
+    rename_sdt_files,
+    save_position,
+    set_aside_sdt_files,
+    set_sdt_filename,
+    write_frame_statistics,
+)
+from .stage import StageMoveTimer, start_move
+from .tracing import TRACE_SUMMARY_NAME, TraceRecorder
+from .writer import BackgroundWriterError
+
+
+def sub_events(event):
+    # With hardware sequencing, the runner hands us a SequencedEvent wrapping
+    # the per-frame events; otherwise a plain MDAEvent.
+    return getattr(event, "events", None) or (event,)
+
+
+# Custom acquisition engine to add PMT overload checking
+class PMTCheckingEngine(MDAEngine):
+    def __init__(
+        self,
+        mmc,
+        args,
+        writer,
+        detector,
+        backend,
+        position_numbers=None,
+        journal=None,
+        tracer=None,
+        estimator=None,
+        autofocus=None,
+        frame_workers=None,
+        pmt=None,
+        placer=None,
+        compactor=None,
+    ):
+        super().__init__(mmc)
+        self.__args = args
+        self.__writer = writer
+        self.__detector = detector
+        self.__backend = backend
+        self.__journal = journal
+        # Maps the sequence's position index to the tile number (CSV row)
+        self.__position_numbers = position_numbers
+        # One stack being filled, plus every stack the writer may hold: up to
+        # max_pending waiting and one being saved, per writer thread
+        self.__buffers = StackBufferPool(max(writer.threads, 1) * (writer.max_pending + 1) + 1)
+        # With frame workers, stacks are acquired into the shared ring when a
+        # slot is free, and into the buffer pool otherwise
+        self.__frame_workers = frame_workers
+        self.__ring = frame_workers.ring if frame_workers is not None else None
+        self.__ring_fallbacks = 0
+        self.__saved_lock = threading.Lock()
+        self.__attempts = {}
+        self.__retry_event = None
+        self.__next_event = None
+        self.__stage_timer = StageMoveTimer()
+        self.__tracer = tracer if tracer is not None else TraceRecorder()
+        self.__estimator = estimator if estimator is not None else ThroughputEstimator()
+        self.__autofocus = autofocus
+        self.__pmt = pmt
+        # Chooses each tile's output root when tiles are striped
+        self.__placer = placer
+        # Compresses raw files once their position is in the journal
+        self.__compactor = compactor
+        # Planned (uncorrected) Z of each position, by sequence index
+        self.__planned_z = {}
+        self.__focused = set()
+        self.__move_issued = None
+        # Z of the position being acquired once drift-corrected or autofocused
+        self.__acquired_z = None
+        # Progress, read by status() from the status server's thread
+        self.__current = None
+        self.__frames_done = 0
+        self.__n_frames = 0
+        self.__positions_done = 0
+        self.__pmt_resets = 0
+        self.__bytes_written = 0
+
+    @property
+    def stage_timer(self):
+        return self.__stage_timer
+
+    @property
+    def tracer(self):
+        return self.__tracer
+
+    @property
+    def estimator(self):
+        return self.__estimator
+
+    def write_status(self, path):
+        self.__tracer.write_summary(path, throughput=self.__estimator.summary())
+
+    def status(self):
+        position, attempt = self.__current or (None, None)
+        return {
+            "time": time.time(),
+            "position": position,
+            "attempt": attempt,
+            "frames_done": self.__frames_done,
+            "frames_per_position": self.__n_frames,
+            "positions_completed": self.__positions_done,
+            "pmt_resets": self.__pmt_resets,
+            "write_queue": self.__writer.pending,
+            "write_queue_max": self.__writer.max_pending,
+            "buffers_in_use": self.__buffers.in_use,
+            "ring_slots_in_use": None if self.__ring is None else self.__ring.in_use,
+            "ring_fallbacks": self.__ring_fallbacks,
+            "frame_worker_queue": (
+                None if self.__frame_workers is None else self.__frame_workers.pending
+            ),
+            "bytes_written": self.__bytes_written,
+            "phases": self.__tracer.summary(),
+            "throughput": self.__estimator.summary(),
+            "autofocus": None if self.__autofocus is None else self.__autofocus.summary(),
+            "pmt": None if self.__pmt is None else self.__pmt.summary(),
+            "volumes": None if self.__placer is None else self.__placer.summary(),
+            "compaction": None if self.__compactor is None else self.__compactor.summary(),
+        }
+
+    def event_iterator(self, events):
+        # Look one event ahead so that the move to the next position can be
+        # started early. Positions aborted because of PMT shut-off are re-run
+        # immediately, before moving on to the next position.
+        upcoming = iter(super().event_iterator(events))
+        event = next(upcoming, None)
+        while event is not None:
+            self.__next_event = next(upcoming, None)
+            yield event
+            while self.__retry_event is not None:
+                retry_event, self.__retry_event = self.__retry_event, None
+                yield retry_event
+            event = self.__next_event
+
+    def setup_event(self, event: MDAEvent):
+        start = time.perf_counter_ns()
+        started = self.__stage_timer.setup_started()
+        corrected = self.__drift_corrected(event)
+        super().setup_event(corrected)
+        self.__stage_timer.setup_finished(started)
+        # The Z the tile is actually taken at, for the journal and backends
+        self.__acquired_z = sub_events(corrected)[0].z_pos
+        end = time.perf_counter_ns()
+        # The stage move runs from when it was issued (early, if prefetched)
+        # until setup_event has waited for it
+        move_start = self.__move_issued if self.__move_issued is not None else start
+        self.__move_issued = None
+        position = sub_events(event)[0].index.get("p")
+        number = self.__number(position)
+        self.__tracer.record("setup_event", start, end, number)
+        self.__tracer.record("stage_move", move_start, end, number)
+        if (
+            self.__autofocus is not None
+            and position not in self.__focused
+            and self.__autofocus.due(position)
+        ):
+            self.__focused.add(position)
+            with self.__tracer.span("autofocus", number):
+                best = self.__autofocus.measure(self.__planned_z.get(position), number)
+            if best is not None:
+                self.__acquired_z = best
+
+    def exec_event(self, event: MDAEvent):
+        first_event = sub_events(event)[0]
+        if self.__acquired_z is not None and self.__acquired_z != first_event.z_pos:
+            first_event = first_event.model_copy(update={"z_pos": self.__acquired_z})
+        n_frames = len(sub_events(event))
+        position = first_event.index["p"]
+        attempt = self.__attempts.get(position, 0)
+        self.__attempts[position] = attempt + 1
+        can_retry = attempt < self.__args.pmt_retries
+
+        number = self.__number(position)
+        self.__current = (number, attempt + 1)
+        self.__frames_done = 0
+        self.__n_frames = n_frames
+        root = self.__placer.place(number) if self.__placer is not None else None
+        sdt_prefix = make_sdt_prefix(self.__args, number, root)
+        set_sdt_filename(self.mmcore, sdt_prefix,self.__args)
+
+        # Consume frames one at a time into a reused TYX stack, checking each
+        # for PMT shut-off as it arrives. Payloads are passed through to the
+        # runner (including any cancel signal it sends back).
+        stack = None
+        slot = None
+        count = 0
+        shut_off_frame = None
+        frames = super().exec_event(event)
+        signal = None
+        frame_start = time.perf_counter_ns()
+        while True:
+            try:
+                payload = frames.send(signal)
+            except StopIteration:
+                break
+            if payload is not None:
+                frame_end = time.perf_counter_ns()
+                self.__tracer.record("frame", frame_start, frame_end, number)
+                frame_start = frame_end
+                image = payload[0]
+                if stack is None:
+                    stack, slot = self.__acquire_stack((n_frames, *image.shape))
+                if count < n_frames:
+                    np.copyto(stack[count], image, casting="unsafe")
+                    if shut_off_frame is None and self.__detector.frame_is_shut_off(
+                        stack, count
+                    ):
+                        shut_off_frame = count
+                    count += 1
+                    self.__frames_done = count
+                    if count == n_frames and not (
+                        shut_off_frame is not None and can_retry
+                    ):
+                        self.__prefetch_next_move()
+            signal = yield payload
+            if shut_off_frame is not None and can_retry:
+                self.__abort_sequence(frames)
+                break
+
+        if shut_off_frame is not None and can_retry:
+            if stack is not None:
+                self.__release_stack(stack, slot)
+            # Now, not on the writer: the retry writes files of the same names
+            set_aside_sdt_files(self.__args, sdt_prefix, attempt)
+            print(
+                f"PMT shut off at frame {shut_off_frame} of position {number} at (x, y) = ({first_event.x_pos}, {first_event.y_pos}); "
+                f"resetting PMT and retrying (attempt {attempt + 2} of {self.__args.pmt_retries + 1})",
+                file=sys.stderr,
+            )
+            self.__reset_pmt(number)
+            self.__retry_event = event
+            return
+
+        if stack is None:
+            print(f"No frames acquired at position {number}", file=sys.stderr)
+            return
+
+        # Saving happens on the writer thread; this blocks only if the writer
+        # has fallen behind by more than --write-queue positions. Each output
+        # root has its own writer thread, so that no two write to one volume.
+        lane = self.__placer.roots.index(root) if root is not None else 0
+        try:
+            if self.__ring is not None:
+                self.__writer.submit(
+                    self.__save_in_worker, sdt_prefix, number, first_event, stack, slot, count,
+                    lane=lane,
+                )
+            else:
+                self.__writer.submit(
+                    self.__save_and_release, sdt_prefix, number, first_event, stack, count,
+                    lane=lane,
+                )
+        except BackgroundWriterError:
+            # Refused (closed, or an earlier write failed) before the job ran
+            self.__release_stack(stack, slot)
+            raise
+
+        if shut_off_frame is not None:
+            print(
+                f"Resetting PMT at position {number} at (x, y) = ({first_event.x_pos}, {first_event.y_pos}); "
+                "no retries left, keeping tile",
+                file=sys.stderr,
+            )
+            self.__reset_pmt(number)
+
+    def __reset_pmt(self, number):
+        with self.__tracer.span("pmt_reset", number):
+            if self.__pmt is not None:
+                self.__pmt.reset(number)
+        self.__pmt_resets += 1
+
+    def __number(self, position):
+        if position is None or self.__position_numbers is None:
+            return position
+        return int(self.__position_numbers[position])
+
+    def __drift_corrected(self, event):
+        # The event with the drift model's current prediction added to its
+        # planned Z; applied when the event is set up or its move prefetched,
+        # so that it includes the latest autofocus measurement
+        first = sub_events(event)[0]
+        if self.__autofocus is None or first.z_pos is None:
+            return event
+        planned = self.__planned_z.setdefault(first.index.get("p"), first.z_pos)
+        update = {"z_pos": planned + self.__autofocus.offset()}
+        if getattr(event, "events", None):
+            update["events"] = tuple(e.model_copy(update=update) for e in event.events)
+        return event.model_copy(update=update)
+
+    def __prefetch_next_move(self):
+        if not self.__args.prefetch_moves or self.__next_event is None:
+            return
+        self.__move_issued = time.perf_counter_ns()
+        start_move(self.mmcore, sub_events(self.__drift_corrected(self.__next_event))[0])
+        self.__stage_timer.move_issued()
+
+    def __acquire_stack(self, shape):
+        # Returns the stack and its ring slot, or None if it is not in the ring
+        if self.__ring is not None and self.__ring.fits(shape):
+            slot = self.__ring.acquire()
+            if slot is not None:
+                return self.__ring.slot(slot)[: shape[0]], slot
+            self.__ring_fallbacks += 1
+        return self.__buffers.acquire(shape), None
+
+    def __release_stack(self, stack, slot):
+        if slot is None:
+            self.__buffers.release(stack)
+        else:
+            self.__ring.release(slot)
+
+    def __abort_sequence(self, frames):
+        core = self.mmcore
+        if core.isSequenceRunning():
+            core.stopSequenceAcquisition()
+        frames.close()
+        core.clearCircularBuffer()
+
+    def __save_and_release(self, prefix, number, event, stack, count):
+        try:
+            files = save_position(
+                self.__args,
+                prefix,
+                number,
+                event,
+                stack[:count],
+                self.__detector,
+                self.__backend,
+                self.__tracer,
+            )
+        finally:
+            self.__buffers.release(stack)
+        self.__position_saved(prefix, number, event, files, count)
+
+    def __save_in_worker(self, prefix, number, event, stack, slot, count):
+        # On the writer thread: the SDT files and tile config are handled
+        # here, the stack by a frame worker
+        if not self.__ring.fits(stack.shape):
+            # The ring is sized from the camera at the start; there is no
+            # backend here to save a stack that does not fit
+            self.__buffers.release(stack)
+            raise FrameWorkerError(
+                f"Position {number}'s stack of shape {stack.shape} does not fit the "
+                f"frame workers' shared memory of shape {self.__ring.shape}; "
+                "did the image size change?"
+            )
+        with self.__tracer.span("rename_sdt_files", number):
+            files = rename_sdt_files(self.__args, prefix)
+        with self.__tracer.span("create_tile_config", number):
+            create_tile_config(self.__args, prefix, event)
+        if slot is None:
+            # Acquired while the ring was full; copy it over once a slot is free
+            try:
+                with self.__tracer.span("ring_wait", number):
+                    slot = self.__ring.acquire(timeout=None)
+                np.copyto(self.__ring.slot(slot)[:count], stack[:count])
+            finally:
+                self.__buffers.release(stack)
+        self.__frame_workers.submit(
+            slot,
+            number,
+            count,
+            event,
+            lambda result: self.__worker_saved(prefix, number, event, files, count, result),
+        )
+
+    def __worker_saved(self, prefix, number, event, files, count, result):
+        # On the frame workers' collector thread
+        for phase, start, end in result["spans"]:
+            self.__tracer.record(phase, start, end, number)
+            if phase == "image_write" and self.__placer is not None:
+                nbytes = sum(os.path.getsize(f) for f in result["files"])
+                self.__placer.observe(number, nbytes, (end - start) / 1e9)
+        if result["statistics"] is not None:
+            write_frame_statistics(self.__args, number, result["statistics"])
+        self.__position_saved(prefix, number, event, files + result["files"], count)
+
+    def __position_saved(self, prefix, number, event, files, count):
+        sizes = {f: os.path.getsize(f) for f in files}
+        # With frame workers, positions finish on the collector thread as
+        # well as the writer thread
+        with self.__saved_lock:
+            if self.__journal is not None:
+                with self.__tracer.span("journal", number):
+                    # A position cut short (cancelled, frames dropped) is
+                    # saved, but recorded with its frame count so that
+                    # --resume acquires it again
+                    self.__journal.record_position(number, prefix, event, sizes, count)
+            self.__estimator.observe(time.time(), sum(sizes.values()))
+            self.__positions_done += 1
+            self.__bytes_written += sum(sizes.values())
+            if self.__placer is not None:
+                self.__placer.finished(number, sum(sizes.values()))
+            if self.__compactor is not None:
+                self.__compactor.submit(number, [f for f in files if f.endswith(RAW_EXTENSIONS)])
+            if self.__args.save is not None:
+                self.write_status(f"{self.__args.save}/{TRACE_SUMMARY_NAME}")
@@ -0,0 +1,158 @@
+import time
+from collections import deque
+
+import numpy as np
+
+
+# Scales the median absolute deviation to a standard deviation for normal data
+MAD_SCALE = 1.4826
+
+
+# Learns the time per position from completion times, for ETAs and stall
+# alerts. Intervals between completions are smoothed with an EWMA; an interval
+# far from the recent median (a PMT reset, a pause, a restart) is left out of
+# the EWMA but kept in the window, so a lasting change in pace is picked up
+# once it becomes the median. The stall threshold is set from the spread of
+# the recent intervals instead of a fixed multiple of a guessed time.
+#
+# Completions can come from a FolderIndex (follow_index) or from the engine,
+# which calls observe() as each position is saved.
+class ThroughputEstimator:
+    def __init__(
+        self,
+        total=None,
+        initial_interval=None,
+        alpha=0.2,
+        outlier_mads=5.0,
+        stall_mads=6.0,
+        stall_factor=1.5,
+        window=200,
+        min_samples=5,
+        started=None,
+    ):
+        self.total = total
+        self.__initial_interval = initial_interval
+        self.__alpha = alpha
+        self.__outlier_mads = outlier_mads
+        self.__stall_mads = stall_mads
+        self.__stall_factor = stall_factor
+        self.__min_samples = min_samples
+        self.__intervals = deque(maxlen=window)
+        self.__interval = None
+        self.__bytes_per_second = None
+        self.__last = None
+        # Until the first completion, a stall is measured from here
+        self.__started = time.time() if started is None else started
+        self.count = 0
+        self.rejected = 0
+
+    @property
+    def last_completed(self):
+        return self.__last
+
+    @property
+    def interval(self):
+        # Estimated seconds per position
+        return self.__interval if self.__interval is not None else self.__initial_interval
+
+    @property
+    def tiles_per_hour(self):
+        interval = self.interval
+        return 3600.0 / interval if interval else None
+
+    @property
+    def bytes_per_second(self):
+        return self.__bytes_per_second
+
+    def observe(self, completed_time=None, nbytes=None):
+        # Returns False if the interval since the previous completion was
+        # rejected as an outlier
+        if completed_time is None:
+            completed_time = time.time()
+        self.count += 1
+        previous, self.__last = self.__last, completed_time
+        if previous is None:
+            return True
+        interval = completed_time - previous
+        if interval <= 0:
+            return True
+        accepted = not self.__is_outlier(interval)
+        self.__intervals.append(interval)
+        if not accepted:
+            self.rejected += 1
+            return False
+        self.__interval = self.__ewma(self.__interval, interval)
+        if nbytes is not None:
+            self.__bytes_per_second = self.__ewma(
+                self.__bytes_per_second, nbytes / interval
+            )
+        return True
+
+    def observe_many(self, completed_times):
+        for t in sorted(completed_times):
+            self.observe(t)
+
+    def follow_index(self, index):
+        # Learn from the files a FolderIndex has already completed, then from
+        # each new one as it completes
+        self.observe_many(index.completion_times())
+        index.add_listener(lambda name, size, completed_time: self.observe(completed_time, size))
+
+    def remaining(self, completed=None):
+        if self.total is None:
+            return None
+        return max(self.total - (self.count if completed is None else completed), 0)
+
+    def eta_seconds(self, completed=None):
+        remaining, interval = self.remaining(completed), self.interval
+        if remaining is None or interval is None:
+            return None
+        return remaining * interval
+
+    def stall_threshold(self):
+        # Seconds without a completion after which acquisition looks stalled
+        if len(self.__intervals) < self.__min_samples:
+            interval = self.interval
+            return self.__stall_factor * interval if interval else None
+        median, spread = self.__median_and_spread()
+        return max(self.__stall_factor * median, median + self.__stall_mads * spread)
+
+    def is_stalled(self, now=None):
+        threshold = self.stall_threshold()
+        if threshold is None:
+            return False
+        last = self.__started if self.__last is None else self.__last
+        return (time.time() if now is None else now) - last > threshold
+
+    def summary(self, now=None, completed=None):
+        return {
+            "completed": self.count if completed is None else completed,
+            "total": self.total,
+            "seconds_per_position": self.interval,
+            "tiles_per_hour": self.tiles_per_hour,
+            "mb_per_second": (
+                None if self.__bytes_per_second is None else self.__bytes_per_second / 1e6
+            ),
+            "eta_seconds": self.eta_seconds(completed),
+            "stall_threshold_seconds": self.stall_threshold(),
+            "stalled": self.is_stalled(now),
+            "rejected_intervals": self.rejected,
+        }
+
+    def __ewma(self, current, value):
+        if current is None:
+            return value
+        return current + self.__alpha * (value - current)
+
+    def __median_and_spread(self):
+        intervals = np.fromiter(self.__intervals, dtype=float)
+        median = float(np.median(intervals))
+        spread = MAD_SCALE * float(np.median(np.abs(intervals - median)))
+        # Identical intervals (e.g. simulated) would make any deviation an outlier
+        return median, max(spread, 0.05 * median)
+
+    def __is_outlier(self, interval):
+        if len(self.__intervals) < self.__min_samples:
+            return False
+        median, spread = self.__median_and_spread()
+        return abs(interval - median) > self.__outlier_mads * spread
@@ -0,0 +1,317 @@
+import numpy as np
+
+
+MODELS = ("plane", "poly2", "poly3", "tps", "piecewise")
+ROBUST_METHODS = ("huber", "ransac", "none")
+
+HUBER_K = 1.345
+MAD_SCALE = 1.4826
+EVAL_CHUNK = 2048
+# The piecewise model interpolates only focus points with at least this
+# weight; a Huber weight of 0.5 is a residual of 2.7 robust standard deviations
+PIECEWISE_MIN_WEIGHT = 0.5
+
+
+# Focus surfaces z = f(x, y) fitted to the focus points of a position list and
+# evaluated at every position at once. Coordinates are centred and scaled
+# before fitting so that the polynomial and spline systems stay well
+# conditioned with stage coordinates in the tens of thousands of microns.
+# Every model accepts per-point weights, which the robust fitting uses to
+# down-weight bad focus points.
+class SurfaceModel:
+    min_points = 3
+
+    def fit(self, xy, z, weights=None):
+        raise NotImplementedError
+
+    def predict(self, xy):
+        raise NotImplementedError
+
+    def fitted_values(self, xy):
+        # The model at the points it was last fitted to
+        return self.predict(xy)
+
+
+class _Normalization:
+    def __init__(self, xy):
+        self.center = xy.mean(axis=0)
+        self.scale = max(float(np.ptp(xy, axis=0).max()), 1e-9) / 2
+
+    def __call__(self, xy):
+        return (np.asarray(xy, dtype=float) - self.center) / self.scale
+
+
+def polynomial_terms(uv, degree):
+    # Columns u^i v^j for i + j <= degree
+    u, v = uv[:, 0], uv[:, 1]
+    return np.column_stack(
+        [u**i * v ** (d - i) for d in range(degree + 1) for i in range(d + 1)]
+    )
+
+
+class PolynomialModel(SurfaceModel):
+    def __init__(self, degree=1):
+        self.degree = degree
+        self.min_points = (degree + 1) * (degree + 2) // 2
+
+    def fit(self, xy, z, weights=None):
+        self.__norm = _Normalization(xy)
+        A = polynomial_terms(self.__norm(xy), self.degree)
+        sw = np.ones(len(z)) if weights is None else np.sqrt(weights)
+        self.__coeffs = np.linalg.lstsq(A * sw[:, None], z * sw, rcond=None)[0]
+        return self
+
+    def predict(self, xy):
+        return polynomial_terms(self.__norm(xy), self.degree) @ self.__coeffs
+
+
+def _tps_kernel(r2):
+    # r^2 log r, written in terms of r^2 (and 0 at r = 0); overwrites r2
+    log = np.log(np.maximum(r2, np.finfo(float).tiny))
+    r2 *= log
+    r2 *= 0.5
+    return r2
+
+
+def _squared_distances(a, b):
+    d = a @ b.T
+    d *= -2
+    d += (a**2).sum(axis=1)[:, None]
+    d += (b**2).sum(axis=1)[None, :]
+    return np.maximum(d, 0.0, out=d)
+
+
+# Thin-plate spline: interpolates the focus points exactly when smoothing is
+# 0, and approaches the least-squares plane as smoothing grows. Refitting the
+# same points with new weights (as the Huber fitting does) reuses the kernel
+# matrix, so only the linear solve is repeated.
+class ThinPlateSplineModel(SurfaceModel):
+    def __init__(self, smoothing=1e-3):
+        self.smoothing = smoothing
+        self.__xy = None
+
+    def fit(self, xy, z, weights=None):
+        if xy is not self.__xy:
+            self.__xy = xy
+            self.__norm = _Normalization(xy)
+            self.__centers = self.__norm(xy)
+            self.__kernel = _tps_kernel(_squared_distances(self.__centers, self.__centers))
+            self.__terms = polynomial_terms(self.__centers, 1)
+        n = len(z)
+        w = np.ones(n) if weights is None else np.maximum(weights, 1e-6)
+        P = self.__terms
+        system = np.block([[self.__kernel, P], [P.T, np.zeros((3, 3))]])
+        system[np.arange(n), np.arange(n)] += self.smoothing / w
+        rhs = np.concatenate([z, np.zeros(3)])
+        try:
+            solution = np.linalg.solve(system, rhs)
+        except np.linalg.LinAlgError:
+            # Coincident or collinear focus points
+            solution = np.linalg.lstsq(system, rhs, rcond=None)[0]
+        self.__weights, self.__affine = solution[:n], solution[n:]
+        return self
+
+    def fitted_values(self, xy):
+        if xy is not self.__xy:
+            return self.predict(xy)
+        return self.__kernel @ self.__weights + self.__terms @ self.__affine
+
+    def predict(self, xy):
+        uv = self.__norm(xy)
+        z = polynomial_terms(uv, 1) @ self.__affine
+        for start in range(0, len(uv), EVAL_CHUNK):
+            chunk = uv[start : start + EVAL_CHUNK]
+            z[start : start + EVAL_CHUNK] += (
+                _tps_kernel(_squared_distances(chunk, self.__centers)) @ self.__weights
+            )
+        return z
+
+
+# Linear interpolation over the Delaunay triangulation of the focus points;
+# positions outside their convex hull get the best-fit plane. With weights,
+# only points weighted at least PIECEWISE_MIN_WEIGHT are interpolated (all of
+# them if fewer than 3 are). Requires scipy.
+class PiecewiseLinearModel(SurfaceModel):
+    def fit(self, xy, z, weights=None):
+        try:
+            from scipy.interpolate import LinearNDInterpolator
+        except ImportError as e:
+            raise RuntimeError("The piecewise model requires scipy") from e
+        if weights is not None:
+            keep = weights >= PIECEWISE_MIN_WEIGHT
+            if keep.sum() >= self.min_points:
+                xy, z, weights = xy[keep], z[keep], weights[keep]
+        self.__norm = _Normalization(xy)
+        self.__interpolator = LinearNDInterpolator(self.__norm(xy), z)
+        self.__plane = PolynomialModel(1).fit(xy, z, weights)
+        return self
+
+    def predict(self, xy):
+        z = self.__interpolator(self.__norm(xy))
+        outside = np.isnan(z)
+        if outside.any():
+            z[outside] = self.__plane.predict(np.asarray(xy, dtype=float)[outside])
+        return z
+
+
+def make_model(name):
+    if name == "plane":
+        return PolynomialModel(1)
+    if name == "poly2":
+        return PolynomialModel(2)
+    if name == "poly3":
+        return PolynomialModel(3)
+    if name == "tps":
+        return ThinPlateSplineModel()
+    if name == "piecewise":
+        return PiecewiseLinearModel()
+    raise ValueError(f"Unknown focus map model: {name}")
+
+
+def robust_scale(residuals):
+    return max(MAD_SCALE * float(np.median(np.abs(residuals - np.median(residuals)))), 1e-9)
+
+
+def fit_huber(model, xy, z, iterations=20, k=HUBER_K):
+    # Iteratively reweighted least squares with Huber weights
+    weights = np.ones(len(z))
+    for _ in range(iterations):
+        model.fit(xy, z, weights)
+        residuals = z - model.fitted_values(xy)
+        scale = robust_scale(residuals)
+        new_weights = np.minimum(1.0, k * scale / np.maximum(np.abs(residuals), 1e-12))
+        if np.allclose(new_weights, weights, atol=1e-4):
+            break
+        weights = new_weights
+    return model, weights
+
+
+def fit_huber_piecewise(xy, z, k=HUBER_K):
+    # An interpolant has no residuals at its own points to reweight, so the
+    # Huber weights come from the cubic surface (or the plane, for too few
+    # points), and points it weights below PIECEWISE_MIN_WEIGHT are dropped
+    reference = PolynomialModel(3)
+    if len(z) <= 2 * reference.min_points:
+        reference = PolynomialModel(1)
+    _, weights = fit_huber(reference, xy, z, k=k)
+    model = PiecewiseLinearModel().fit(xy, z, weights)
+    keep = weights >= PIECEWISE_MIN_WEIGHT
+    return model, (keep if keep.sum() >= model.min_points else weights > 0).astype(float)
+
+
+def fit_ransac(model_name, xy, z, threshold=None, trials=200, seed=0):
+    # Consensus of minimal plane fits; the model is then fitted to the inliers
+    rng = np.random.default_rng(seed)
+    if threshold is None:
+        threshold = 3 * robust_scale(z - PolynomialModel(1).fit(xy, z).predict(xy))
+    best = None
+    for _ in range(trials):
+        sample = rng.choice(len(z), 3, replace=False)
+        candidate = PolynomialModel(1).fit(xy[sample], z[sample])
+        inliers = np.abs(z - candidate.predict(xy)) <= threshold
+        if best is None or inliers.sum() > best.sum():
+            best = inliers
+    model = make_model(model_name)
+    if best.sum() < model.min_points:
+        best = np.ones(len(z), dtype=bool)
+    model.fit(xy[best], z[best])
+    return model, best.astype(float)
+
+
+def fit_model(model_name, xy, z, robust="huber", seed=0):
+    # Returns the fitted model and a weight per point (0 for rejected points)
+    if robust == "huber":
+        if model_name == "piecewise":
+            return fit_huber_piecewise(xy, z)
+        return fit_huber(make_model(model_name), xy, z)
+    if robust == "ransac":
+        return fit_ransac(model_name, xy, z, seed=seed)
+    if robust == "none":
+        return make_model(model_name).fit(xy, z), np.ones(len(z))
+    raise ValueError(f"Unknown robust fitting method: {robust}")
+
+
+def cross_validation_error(model_name, xy, z, robust="huber", n_folds=5, seed=0):
+    # Median absolute error on held-out focus points, which is not dominated
+    # by the bad points that robust fitting rejects
+    n = len(z)
+    n_folds = min(n_folds, n)
+    folds = np.random.default_rng(seed).permutation(n) % n_folds
+    errors = np.empty(n)
+    for fold in range(n_folds):
+        test = folds == fold
+        train = ~test
+        if train.sum() < make_model(model_name).min_points:
+            return np.inf
+        model, _ = fit_model(model_name, xy[train], z[train], robust, seed)
+        errors[test] = np.abs(z[test] - model.predict(xy[test]))
+    return float(np.median(errors))
+
+
+class FocusMap:
+    def __init__(self, model_name, model, weights, cv_errors, xy, z):
+        self.model_name = model_name
+        self.model = model
+        self.weights = weights
+        self.cv_errors = cv_errors
+        self.residuals = z - model.predict(xy)
+        scale = robust_scale(self.residuals)
+        self.inliers = (weights > 0) & (np.abs(self.residuals) <= 3 * scale + 1e-9)
+
+    def predict(self, xy):
+        return self.model.predict(np.asarray(xy, dtype=float))
+
+    def summary(self):
+        lines = [
+            f"Focus map: {self.model_name}, {self.inliers.sum()} of "
+            f"{len(self.inliers)} focus points used, residual RMS "
+            f"{np.sqrt(np.mean(self.residuals[self.inliers] ** 2)):.2f} um"
+        ]
+        for name, error in self.cv_errors.items():
+            lines.append(f"  {name:<10} cross-validated median error {error:.2f} um")
+        return "\n".join(lines)
+
+
+def fit_focus_map(xy, z, model="auto", robust="huber", n_folds=5, seed=0):
+    # With model="auto", each model that the focus points can support is
+    # cross-validated and the one with the smallest held-out error is used.
+    xy = np.asarray(xy, dtype=float)[:, :2]
+    z = np.asarray(z, dtype=float)
+    if len(z) < 3:
+        raise ValueError(f"Need at least 3 focus points, got {len(z)}")
+    cv_errors = {}
+    if model == "auto":
+        for name in MODELS:
+            # Require twice the minimum so the held-out folds mean something
+            if len(z) < 2 * make_model(name).min_points + 1:
+                continue
+            try:
+                cv_errors[name] = cross_validation_error(name, xy, z, robust, n_folds, seed)
+            except RuntimeError:
+                continue  # scipy not installed
+        model = min(cv_errors, key=cv_errors.get) if cv_errors else "plane"
+    fitted, weights = fit_model(model, xy, z, robust, seed)
+    return FocusMap(model, fitted, weights, cv_errors, xy, z)
+
+
+def check_safe_z_range(z_coords, z_min, z_max):
+    z_coords = np.asarray(z_coords, dtype=float)
+    outside = ~((z_coords >= z_min) & (z_coords <= z_max))  # also catches NaN
+    if outside.any():
+        raise ValueError(
+            f"Z out of safe range of {z_min} to {z_max} at {int(outside.sum())} "
+            f"positions (range {z_coords.min()} to {z_coords.max()})"
+        )
+
+
+def check_safe_xy_range(xy, x_min, y_min, x_max, y_max):
+    xy = np.asarray(xy, dtype=float).reshape(-1, 2)
+    outside = ~(
+        (xy[:, 0] >= x_min) & (xy[:, 0] <= x_max) & (xy[:, 1] >= y_min) & (xy[:, 1] <= y_max)
+    )
+    if outside.any():
+        first = int(np.flatnonzero(outside)[0])
+        raise ValueError(
+            f"XY out of safe range of ({x_min}, {y_min}) to ({x_max}, {y_max}) at "
+            f"{int(outside.sum())} positions (first: {xy[first].tolist()})"
+        )
@@ -0,0 +1,247 @@
+import fnmatch
+import os
+import queue
+import re
+import time
+from collections import deque
+
+from .compaction import uncompacted_name
+from .striping import acquisition_folders
+
+
+DEFAULT_PATTERN = "*.sdt"
+DEFAULT_SETTLE_TIME = 2.0
+
+# Files that are still being written (the BH-TCSPC name before rename) or
+# were set aside by the acquisition; they never count as completed positions.
+# (pos_0000.sdt is a tile; pos_0000_0000.sdt is its file being written. Tile
+# numbers past 9999 have more digits: pos_12345_0000.sdt.)
+PARTIAL_NAME = re.compile(r"(_\d{4,}_0000|_aborted\d+|_incomplete\d+)$")
+
+
+def is_partial_name(filename):
+    return PARTIAL_NAME.search(os.path.splitext(filename)[0]) is not None
+
+
+# Incremental index of the completed files in an acquisition folder, for the
+# monitors in src/utils. A file counts once, when it is complete: it has its
+# final name and its size and modification time have not changed for
+# settle_time seconds. Only new or not-yet-complete files are looked at on
+# each poll(): with watchdog installed (inotify, or ReadDirectoryChangesW on
+# Windows) the observer reports which names changed; otherwise the directory
+# is listed with os.scandir and names already counted are skipped without a
+# stat. Counts, bytes and completion times are kept as running totals.
+#
+# `folder` may also be a list of folders, counted together: the output roots
+# of an acquisition whose tiles were spread over several volumes.
+# for_acquisition() finds them from the acquisition's tile manifest. A file
+# and its compressed copy (pos_0000.sdt.zst) count as one.
+class FolderIndex:
+    def __init__(
+        self,
+        folder,
+        pattern=DEFAULT_PATTERN,
+        settle_time=DEFAULT_SETTLE_TIME,
+        use_watchdog=True,
+        history=1000,
+    ):
+        if isinstance(folder, (str, os.PathLike)):
+            folder = [folder]
+        self.__folders = [str(f) for f in folder]
+        self.__pattern = pattern
+        self.__settle_time = settle_time
+        self.__completed = set()
+        self.__pending = {}  # name -> (size, mtime, first seen unchanged)
+        self.__locations = {}  # pending name -> its folder
+        self.__count = 0
+        self.__bytes = 0
+        self.__first_created = None
+        self.__completion_times = deque(maxlen=history)
+        self.__listeners = []
+        self.__changes = None
+        self.__observer = None
+        if use_watchdog:
+            self.__start_observer()
+        self.__scan()
+
+    @classmethod
+    def for_acquisition(cls, directory, **kwargs):
+        return cls(acquisition_folders(directory), **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def folder(self):
+        return self.__folders[0]
+
+    @property
+    def folders(self):
+        return list(self.__folders)
+
+    @property
+    def watching(self):
+        # True if changes come from a filesystem observer instead of listing
+        return self.__observer is not None
+
+    @property
+    def count(self):
+        return self.__count
+
+    @property
+    def bytes_completed(self):
+        return self.__bytes
+
+    @property
+    def pending(self):
+        return len(self.__pending)
+
+    @property
+    def first_created(self):
+        # Creation time of the earliest completed file: when imaging started
+        return self.__first_created
+
+    @property
+    def last_completed(self):
+        return self.__completion_times[-1] if self.__completion_times else None
+
+    def completion_times(self):
+        # Modification times of the most recently completed files, in order
+        return list(self.__completion_times)
+
+    def add_listener(self, callback):
+        # callback(name, size, completed_time) for each newly completed file
+        self.__listeners.append(callback)
+
+    def rate(self, window=None):
+        # Completed files per second over the last `window` completions
+        times = list(self.__completion_times)
+        if window is not None:
+            times = times[-(window + 1):]
+        if len(times) < 2 or times[-1] <= times[0]:
+            return None
+        return (len(times) - 1) / (times[-1] - times[0])
+
+    def poll(self):
+        # Pick up changes since the last poll; returns the number of files
+        # that completed.
+        if self.__observer is None:
+            self.__scan()
+        else:
+            while True:
+                try:
+                    folder, name = self.__changes.get_nowait()
+                except queue.Empty:
+                    break
+                if uncompacted_name(name) not in self.__completed:
+                    self.__pending.setdefault(name, None)
+                    self.__locations.setdefault(name, folder)
+        return self.__check_pending()
+
+    def close(self):
+        if self.__observer is not None:
+            self.__observer.stop()
+            self.__observer.join()
+            self.__observer = None
+
+    def __matches(self, name):
+        name = uncompacted_name(name)
+        return fnmatch.fnmatch(name, self.__pattern) and not is_partial_name(name)
+
+    def __scan(self):
+        for folder in self.__folders:
+            try:
+                entries = os.scandir(folder)
+            except FileNotFoundError:
+                continue
+            with entries:
+                for entry in entries:
+                    name = entry.name
+                    if uncompacted_name(name) in self.__completed or name in self.__pending:
+                        continue
+                    if self.__matches(name):
+                        self.__pending[name] = None
+                        self.__locations[name] = folder
+
+    def __check_pending(self):
+        now = time.time()
+        completed = 0
+        for name, previous in list(self.__pending.items()):
+            if uncompacted_name(name) in self.__completed:
+                # The other of a file and its compressed copy was counted
+                del self.__pending[name]
+                del self.__locations[name]
+                continue
+            try:
+                st = os.stat(os.path.join(self.__locations[name], name))
+            except FileNotFoundError:
+                # Renamed or set aside before it completed
+                del self.__pending[name]
+                del self.__locations[name]
+                continue
+            key = (st.st_size, st.st_mtime)
+            if previous is None or previous[:2] != key:
+                self.__pending[name] = (*key, now)
+                # A file last written longer ago than settle_time (e.g. at
+                # start-up) is complete the first time it is seen
+                if now - st.st_mtime < self.__settle_time:
+                    continue
+            elif now - previous[2] < self.__settle_time:
+                continue
+            del self.__pending[name]
+            del self.__locations[name]
+            self.__complete(name, st)
+            completed += 1
+        return completed
+
+    def __complete(self, name, st):
+        self.__completed.add(uncompacted_name(name))
+        self.__count += 1
+        self.__bytes += st.st_size
+        created = getattr(st, "st_birthtime", st.st_ctime)
+        if self.__first_created is None or created < self.__first_created:
+            self.__first_created = created
+        # Files found at start-up complete in mtime order, not listing order
+        times = self.__completion_times
+        if times and st.st_mtime < times[-1]:
+            times = sorted([*times, st.st_mtime])
+            self.__completion_times.clear()
+            self.__completion_times.extend(times)
+        else:
+            times.append(st.st_mtime)
+        for callback in self.__listeners:
+            callback(name, st.st_size, st.st_mtime)
+
+    def __start_observer(self):
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            return
+
+        changes = queue.SimpleQueue()
+        matches = self.__matches
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if event.is_directory:
+                    return
+                for path in (event.src_path, getattr(event, "dest_path", "")):
+                    folder, name = os.path.split(path)
+                    if name and matches(name):
+                        changes.put((folder, name))
+
+        if not all(os.path.isdir(folder) for folder in self.__folders):
+            # Not created yet (the acquisition refuses an existing folder);
+            # fall back to listing them
+            return
+        observer = Observer()
+        for folder in self.__folders:
+            observer.schedule(Handler(), folder, recursive=False)
+        observer.daemon = True
+        observer.start()
+        self.__changes = changes
+        self.__observer = observer
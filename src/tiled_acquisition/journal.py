@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+from .compaction import compacted_path
+
+
+JOURNAL_NAME = "journal.jsonl"
+
+
+def positions_hash(xyzs):
+    # Identifies the planned positions that tile numbers index. Only XY is
+    # hashed: Z may be re-planned (a new focus map) without moving any tile.
+    xy = np.ascontiguousarray(np.asarray(xyzs, dtype=np.float64)[:, :2])
+    return hashlib.sha256(xy.tobytes()).hexdigest()
+
+
+# Append-only record of an acquisition, one JSON object per line. Each
+# completed position is recorded only after all of its files are written, and
+# every record is fsync'd, so after a crash the journal lists exactly the
+# positions that can be skipped on --resume.
+class PositionJournal:
+    def __init__(self, directory):
+        self.__path = Path(directory) / JOURNAL_NAME
+        self.__file = open(self.__path, "a", encoding="utf-8")
+        if self.__file.tell() > 0 and not self.__ends_with_newline():
+            # A record cut short by a crash; keep the next one off its line
+            self.__file.write("\n")
+
+    @property
+    def path(self):
+        return self.__path
+
+    def record_start(self, args, xyzs=None):
+        # xyzs: every planned position, indexed by tile number
+        self.__append(
+            type="start",
+            position_csv=str(args.position_csv),
+            frames=args.frames,
+            resolution=args.resolution,
+            positions=None if xyzs is None else positions_hash(xyzs),
+            resume=bool(args.resume),
+        )
+
+    def record_position(self, number, prefix, event, files, frames=None):
+        # files maps each written file's path to its size in bytes; frames is
+        # the number of frames acquired
+        self.__append(
+            type="position",
+            number=number,
+            prefix=Path(prefix).name,
+            x=event.x_pos,
+            y=event.y_pos,
+            z=event.z_pos,
+            frames=frames,
+            files={str(path): size for path, size in files.items()},
+        )
+
+    def close(self):
+        self.__file.close()
+
+    def __ends_with_newline(self):
+        with open(self.__path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def __append(self, **record):
+        record["time"] = time.time()
+        self.__file.write(json.dumps(record) + "\n")
+        self.__file.flush()
+        os.fsync(self.__file.fileno())
+
+
+def read_journal(directory):
+    path = Path(directory) / JOURNAL_NAME
+    starts, positions = [], {}
+    if not path.exists():
+        return starts, positions
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A record cut short by a crash; it was never completed
+                continue
+            if record.get("type") == "start":
+                starts.append(record)
+            elif record.get("type") == "position":
+                positions[record["number"]] = record
+    return starts, positions
+
+
+def missing_or_incomplete_files(record):
+    problems = []
+    for path, size in record["files"].items():
+        if not os.path.exists(path) and os.path.exists(compacted_path(path)):
+            # Compressed by the compactor, which names it only once verified
+            continue
+        if not os.path.exists(path):
+            problems.append(f"{path} is missing")
+        elif os.path.getsize(path) != size:
+            problems.append(f"{path} is {os.path.getsize(path)} bytes, expected {size}")
+    return problems
+
+
+def completed_positions(directory, frames=None, resolution=None, xyzs=None):
+    # Returns the journal records of positions whose files are all present
+    # and complete, keyed by tile number. With xyzs, refuses to resume if the
+    # planned positions differ from a previous run's (tile numbers would then
+    # refer to other positions); journals from before this was recorded are
+    # not checked.
+    starts, positions = read_journal(directory)
+    for start in starts:
+        for key, value in (("frames", frames), ("resolution", resolution)):
+            if value is not None and start.get(key) != value:
+                raise ValueError(
+                    f"Cannot resume: previous run used {key}={start.get(key)}, "
+                    f"not {value}"
+                )
+        if (
+            xyzs is not None
+            and start.get("positions") is not None
+            and start["positions"] != positions_hash(xyzs)
+        ):
+            raise ValueError(
+                f"Cannot resume: the positions differ from those of the previous run "
+                f"(from {start.get('position_csv')})"
+            )
+    completed = {}
+    for number, record in sorted(positions.items()):
+        problems = missing_or_incomplete_files(record)
+        acquired = record.get("frames")
+        if frames is not None and acquired is not None and acquired != frames:
+            problems.append(f"only {acquired} of {frames} frames were acquired")
+        if problems:
+            print(
+                f"Re-acquiring position {number}: {'; '.join(problems)}",
+                file=sys.stderr,
+            )
+        else:
+            completed[number] = record
+    return completed
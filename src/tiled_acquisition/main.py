@@ -1,19 +1,101 @@
 import argparse
 import csv
+import functools
 import os
 from pathlib import Path
+import re
 import sys
+import threading
 import time
 import numpy as np
-from pymmcore_plus import CMMCorePlus
-from pymmcore_plus.mda import MDAEngine
-from pyometiff import OMETIFFWriter
-from useq import MDAEvent, MDASequence, TIntervalLoops
 
+from .autofocus import (
+    DEFAULT_RANGE,
+    DEFAULT_STEPS,
+    FOCUS_CACHE_NAME,
+    FOCUS_METRICS,
+    Autofocus,
+    FocusCache,
+)
+from .backends import (
+    OUTPUT_FORMATS,
+    CompositeBackend,
+    NullBackend,
+    OMETiffBackend,
+    OMEZarrBackend,
+)
+from .compaction import COMPACTION_MANIFEST_NAME, DEFAULT_COMPRESSION_LEVEL, Compactor
+from .eta import ThroughputEstimator
+from .dry_run import (
+    TimingProfile,
+    disk_requirements,
+    format_bytes,
+    format_duration,
+    output_files,
+)
+from .focus_map import MODELS, check_safe_xy_range, check_safe_z_range, fit_focus_map
+from .journal import PositionJournal, completed_positions
+from .mosaic import MOSAIC_FRAMES, OVERLAP_MODES, MosaicBackend
+from .path_planner import (
+    DEFAULT_XY_SPEED,
+    DEFAULT_Z_SPEED,
+    PATH_ORDERS,
+    path_travel_time,
+    plan_path,
+)
+from .plan import (
+    PositionPlan,
+    is_plan_file,
+    load_plan,
+    PositionEvents,
+    read_position_csv,
+    save_plan,
+)
+from .pmt_control import DEFAULT_READY_TIMEOUT, PMTController
+from .pmt_detector import DEFAULT_CHECKED_FRACTION, TailRegionDetector
+from .shared_frames import FrameWorkerPool, SharedFrameRing
+from .stage import describe_stage_sequencing
+from .status_server import StatusServer
+from .striping import MANIFEST_NAME, PLACEMENTS, StripedBackend, TileLocator, VolumePlacer, read_manifest
+from .tile_grid import (
+    DEFAULT_OVERLAP,
+    DEFAULT_ZOOM,
+    apply_focus,
+    pixel_size_for,
+    read_polygon,
+    tile_grid,
+)
+from .tracing import CHROME_TRACE_NAME, TRACE_NAME, TRACE_SUMMARY_NAME, TraceRecorder
+from .writer import BackgroundWriter
 
-def parse_args():
+
+def parse_args(argv=None):
     parser = argparse.ArgumentParser(fromfile_prefix_chars="@")
-    parser.add_argument("position_csv", help="CSV file containing X, Y, Z")
+    parser.add_argument(
+        "position_csv",
+        nargs="?",
+        help="CSV file containing X, Y, Z, or a position plan (.npz); with "
+        "--grid-bbox or --grid-polygon, the focus points that the grid's Z is "
+        "interpolated from",
+    )
+    parser.add_argument(
+        "--save-plan",
+        metavar="FILENAME",
+        help="Write the positions and acquisition order to a position plan "
+        "(.npz) and exit without acquiring",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Check the positions against --z-range and --xy-range and estimate "
+        "stage travel, run time and disk use, without loading Micro-Manager",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="DIRNAME",
+        help="Save directory of a previous acquisition whose frame times, "
+        "per-position overhead and file sizes --dry-run's estimates use",
+    )
     parser.add_argument(
         "--frames",
         type=int,
@@ -46,11 +128,333 @@ def parse_args():
         choices=(256, 512, 1024),
         help="Scan resolution",
     )
+    parser.add_argument(
+        "--zoom",
+        type=float,
+        metavar="FACTOR",
+        default=DEFAULT_ZOOM,
+        help="Scanner zoom factor",
+    )
     parser.add_argument(
         "--no-sync-check", action="store_true", help="Disable check for SYNC signal"
     )
     parser.add_argument("--save", metavar="DIRNAME", help="Destination to save images")
-    return parser.parse_args()
+    parser.add_argument(
+        "--output",
+        default="ome-tiff",
+        choices=OUTPUT_FORMATS,
+        help="Format for the image stack of each position: one OME-TIFF per "
+        "position, or all positions in one chunked OME-Zarr store",
+    )
+    parser.add_argument(
+        "--image-dir",
+        metavar="PATH",
+        help="Where to write image stacks (default: SAVE_tif for OME-TIFF, "
+        "SAVE.ome.zarr for OME-Zarr)",
+    )
+    parser.add_argument(
+        "--output-roots",
+        nargs="+",
+        metavar="DIR",
+        default=[],
+        help="Further directories, ideally on other disks, to spread tiles "
+        "over along with --save. Each tile's SDT, SPC and JSON files go to one "
+        "root and its OME-TIFF to ROOT_tif; --save keeps the journal, tile "
+        f"config and {MANIFEST_NAME}, which records where each tile went",
+    )
+    parser.add_argument(
+        "--placement",
+        default="balanced",
+        choices=PLACEMENTS,
+        help="How tiles are spread over the output roots: in turn, or to the "
+        "root expected to finish writing first given its measured bandwidth "
+        "(roots that are nearly full are skipped either way)",
+    )
+    parser.add_argument(
+        "--pixel-size",
+        type=float,
+        metavar="MICRONS",
+        help="Image pixel size, for image metadata, mosaic placement and the "
+        "tile grid (default: from the resolution and zoom)",
+    )
+    parser.add_argument(
+        "--grid-bbox",
+        type=float,
+        nargs=4,
+        metavar=("X0", "Y0", "X1", "Y1"),
+        help="Acquire a grid of tiles covering this stage region instead of "
+        "the positions in a CSV file",
+    )
+    parser.add_argument(
+        "--grid-polygon",
+        metavar="FILENAME",
+        help="Acquire a grid of tiles covering the polygon whose vertices are "
+        "the X, Y rows of this CSV file",
+    )
+    parser.add_argument(
+        "--overlap",
+        type=float,
+        metavar="PERCENT",
+        default=DEFAULT_OVERLAP,
+        help="Overlap between adjacent grid tiles",
+    )
+    parser.add_argument(
+        "--grid-z",
+        type=float,
+        metavar="MICRONS",
+        help="Z for every grid tile, when no focus points are given",
+    )
+    parser.add_argument(
+        "--focus-model",
+        default="plane",
+        choices=("auto",) + MODELS,
+        help="Focus surface fitted to the focus points for the grid's Z",
+    )
+    parser.add_argument(
+        "--z-range",
+        type=float,
+        nargs=2,
+        metavar=("ZMIN", "ZMAX"),
+        help="Refuse to start if any position's Z is outside this range",
+    )
+    parser.add_argument(
+        "--xy-range",
+        type=float,
+        nargs=4,
+        metavar=("XMIN", "YMIN", "XMAX", "YMAX"),
+        help="Refuse to start if any position is outside this stage region",
+    )
+    parser.add_argument(
+        "--mosaic",
+        metavar="FILENAME",
+        help="Also write a stitched mosaic (.npy, memory-mapped) while acquiring",
+    )
+    parser.add_argument(
+        "--mosaic-overlap",
+        default="last",
+        choices=OVERLAP_MODES,
+        help="How overlapping tiles are combined in the mosaic",
+    )
+    parser.add_argument(
+        "--mosaic-frames",
+        default="last",
+        choices=MOSAIC_FRAMES,
+        help="Put only the last (fully accumulated) frame, or all frames, in "
+        "the mosaic",
+    )
+    parser.add_argument(
+        "--mosaic-invert",
+        default="",
+        choices=("", "x", "y", "xy"),
+        help="Stage axes that run opposite to the image axes",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted acquisition in the existing --save "
+        "directory, skipping positions recorded as complete in its journal",
+    )
+    parser.add_argument(
+        "--pmt-retries",
+        type=int,
+        metavar="N",
+        default=1,
+        help="Number of times to re-acquire a position after the PMT shuts off "
+        "(the partial acquisition is aborted as soon as shut-off is seen)",
+    )
+    parser.add_argument(
+        "--pmt-check-fraction",
+        type=float,
+        metavar="F",
+        default=DEFAULT_CHECKED_FRACTION,
+        help="Fraction of each frame (at the end of the scan) checked for PMT "
+        "shut-off",
+    )
+    parser.add_argument(
+        "--pmt-check-stride",
+        type=int,
+        metavar="N",
+        default=1,
+        help="Check only every Nth pixel of the PMT shut-off region",
+    )
+    parser.add_argument(
+        "--path-order",
+        default="csv",
+        choices=PATH_ORDERS,
+        help="Order in which to visit positions: as listed in the CSV (a tile "
+        "grid is listed in serpentine order), serpentine rows, or "
+        "nearest-neighbour with 2-opt; tiles keep their CSV row numbers either way",
+    )
+    parser.add_argument(
+        "--stage-speed",
+        type=float,
+        metavar="UM_PER_S",
+        default=DEFAULT_XY_SPEED,
+        help="XY stage speed used for path planning and travel estimates",
+    )
+    parser.add_argument(
+        "--z-speed",
+        type=float,
+        metavar="UM_PER_S",
+        default=DEFAULT_Z_SPEED,
+        help="Focus drive speed used for path planning and travel estimates",
+    )
+    parser.add_argument(
+        "--prefetch-moves",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Start moving to the next position as soon as the last frame of "
+        "the current position has been read out",
+    )
+    parser.add_argument(
+        "--write-queue",
+        type=int,
+        metavar="N",
+        default=2,
+        help="Number of positions that may wait to be saved in the background "
+        "before acquisition pauses, per output root (0 saves synchronously)",
+    )
+    parser.add_argument(
+        "--frame-workers",
+        type=int,
+        metavar="N",
+        default=0,
+        help="Save positions (image encoding, mosaic, frame statistics) in N "
+        "worker processes that read frames from shared memory, instead of in "
+        "the acquisition process (0)",
+    )
+    parser.add_argument(
+        "--frame-slots",
+        type=int,
+        metavar="N",
+        help="Number of positions' frames the shared memory for --frame-workers "
+        "holds (default: workers + 2); when all are in use, frames are "
+        "acquired into ordinary memory and copied over once a slot is free",
+    )
+    parser.add_argument(
+        "--compress-raw",
+        action="store_true",
+        help="Compress each saved position's SDT and SPC files with zstd in "
+        "low-priority background processes, replacing them with verified .zst "
+        f"files whose SHA-256 is recorded in {COMPACTION_MANIFEST_NAME} "
+        "(requires the zstandard package)",
+    )
+    parser.add_argument(
+        "--compress-workers",
+        type=int,
+        metavar="N",
+        default=1,
+        help="Number of processes compressing raw files for --compress-raw",
+    )
+    parser.add_argument(
+        "--compress-level",
+        type=int,
+        metavar="LEVEL",
+        default=DEFAULT_COMPRESSION_LEVEL,
+        help="zstd compression level for --compress-raw",
+    )
+    parser.add_argument(
+        "--pmt-warmup",
+        type=float,
+        metavar="SECONDS",
+        default=5.0,
+        help="Time to wait after switching on the PMT, at the start and after "
+        "each reset, if the DCC module does not report the PMT's HV readback "
+        "(otherwise it is polled until the HV has ramped up)",
+    )
+    parser.add_argument(
+        "--pmt-ready-timeout",
+        type=float,
+        metavar="SECONDS",
+        default=DEFAULT_READY_TIMEOUT,
+        help="Longest time to wait for the DCC module to report the PMT ready "
+        "after switching it on",
+    )
+    parser.add_argument(
+        "--autofocus-every",
+        type=int,
+        metavar="N",
+        default=0,
+        help="Run image-based autofocus at the first and every Nth position, "
+        "and correct the Z of the positions in between for the measured drift "
+        "(0 disables autofocus)",
+    )
+    parser.add_argument(
+        "--autofocus-range",
+        type=float,
+        metavar="MICRONS",
+        default=DEFAULT_RANGE,
+        help="Z range of the autofocus sweep, centred on the predicted Z",
+    )
+    parser.add_argument(
+        "--autofocus-steps",
+        type=int,
+        metavar="N",
+        default=DEFAULT_STEPS,
+        help="Number of scans in the autofocus sweep",
+    )
+    parser.add_argument(
+        "--autofocus-metric",
+        default="brenner",
+        choices=FOCUS_METRICS,
+        help="Focus metric for the autofocus sweep",
+    )
+    parser.add_argument(
+        "--autofocus-resolution",
+        type=int,
+        metavar="PIXELS",
+        choices=(256, 512, 1024),
+        help="Scan resolution for the autofocus sweep (default: --resolution)",
+    )
+    parser.add_argument(
+        "--autofocus-max-offset",
+        type=float,
+        metavar="MICRONS",
+        help="Largest Z correction the drift model may apply",
+    )
+    parser.add_argument(
+        "--autofocus-cache",
+        metavar="FILENAME",
+        help="File of measured Z per position, read at the start (to begin "
+        "from the last measured drift) and updated after each measurement "
+        f"(default: {FOCUS_CACHE_NAME} in the save directory)",
+    )
+    parser.add_argument(
+        "--status-server",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Serve live progress as JSON on localhost (the URL is written to "
+        "status_endpoint.json in the save directory)",
+    )
+    parser.add_argument(
+        "--status-port",
+        type=int,
+        metavar="PORT",
+        default=0,
+        help="Port for the status server (default: any free port)",
+    )
+    args = parser.parse_args(argv)
+    if args.grid_bbox is not None and args.grid_polygon is not None:
+        parser.error("--grid-bbox and --grid-polygon cannot be used together")
+    if args.grid_bbox is None and args.grid_polygon is None:
+        if args.position_csv is None:
+            parser.error("Give a position CSV, --grid-bbox or --grid-polygon")
+    elif args.position_csv is None and args.grid_z is None:
+        parser.error("A tile grid needs focus points (a position CSV) or --grid-z")
+    if args.frame_workers > 1 and (args.output == "ome-zarr" or args.mosaic):
+        parser.error(
+            "Only one frame worker can write an OME-Zarr store or a mosaic; "
+            "use --frame-workers 1"
+        )
+    if args.frame_slots is not None and args.frame_slots < 1:
+        parser.error("--frame-slots must be at least 1")
+    if args.output_roots and args.save is None:
+        parser.error("--output-roots requires --save")
+    if args.compress_workers < 1:
+        parser.error("--compress-workers must be at least 1")
+    if args.pixel_size is None:
+        args.pixel_size = pixel_size_for(args.resolution, args.zoom)
+    return args
 
 
 def setup_hardware(args):
@@ -61,6 +465,8 @@ def setup_hardware(args):
     save_cwd = os.getcwd()
     os.chdir(os.environ["MICROMANAGER_PATH"])
 
+    from pymmcore_plus import CMMCorePlus
+
     mmc = CMMCorePlus.instance()
     mmc.enableDebugLog(True)
     if args.config:
@@ -76,7 +482,7 @@ def setup_hardware(args):
         mmc.setConfig("Lens", "20X 0.75 Nikon")
         mmc.setConfig("Resolution (pixels)", str(args.resolution))
         mmc.setProperty("NIDAQAO-Dev2/ao1", "Voltage", args.eom)
-        mmc.setProperty("OSc-LSM", "LSM-ZoomFactor", 2)
+        mmc.setProperty("OSc-LSM", "LSM-ZoomFactor", args.zoom)
         mmc.setProperty("DCCModule2", "C3_GainHV", args.pmtgain)
         if args.no_sync_check:
             mmc.setConfig("FLIMCheckSync", "No")
@@ -94,173 +500,543 @@ def unaccumulate_images(images):
 
 
 def looks_like_pmt_shut_off(image):
-    checked_portion = np.ravel(image)[-16384:]
-    return np.all(checked_portion == 0)
+    return TailRegionDetector().is_shut_off(image)
 
 
-def reset_pmt(args, mmc):
-    if args.config:
-        mmc.setConfig("PMT Power (HV)", "Off")
-        mmc.setProperty("DCCModule2", "ClearOverloads", "Clear")
-        time.sleep(0.1)
-        mmc.setConfig("PMT Power (HV)", "On")
-        time.sleep(5.0)
+def frame_looks_like_pmt_shut_off(stack, index):
+    # Equivalent to looks_like_pmt_shut_off(unaccumulate_images(stack)[index])
+    # but compares the accumulated frames in place instead of materializing
+    # the differences.
+    return TailRegionDetector().frame_is_shut_off(stack, index)
+
+
+def make_pmt_detector(args):
+    return TailRegionDetector.for_resolution(
+        args.resolution, args.pmt_check_fraction, args.pmt_check_stride
+    )
+
+
+def make_pmt_controller(mmc, args):
+    # The Demo config has no PMT to switch or wait for
+    if not args.config:
+        return None
+    return PMTController(mmc, warmup=args.pmt_warmup, timeout=args.pmt_ready_timeout)
 
 
-def make_sdt_prefix(args, number):
-    return f"{args.save}/pos_{number:04d}"
+def output_roots(args):
+    # The volumes tiles are spread over; --save is the first
+    if args.save is None:
+        return []
+    return [str(root).rstrip("/\\") for root in (args.save, *args.output_roots)]
+
+
+def image_dir_for(args, root):
+    if args.image_dir and root == output_roots(args)[0]:
+        return args.image_dir
+    return f"{root}_tif"
+
+
+def make_volume_placer(args):
+    if not args.output_roots:
+        return None
+    roots = output_roots(args)
+    for root in roots:
+        os.makedirs(root, exist_ok=True)
+    return VolumePlacer(roots, args.placement, f"{args.save}/{MANIFEST_NAME}")
+
+
+def make_sdt_prefix(args, number, root=None):
+    return f"{root or args.save}/pos_{number:04d}"
 
 
 def set_sdt_filename(mmc, prefix,args):
     if args.config:
         mmc.setProperty("OSc-LSM", "BH-TCSPC-FLIMFileNamePrefix", prefix)
     
-def create_tile_config(args,prefix,coords):
+def tile_config_name(args, prefix):
+    # Tiles on other output roots are named relative to the main image
+    # folder, or by absolute path if they are on another drive
+    root, name = os.path.split(prefix)
+    name = f"{name}.tif"
+    if not args.output_roots or root == output_roots(args)[0]:
+        return name
+    path = os.path.join(image_dir_for(args, root), name)
+    try:
+        return os.path.relpath(path, image_dir_for(args, output_roots(args)[0]))
+    except ValueError:
+        return os.path.abspath(path)
+
 
-    filename = f"{prefix}"
-    #print(f"filename: {filename.split("/")[1]}")
-    #print(f"this is x y:{coords[0][1].x_pos} and {coords[0][1].y_pos}")
-    tile_config_row = (f"{filename.split("/")[-1]}.tif; ; ({coords[0][1].x_pos},{coords[0][1].y_pos})")
+# Tile config rows and frame statistics are appended from the writer
+# threads and the frame workers' collector thread
+_append_lock = threading.Lock()
+
+
+def create_tile_config(args,prefix,event):
+
+    filename = tile_config_name(args, prefix)
+    #print(f"this is x y:{event.x_pos} and {event.y_pos}")
+    tile_config_row = (f"{filename}; ; ({event.x_pos},{event.y_pos})")
     #print(tile_config_row)
-    write_tile_config(args, tile_config_row,filename.split("/")[-1])
+    write_tile_config(args, tile_config_row,filename)
     return
 
 def write_tile_config(args,tile_config_row,position):
-    
-    # FIXME: @Helen
-    # - move this before acquisition
-    # but need coords info from result for stage?
 
-    if Path(f"{args.save}/tile_config.txt").exists() and position=='pos_0000':
-        raise RuntimeError("Tile config file already exists")
-
-    with open(f"{args.save}/tile_config.txt","a") as text_file:
+    # The save directory is new (or the file was rewritten for --resume);
+    # rows are appended as positions finish saving, which with several
+    # writer threads or frame workers is not the order they were acquired
+    # in; sort_tile_config() restores that order once the run is over.
+    with _append_lock, open(f"{args.save}/tile_config.txt","a") as text_file:
         text_file.write(tile_config_row+ "\n")
 
+
+TILE_CONFIG_NUMBER = re.compile(r"pos_(\d+)\.tif$")
+
+
+def sort_tile_config(args, numbers):
+    # Puts the rows of the tile numbers acquired in this run in the order
+    # they were acquired, after any rows kept from before a --resume
+    filename = f"{args.save}/tile_config.txt"
+    if not os.path.exists(filename):
+        return
+    rank = {int(number): i for i, number in enumerate(numbers)}
+
+    def key(row):
+        match = TILE_CONFIG_NUMBER.search(row.split(";")[0].strip())
+        return rank.get(int(match.group(1)), -1) if match else -1
+
+    with open(filename) as text_file:
+        rows = text_file.read().splitlines()
+    with open(filename + ".tmp", "w") as text_file:
+        for row in sorted(rows, key=key):
+            text_file.write(row + "\n")
+    os.replace(filename + ".tmp", filename)
+
 def rename_sdt_files(args, prefix):
+    renamed_files = []
     if args.save is None or not args.config:
-        return
+        return renamed_files
     extensions = ("spc", "sdt", "json")
     for ext in extensions:
         original = f"{prefix}_0000.{ext}"
         renamed = f"{prefix}.{ext}"
         os.rename(original, renamed)
+        renamed_files.append(renamed)
+    return renamed_files
 
-#@Helen tiff save needs updating
-def save_tiff_image_test(file,values):
-    imvalues = []
-    imgarray = [np.array(p.image) for p in values]
-    imvalues = np.stack(imgarray)
-    
-    imvalues = np.array(imvalues)
-    #print(f"this is imvalues: {imvalues.shape}")
-    
-    metadata_dict = {
-        "PhysicalSizeX" : "0.7", #update
-        "PhysicalSizeXUnit" : "µm",
-        "PhysicalSizeY" : "0.7",    #update
-        "PhysicalSizeYUnit" : "µm",
-        "PhysicalSizeZ" : "0.0",
-        "PhysicalSizeZUnit" : "µm",
-        "Channels" : {
-            "FLIM" : {
-                "Name" : "FLIM740",
-                "SamplesPerPixel": 90,
-                "ExcitationWavelength": 740,
-                "ExcitationWavelengthUnit": "nm"
-            },
-        }
-    }
 
-    # our data in npy format
-    npy_array_data = np.uint16(imvalues)
-    # a string describing the dimension ordering
-    dimension_order = "TYX"
-    
-    writer = OMETIFFWriter(
-        fpath=rf"D:\UserData\HelenWilson\20250814_HDIM\hdim_trial2\thirteenbeads_coverslip_water\data_tif\{file.split("/")[-1]}.tif",
-        dimension_order=dimension_order,
-        array=npy_array_data,
-        metadata=metadata_dict,
-        explicit_tiffdata=False)
+def set_aside_sdt_files(args, prefix, attempt):
+    # Keep the partial files from an aborted attempt out of the way of the
+    # retry, which writes to the same prefix.
+    if args.save is None or not args.config:
+        return
+    extensions = ("spc", "sdt", "json")
+    for ext in extensions:
+        original = f"{prefix}_0000.{ext}"
+        if os.path.exists(original):
+            os.rename(original, f"{prefix}_aborted{attempt}.{ext}")
+
+
+def set_aside_incomplete_files(prefix):
+    # Files left at a position that was interrupted before it was recorded
+    # as complete; the position will be acquired again on --resume.
+    extensions = ("spc", "sdt", "json")
+    for ext in extensions:
+        for original in (f"{prefix}.{ext}", f"{prefix}_0000.{ext}"):
+            if not os.path.exists(original):
+                continue
+            base, _ = os.path.splitext(original)
+            k = 0
+            while os.path.exists(f"{base}_incomplete{k}.{ext}"):
+                k += 1
+            os.rename(original, f"{base}_incomplete{k}.{ext}")
+
+def write_frame_statistics(args, number, stats):
+    if args.save is None:
+        return
+    filename = f"{args.save}/frame_stats.csv"
+    with _append_lock:
+        is_new = not Path(filename).exists()
+        with open(filename, "a", newline="") as f:
+            writer = csv.writer(f)
+            if is_new:
+                writer.writerow(("position", "frame", "photons", "checked_nonzero", "shut_off"))
+            for row in stats.rows():
+                writer.writerow((number, *row))
+
+
+def save_position(args, prefix, number, event, stack, detector, backend, tracer=None):
+    tracer = tracer or TraceRecorder(capacity=0)
+    with tracer.span("rename_sdt_files", number):
+        files = rename_sdt_files(args, prefix)
+    with tracer.span("create_tile_config", number):
+        create_tile_config(args, prefix, event)
+    with tracer.span("image_write", number):
+        files.extend(backend.write_position(number, event, stack))
+    with tracer.span("frame_statistics", number):
+        write_frame_statistics(args, number, detector.frame_statistics(stack))
+    return files
+
+
+def rewrite_tile_config(args, records):
+    # On --resume, keep only rows for positions that are complete; the rest
+    # are appended again as they are re-acquired.
+    filename = f"{args.save}/tile_config.txt"
+    _, placed = read_manifest(args.save)
+    with open(filename + ".tmp", "w") as text_file:
+        for record in records:
+            root = placed.get(record["number"], output_roots(args)[0])
+            name = tile_config_name(args, f"{root}/{record['prefix']}")
+            text_file.write(f"{name}; ; ({record['x']},{record['y']})\n")
+    os.replace(filename + ".tmp", filename)
 
-    writer.write()
 
 def read_poslist(filename):
-    with open(filename, newline="") as f:
-        reader = csv.reader(f)
-        xyzs = []
-        for row in reader:
-            xyz = tuple(float(v) for v in row)
-            if len(xyz) != 3:
-                raise ValueError(
-                    f"Position CSV rows must contain X, Y, Z; found: {row}"
-                )
-            xyzs.append(xyz)
+    if is_plan_file(filename):
+        return load_plan(filename).xyz
+    return read_position_csv(filename)
+
+
+def make_grid_positions(args):
+    # XYZ positions of the tile grid, in serpentine order, with Z from the
+    # focus surface through the focus points in position_csv
+    polygon = read_polygon(args.grid_polygon) if args.grid_polygon else None
+    tile_size = args.resolution * args.pixel_size
+    xys = tile_grid(args.grid_bbox, polygon, tile_size, args.overlap)
+    focus_map = None
+    if args.position_csv is not None:
+        focus_points = np.array(read_poslist(args.position_csv))
+        focus_map = fit_focus_map(focus_points[:, :2], focus_points[:, 2], args.focus_model)
+        print(focus_map.summary(), file=sys.stderr)
+    xyzs = apply_focus(xys, focus_map, args.grid_z)
+    print(
+        f"Tile grid: {len(xyzs)} tiles of {tile_size:.1f} um with {args.overlap}% "
+        f"overlap, Z {xyzs[:, 2].min():.1f} to {xyzs[:, 2].max():.1f} um",
+        file=sys.stderr,
+    )
+    if args.z_range is not None:
+        check_safe_z_range(xyzs[:, 2], *args.z_range)
     return xyzs
 
 
-# Custom acquisition engine to add PMT overload checking
-class PMTCheckingEngine(MDAEngine):
-    def __init__(self, mmc, args):
-        super().__init__(mmc)
-        self.__args = args
-        self.__event_counter = 0
+def load_positions(args):
+    if args.grid_bbox is not None or args.grid_polygon is not None:
+        return make_grid_positions(args)
+    return read_poslist(args.position_csv)
 
-    def exec_event(self, event: MDAEvent):
-        sdt_prefix = make_sdt_prefix(self.__args, self.__event_counter)
-        self.__event_counter += 1
 
-        set_sdt_filename(self.mmcore, sdt_prefix,self.__args)
+def plan_positions(args):
+    # A plan file keeps its stored order unless another --path-order is asked for
+    if is_plan_file(args.position_csv) and args.grid_bbox is None and args.grid_polygon is None:
+        plan = load_plan(args.position_csv)
+        if args.path_order != "csv":
+            plan.order = order_positions(args, plan.xyz)
+        return plan
+    xyzs = load_positions(args)
+    return PositionPlan(xyzs, order_positions(args, xyzs))
 
-        result = super().exec_event(event)
-        result = list(result)  # Originally a generator
 
-        rename_sdt_files(self.__args, sdt_prefix)
-        create_tile_config(self.__args, sdt_prefix,result)
+def check_plan_bounds(args, xyz):
+    # Returns a message for each safe range (--z-range, --xy-range) violated
+    problems = []
+    for check, limits, coords in (
+        (check_safe_z_range, args.z_range, xyz[:, 2]),
+        (check_safe_xy_range, args.xy_range, xyz[:, :2]),
+    ):
+        if limits is not None:
+            try:
+                check(coords, *limits)
+            except ValueError as e:
+                problems.append(str(e))
+    return problems
 
-        save_tiff_image_test(sdt_prefix,result)
 
-        for image in unaccumulate_images([p.image for p in result]):
-            if looks_like_pmt_shut_off(image):
-                event = result[0].event
-                print(
-                    f"Resetting PMT at position {event.index['p']} at (x, y) = ({event.x_pos}, {event.y_pos})",
-                    file=sys.stderr,
+def dry_run(args):
+    # Checks the plan and estimates what running it takes, without touching
+    # Micro-Manager; returns the exit status
+    start = time.perf_counter()
+    problems = []
+    try:
+        plan = plan_positions(args)
+    except (OSError, ValueError) as e:
+        print(f"Cannot plan: {e}", file=sys.stderr)
+        return 1
+    xyz, order = plan.xyz, plan.order
+    if args.save is not None and Path(args.save).exists():
+        if args.resume:
+            try:
+                completed = completed_positions(
+                    args.save, args.frames, args.resolution, xyz
                 )
-                reset_pmt(self.__args, self.mmcore)
-                break
+                order = order[~np.isin(order, list(completed))]
+            except ValueError as e:
+                problems.append(str(e))
+        else:
+            problems.append(f"The save directory {args.save} already exists")
+    if not args.resume:
+        problems.extend(
+            f"The output root {root} already exists"
+            for root in args.output_roots
+            if Path(root).exists()
+        )
+    if args.resume and (args.save is None or not Path(args.save).exists()):
+        problems.append("--resume requires an existing --save directory")
+    problems.extend(check_plan_bounds(args, xyz[order]))
+    try:
+        profile = TimingProfile.from_run(args.profile) if args.profile else TimingProfile()
+    except ValueError as e:
+        problems.append(str(e))
+        profile = TimingProfile()
 
-        return result
+    n = len(order)
+    path = xyz[order]
+    lo, hi = (path.min(axis=0), path.max(axis=0)) if n else (np.zeros(3), np.zeros(3))
+    distance = float(np.hypot(*np.diff(path[:, :2], axis=0).T).sum()) if n > 1 else 0.0
+    travel = path_travel_time(xyz, order, args.stage_speed, args.z_speed)
+    scanning = n * args.frames * profile.frame_time_for(args.resolution)
+    overhead = n * profile.position_overhead
+    autofocus = 0.0
+    if args.autofocus_every:
+        resolution = args.autofocus_resolution or args.resolution
+        sweeps = -(-n // args.autofocus_every)
+        autofocus = sweeps * args.autofocus_steps * profile.frame_time_for(resolution)
+    total = scanning + travel + overhead + autofocus
 
+    print(
+        f"Dry run: {n} of {len(xyz)} positions, {args.frames} frames at "
+        f"{args.resolution} x {args.resolution}",
+        file=sys.stderr,
+    )
+    print(
+        f"  X {lo[0]:.1f} to {hi[0]:.1f} um, Y {lo[1]:.1f} to {hi[1]:.1f} um, "
+        f"Z {lo[2]:.1f} to {hi[2]:.1f} um",
+        file=sys.stderr,
+    )
+    print(
+        f"  Stage travel: {distance / 1000:.1f} mm in {args.path_order} order, "
+        f"{format_duration(travel)}",
+        file=sys.stderr,
+    )
+    print(
+        f"  Estimated time: {format_duration(total)} (scanning {format_duration(scanning)}, "
+        f"travel {format_duration(travel)}, overhead {format_duration(overhead)}"
+        + (f", autofocus {format_duration(autofocus)}" if autofocus else "")
+        + f"; profile: {profile.source})",
+        file=sys.stderr,
+    )
+    needed = {}
+    per_tile = {}
+    for directory, ext, share in output_files(args):
+        per_tile[ext] = size = profile.file_size(ext, args.frames, args.resolution)
+        needed[directory] = needed.get(directory, 0) + share * n * size
+    if per_tile:
+        sizes = ", ".join(f"{ext} {format_bytes(size)}" for ext, size in per_tile.items())
+        print(f"  Per tile: {sizes}", file=sys.stderr)
+    for anchor, required, free in disk_requirements(needed):
+        print(
+            f"  Disk at {anchor}: {format_bytes(required)} needed, {format_bytes(free)} free",
+            file=sys.stderr,
+        )
+        if required > free:
+            problems.append(
+                f"Not enough space at {anchor}: {format_bytes(required)} needed, "
+                f"{format_bytes(free)} free"
+            )
+    for problem in problems:
+        print(f"Problem: {problem}", file=sys.stderr)
+    print(f"Planned in {time.perf_counter() - start:.2f} s", file=sys.stderr)
+    return 1 if problems else 0
 
-def main():
-    args = parse_args()
 
-    if args.save is not None and Path(args.save).exists():
-        print(f"The save directory {args.save} already exists", file=sys.stderr)
-        sys.exit(1)
-    if args.save is not None:
-        os.mkdir(args.save)
+def check_plan_stages(mmc, plan):
+    for axis, planned, current in (
+        ("XY", plan.xy_stage, mmc.getXYStageDevice()),
+        ("Z", plan.z_stage, mmc.getFocusDevice()),
+    ):
+        if planned and planned != current:
+            print(
+                f"Warning: the plan's {axis} positions are for stage {planned}, "
+                f"but the current {axis} stage is {current}",
+                file=sys.stderr,
+            )
+
+
+def make_output_backend(args, xyzs, placer=None):
+    # Without the placer (in a frame worker), tiles spread over several
+    # output roots are looked up in the manifest
+    if args.save is None:
+        return NullBackend()
+    save = str(args.save).rstrip("/\\")
+    backends = []
+    if args.output == "ome-tiff" and args.output_roots:
+        backends.append(
+            StripedBackend(
+                {
+                    root: OMETiffBackend(image_dir_for(args, root), args.pixel_size)
+                    for root in output_roots(args)
+                },
+                placer.root_of if placer is not None else TileLocator(save).root_of,
+                placer.observe if placer is not None else None,
+            )
+        )
+    elif args.output == "ome-tiff":
+        backends.append(OMETiffBackend(args.image_dir or f"{save}_tif", args.pixel_size))
+    elif args.output == "ome-zarr":
+        backends.append(
+            OMEZarrBackend(
+                args.image_dir or f"{save}.ome.zarr",
+                len(xyzs),
+                args.pixel_size,
+                n_frames=args.frames,
+            )
+        )
+    if args.mosaic:
+        backends.append(
+            MosaicBackend(
+                args.mosaic,
+                xyzs,
+                (args.resolution, args.resolution),
+                args.pixel_size,
+                args.frames,
+                args.mosaic_overlap,
+                args.mosaic_frames,
+                invert_x="x" in args.mosaic_invert,
+                invert_y="y" in args.mosaic_invert,
+            )
+        )
+    return CompositeBackend(backends)
 
-    mmc = setup_hardware(args)
 
-    xyzs = read_poslist(args.position_csv)
+def order_positions(args, xyzs):
+    order = plan_path(xyzs, args.path_order, args.stage_speed, args.z_speed)
+    if args.path_order != "csv":
+        before = path_travel_time(xyzs, None, args.stage_speed, args.z_speed)
+        after = path_travel_time(xyzs, order, args.stage_speed, args.z_speed)
+        print(
+            f"Estimated stage travel time: {before:.0f} s in CSV order, "
+            f"{after:.0f} s in {args.path_order} order",
+            file=sys.stderr,
+        )
+    return order
+
 
-    mda_sequence = MDASequence(
-        stage_positions=xyzs,
-        time_plan=TIntervalLoops(interval=0, loops=args.frames),
-        axis_order="pt",
+def make_autofocus(mmc, args):
+    if not args.autofocus_every:
+        return None
+    cache = args.autofocus_cache
+    if cache is None and args.save is not None:
+        cache = f"{args.save}/{FOCUS_CACHE_NAME}"
+    return Autofocus(
+        mmc,
+        args.autofocus_every,
+        args.autofocus_range,
+        args.autofocus_steps,
+        args.autofocus_metric,
+        args.autofocus_resolution,
+        FocusCache(cache),
+        max_offset=args.autofocus_max_offset,
     )
 
-    mmc.mda.set_engine(PMTCheckingEngine(mmc, args))
+
+def make_frame_workers(args, xyzs, detector, image_shape):
+    # image_shape is the camera's (height, width), which may differ from
+    # --resolution (e.g. with the Demo config)
+    if not args.frame_workers:
+        return None
+    n_slots = args.frame_slots or args.frame_workers + 2
+    ring = SharedFrameRing(n_slots, (args.frames, *image_shape))
+    # Each worker makes its own output backend
+    return FrameWorkerPool(
+        ring,
+        functools.partial(make_output_backend, args, xyzs),
+        args.frame_workers,
+        detector,
+    )
+
+
+def make_compactor(args):
+    if not args.compress_raw or args.save is None:
+        return None
+    return Compactor(
+        f"{args.save}/{COMPACTION_MANIFEST_NAME}", args.compress_workers, args.compress_level
+    )
+
+
+def run_acquisition(mmc, args, xyzs, order, journal=None, backend=None, placer=None):
+    # Acquires the positions xyzs[order] with an already set-up core; returns
+    # the engine (for its timers) once all positions are saved. With
+    # --frame-workers, stacks are written by the workers' own backends
+    # through shared memory sized from the camera, and `backend` is unused. With
+    # --output-roots, tiles are placed by `placer` (made from args if not
+    # given), and there is a writer thread per root.
+    from .engine import PMTCheckingEngine
+
+    events = PositionEvents(xyzs, order, args.frames)
+
+    if placer is None:
+        placer = make_volume_placer(args)
+    writer = BackgroundWriter(
+        max_pending=args.write_queue, threads=1 if placer is None else len(placer.roots)
+    )
+    detector = make_pmt_detector(args)
+    frame_workers = make_frame_workers(
+        args, xyzs, detector, (mmc.getImageHeight(), mmc.getImageWidth())
+    )
+    if backend is None:
+        backend = (
+            make_output_backend(args, xyzs, placer) if frame_workers is None else NullBackend()
+        )
+    tracer = TraceRecorder()
+    estimator = ThroughputEstimator(total=len(order))
+    autofocus = make_autofocus(mmc, args)
+    pmt = make_pmt_controller(mmc, args)
+    compactor = make_compactor(args)
+    engine = PMTCheckingEngine(
+        mmc,
+        args,
+        writer,
+        detector,
+        backend,
+        order,
+        journal,
+        tracer,
+        estimator,
+        autofocus,
+        frame_workers,
+        pmt,
+        placer,
+        compactor,
+    )
+    mmc.mda.set_engine(engine)
     mmc.mda.engine.use_hardware_sequencing = True
+    # Each position gets its own SDT file and PMT check, so positions are not
+    # merged into one stage sequence; moves are host-driven (and prefetched).
+    print(describe_stage_sequencing(mmc), file=sys.stderr)
+
+    status_server = None
+    if args.status_server:
+        previously_completed = len(xyzs) - len(order)
+        status_server = StatusServer(
+            lambda: {
+                **engine.status(),
+                "total_positions": len(xyzs),
+                "previously_completed": previously_completed,
+            },
+            args.save,
+            port=args.status_port,
+        )
+        print(f"Serving status at {status_server.url}", file=sys.stderr)
 
     try:
-        if args.config:
-            mmc.setConfig("PMT Power (HV)", "On")
-        time.sleep(5.0)
-        thd = mmc.run_mda(mda_sequence)
+        if pmt is not None:
+            with tracer.span("pmt_warmup"):
+                ready, waited = pmt.power_on()
+            print(
+                f"PMT {'ready' if ready else 'not reported ready'} after {waited:.2f} s",
+                file=sys.stderr,
+            )
+        thd = mmc.run_mda(events)
         while thd.is_alive():
             try:
                 thd.join(timeout=0.1)
@@ -271,6 +1047,105 @@ def main():
                 raise
     finally:
         print("Shutting down...", file=sys.stderr)
-        if args.config:
-            mmc.setConfig("PMT Power (HV)", "Off")
+        if pmt is not None:
+            pmt.power_off()
         mmc.setShutterOpen(False)
+        print(engine.stage_timer.summary(), file=sys.stderr)
+        print("Waiting for pending saves to finish...", file=sys.stderr)
+        try:
+            try:
+                writer.close()
+            finally:
+                try:
+                    if frame_workers is not None:
+                        frame_workers.close()
+                finally:
+                    if compactor is not None:
+                        print("Waiting for raw file compression to finish...", file=sys.stderr)
+                        compactor.close()
+                        compacted = compactor.summary()
+                        print(
+                            f"Compressed {compacted['files']} raw files from "
+                            f"{format_bytes(compacted['bytes_in'])} to "
+                            f"{format_bytes(compacted['bytes_out'])}",
+                            file=sys.stderr,
+                        )
+        finally:
+            if status_server is not None:
+                status_server.close()
+            backend.close()
+            if args.save is not None:
+                sort_tile_config(args, order)
+            if placer is not None:
+                placer.close()
+            if args.save is not None:
+                engine.write_status(f"{args.save}/{TRACE_SUMMARY_NAME}")
+                tracer.write_jsonl(f"{args.save}/{TRACE_NAME}")
+                tracer.write_chrome_trace(f"{args.save}/{CHROME_TRACE_NAME}")
+    return engine
+
+
+def main():
+    args = parse_args()
+    if args.dry_run:
+        sys.exit(dry_run(args))
+
+    if args.resume and (args.save is None or not Path(args.save).is_dir()):
+        print("--resume requires an existing --save directory", file=sys.stderr)
+        sys.exit(1)
+    if not args.resume:
+        for root in output_roots(args):
+            if Path(root).exists():
+                print(
+                    f"The save directory {root} already exists (use --resume to continue it)",
+                    file=sys.stderr,
+                )
+                sys.exit(1)
+
+    plan = plan_positions(args)
+    if args.save_plan is not None:
+        save_plan(args.save_plan, plan)
+        print(f"Wrote a plan of {len(plan)} positions to {args.save_plan}", file=sys.stderr)
+        return
+    xyzs, order = plan.xyz, plan.order
+    problems = check_plan_bounds(args, xyzs[order])
+    if problems:
+        for problem in problems:
+            print(problem, file=sys.stderr)
+        sys.exit(1)
+
+    if args.save is not None and not args.resume:
+        os.mkdir(args.save)
+
+    completed = {}
+    if args.resume:
+        try:
+            completed = completed_positions(args.save, args.frames, args.resolution, xyzs)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+        rewrite_tile_config(args, completed.values())
+        order = np.array([i for i in order if i not in completed], dtype=int)
+        _, placed = read_manifest(args.save)
+        for i in order:
+            set_aside_incomplete_files(make_sdt_prefix(args, i, placed.get(i)))
+        print(
+            f"Resuming: {len(completed)} of {len(xyzs)} positions already complete, "
+            f"{len(order)} remaining",
+            file=sys.stderr,
+        )
+        if len(order) == 0:
+            return
+
+    journal = None
+    if args.save is not None:
+        journal = PositionJournal(args.save)
+        journal.record_start(args, xyzs)
+
+    try:
+        mmc = setup_hardware(args)
+        check_plan_stages(mmc, plan)
+        run_acquisition(mmc, args, xyzs, order, journal)
+    finally:
+        if journal is not None:
+            journal.close()
@@ -0,0 +1,142 @@
+import os
+import threading
+
+import numpy as np
+
+from .backends import OutputBackend
+
+
+OVERLAP_MODES = ("last", "average", "blend")
+MOSAIC_FRAMES = ("last", "all")
+
+
+def tile_offsets(xys, pixel_size, invert_x=False, invert_y=False):
+    # (row, column) of each tile's top-left pixel in the mosaic, from the
+    # same stage coordinates that go into tile_config.txt
+    xys = np.asarray(xys, dtype=float)[:, :2] / pixel_size
+    if invert_x:
+        xys[:, 0] = -xys[:, 0]
+    if invert_y:
+        xys[:, 1] = -xys[:, 1]
+    xys -= xys.min(axis=0)
+    return np.rint(xys[:, ::-1]).astype(np.int64)
+
+
+def blend_weights(shape):
+    # Linear ramp that is highest in the middle of the tile and falls off
+    # towards the edges, so overlapping tiles cross-fade
+    wy = np.minimum(np.arange(shape[0]) + 1, np.arange(shape[0], 0, -1))
+    wx = np.minimum(np.arange(shape[1]) + 1, np.arange(shape[1], 0, -1))
+    return np.outer(wy, wx).astype(np.float32)
+
+
+def open_npy_memmap(path, dtype, shape):
+    if os.path.exists(path):
+        array = np.lib.format.open_memmap(path, mode="r+")
+        if array.shape != shape or array.dtype != dtype:
+            raise ValueError(f"Existing {path} has shape {array.shape}, expected {shape}")
+        return array
+    return np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+
+
+# Writes each position straight into its place in a preallocated mosaic
+# (an .npy file opened as a memory map, readable with np.load(mmap_mode="r")),
+# so a stitched overview exists as soon as acquisition finishes. Only one tile
+# is touched at a time. The mosaic holds either the last accumulated frame of
+# each position (total photon counts) or all frames as (t, y, x).
+#
+# Overlaps: "last" lets the most recent tile win. "average" and "blend" keep a
+# float32 weighted sum and weight alongside the mosaic and compute the
+# uint16 result in row bands on close(). Parts of the mosaic that received no
+# tiles in this run are left as they were, so --resume can add to it.
+# Overlapping tiles are read, added to and written back, so writes from
+# several writer threads (--output-roots) take turns.
+class MosaicBackend(OutputBackend):
+    def __init__(
+        self,
+        path,
+        xys,
+        tile_shape,
+        pixel_size,
+        n_frames=1,
+        overlap="last",
+        frames="last",
+        invert_x=False,
+        invert_y=False,
+    ):
+        if overlap not in OVERLAP_MODES:
+            raise ValueError(f"Unknown overlap mode: {overlap}")
+        if frames not in MOSAIC_FRAMES:
+            raise ValueError(f"Unknown mosaic frames: {frames}")
+        self.__path = str(path)
+        self.__overlap = overlap
+        self.__frames = frames
+        self.__tile_shape = tuple(tile_shape)
+        self.__lock = threading.Lock()
+        self.__offsets = tile_offsets(xys, pixel_size, invert_x, invert_y)
+        height, width = self.__offsets.max(axis=0) + self.__tile_shape
+        depth = 1 if frames == "last" else n_frames
+        self.__shape = (depth, int(height), int(width))
+        self.__mosaic = open_npy_memmap(self.__path, np.uint16, self.__shape)
+        if overlap == "last":
+            self.__sum = self.__weight = self.__tile_weights = None
+        else:
+            self.__sum = open_npy_memmap(self.__path + ".sum.npy", np.float32, self.__shape)
+            self.__weight = open_npy_memmap(
+                self.__path + ".weight.npy", np.float32, self.__shape[1:]
+            )
+            self.__tile_weights = (
+                blend_weights(self.__tile_shape)
+                if overlap == "blend"
+                else np.ones(self.__tile_shape, dtype=np.float32)
+            )
+
+    @property
+    def path(self):
+        return self.__path
+
+    @property
+    def shape(self):
+        return self.__shape
+
+    @property
+    def offsets(self):
+        return self.__offsets
+
+    def write_position(self, number, event, stack):
+        tile = stack[-1:] if self.__frames == "last" else stack[: self.__shape[0]]
+        if tile.shape[1:] != self.__tile_shape:
+            raise ValueError(
+                f"Tile shape {tile.shape[1:]} does not match mosaic tile {self.__tile_shape}"
+            )
+        y0, x0 = self.__offsets[number]
+        rows = slice(y0, y0 + self.__tile_shape[0])
+        cols = slice(x0, x0 + self.__tile_shape[1])
+        with self.__lock:
+            if self.__overlap == "last":
+                self.__mosaic[: len(tile), rows, cols] = tile
+            else:
+                self.__sum[: len(tile), rows, cols] += tile * self.__tile_weights
+                self.__weight[rows, cols] += self.__tile_weights
+        return []
+
+    def close(self, band_rows=256):
+        if self.__overlap != "last":
+            # One frame of one band at a time, so that memory does not grow
+            # with the number of frames (--mosaic-frames all)
+            for r0 in range(0, self.__shape[1], band_rows):
+                band = slice(r0, r0 + band_rows)
+                weight = np.asarray(self.__weight[band])
+                covered = weight > 0
+                divisor = np.where(covered, weight, 1)
+                for t in range(self.__shape[0]):
+                    value = np.rint(self.__sum[t, band] / divisor)
+                    # Pixels with no weight keep what an earlier run wrote there
+                    self.__mosaic[t, band] = np.where(
+                        covered, value, self.__mosaic[t, band]
+                    ).astype(np.uint16)
+            del self.__sum, self.__weight
+            os.remove(self.__path + ".sum.npy")
+            os.remove(self.__path + ".weight.npy")
+            self.__overlap = "last"
+        self.__mosaic.flush()
@@ -0,0 +1,216 @@
+import queue
+import sys
+import threading
+import time
+
+
+STATUS_WORDS = ("status", "progress", "update")
+
+
+# A notifier delivers messages to a chat service. The status service calls
+# send() only from its worker thread, and get_requests() only from its
+# listener thread.
+class Notifier:
+    def send(self, topic, content):
+        raise NotImplementedError
+
+    def get_requests(self):
+        # Blocks (long-polls) until messages arrive; returns (topic, content)
+        # pairs. The default never receives anything.
+        time.sleep(60)
+        return []
+
+    def close(self):
+        pass
+
+
+# Keeps what would have been sent, for tests and for running without a chat
+# server. Requests can be injected with add_request().
+class StubNotifier(Notifier):
+    def __init__(self, send_delay=0.0, echo=False):
+        self.sent = []
+        self.__send_delay = send_delay
+        self.__echo = echo
+        self.__requests = queue.Queue()
+
+    def send(self, topic, content):
+        if self.__send_delay:
+            time.sleep(self.__send_delay)
+        self.sent.append((topic, content))
+        if self.__echo:
+            print(f"[{topic}] {content}", file=sys.stderr)
+
+    def add_request(self, topic, content):
+        self.__requests.put((topic, content))
+
+    def get_requests(self):
+        try:
+            return [self.__requests.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+
+
+# One persistent Zulip client. Incoming messages on the stream come from an
+# event queue registered once (and again if the server expires it), through
+# the long-polling get_events call, instead of re-fetching recent messages.
+class ZulipNotifier(Notifier):
+    def __init__(self, config_file, stream):
+        import zulip
+
+        self.__client = zulip.Client(config_file=config_file)
+        self.__stream = stream
+        self.__queue_id = None
+        self.__last_event_id = -1
+        self.__own_email = None
+
+    def send(self, topic, content):
+        result = self.__client.send_message(
+            {"type": "stream", "to": self.__stream, "topic": topic, "content": content}
+        )
+        if result.get("result") != "success":
+            raise RuntimeError(f"Zulip send failed: {result.get('msg', result)}")
+
+    def get_requests(self):
+        if self.__queue_id is None:
+            self.__register()
+        result = self.__client.get_events(
+            queue_id=self.__queue_id, last_event_id=self.__last_event_id
+        )
+        if result.get("result") != "success":
+            if result.get("code") == "BAD_EVENT_QUEUE_ID":
+                self.__queue_id = None
+                return []
+            raise RuntimeError(f"Zulip get_events failed: {result.get('msg', result)}")
+        requests = []
+        for event in result["events"]:
+            self.__last_event_id = max(self.__last_event_id, event["id"])
+            message = event.get("message")
+            if event["type"] != "message" or message is None:
+                continue
+            if message.get("sender_email") == self.__own_email:
+                continue
+            requests.append((message.get("subject", ""), message.get("content", "")))
+        return requests
+
+    def __register(self):
+        if self.__own_email is None:
+            self.__own_email = self.__client.get_profile().get("email")
+        result = self.__client.register(
+            event_types=["message"], narrow=[["stream", self.__stream]]
+        )
+        if result.get("result") != "success":
+            raise RuntimeError(f"Zulip register failed: {result.get('msg', result)}")
+        self.__queue_id = result["queue_id"]
+        self.__last_event_id = result["last_event_id"]
+
+
+# Sends status messages without ever blocking the caller. alert() only puts
+# the message on a bounded queue (dropping it if the queue is full); a single
+# worker thread collects what arrives within batch_interval, combines it into
+# one message per topic, and suppresses an alert identical to one sent less
+# than dedup_window seconds ago. If status_provider is given, a listener
+# thread long-polls the notifier for messages mentioning status, progress or
+# update and queues a reply with status_provider()'s text on the same topic.
+class StatusService:
+    def __init__(
+        self,
+        notifier,
+        topic="Acquisition status",
+        batch_interval=2.0,
+        dedup_window=300.0,
+        max_pending=100,
+        status_provider=None,
+    ):
+        self.__notifier = notifier
+        self.__topic = topic
+        self.__batch_interval = batch_interval
+        self.__dedup_window = dedup_window
+        self.__queue = queue.Queue(max_pending)
+        self.__last_sent = {}
+        self.__suppressed = {}
+        self.__running = True
+        self.dropped = 0
+        self.errors = 0
+        self.__worker = threading.Thread(target=self.__send_loop, daemon=True)
+        self.__worker.start()
+        self.__listener = None
+        if status_provider is not None:
+            self.__status_provider = status_provider
+            self.__listener = threading.Thread(target=self.__listen_loop, daemon=True)
+            self.__listener.start()
+
+    def alert(self, content, topic=None, dedup=True):
+        try:
+            self.__queue.put_nowait((topic or self.__topic, content, dedup))
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self, timeout=10.0):
+        # Sends what is queued (waiting at most `timeout` for the chat server)
+        self.__running = False
+        try:
+            self.__queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self.__worker.join(timeout)
+        self.__notifier.close()
+
+    def __send_loop(self):
+        while True:
+            item = self.__queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.__batch_interval
+            stop = False
+            while (remaining := deadline - time.monotonic()) > 0:
+                try:
+                    item = self.__queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self.__send_batch(batch)
+            if stop:
+                return
+
+    def __send_batch(self, batch):
+        now = time.monotonic()
+        by_topic = {}
+        for topic, content, dedup in batch:
+            counts = by_topic.setdefault(topic, {})
+            if dedup:
+                last = self.__last_sent.get((topic, content))
+                if last is not None and now - last < self.__dedup_window:
+                    key = (topic, content)
+                    self.__suppressed[key] = self.__suppressed.get(key, 0) + 1
+                    continue
+            counts[content] = counts.get(content, 0) + 1
+        for topic, counts in by_topic.items():
+            lines = []
+            for content, count in counts.items():
+                repeats = count + self.__suppressed.pop((topic, content), 0)
+                lines.append(content if repeats == 1 else f"{content} (x{repeats})")
+                self.__last_sent[(topic, content)] = now
+            if not lines:
+                continue
+            try:
+                self.__notifier.send(topic, "\n".join(lines))
+            except Exception as e:
+                self.errors += 1
+                print(f"Could not send status message: {e!r}", file=sys.stderr)
+
+    def __listen_loop(self):
+        while self.__running:
+            try:
+                requests = self.__notifier.get_requests()
+            except Exception as e:
+                self.errors += 1
+                print(f"Could not check for status requests: {e!r}", file=sys.stderr)
+                time.sleep(10)
+                continue
+            for topic, content in requests:
+                if any(word in content.lower() for word in STATUS_WORDS):
+                    self.alert(self.__status_provider(), topic=topic, dedup=False)
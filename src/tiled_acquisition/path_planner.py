@@ -0,0 +1,135 @@
+import numpy as np
+
+
+PATH_ORDERS = ("csv", "serpentine", "nearest")
+
+# Defaults are conservative figures for our motorized stages; override them
+# with --stage-speed / --z-speed.
+DEFAULT_XY_SPEED = 1000.0  # um/s
+DEFAULT_Z_SPEED = 100.0  # um/s
+DEFAULT_SETTLE_TIME = 0.1  # s per move
+
+# 2-opt is O(n^2) per pass; above this many positions only the greedy
+# nearest-neighbour tour is used.
+TWO_OPT_MAX_POSITIONS = 5000
+
+
+def move_times(a, b, xy_speed=DEFAULT_XY_SPEED, z_speed=DEFAULT_Z_SPEED):
+    # Stage travel time between XYZ points (broadcasting). X and Y move
+    # simultaneously; the focus move is counted on top of it, so that
+    # orderings with large Z jumps are penalized.
+    d = np.abs(np.asarray(b, dtype=float) - np.asarray(a, dtype=float))
+    return np.maximum(d[..., 0], d[..., 1]) / xy_speed + d[..., 2] / z_speed
+
+
+def path_travel_time(
+    xyz,
+    order=None,
+    xy_speed=DEFAULT_XY_SPEED,
+    z_speed=DEFAULT_Z_SPEED,
+    settle_time=DEFAULT_SETTLE_TIME,
+):
+    xyz = np.asarray(xyz, dtype=float)
+    if order is not None:
+        xyz = xyz[order]
+    if len(xyz) < 2:
+        return 0.0
+    moves = move_times(xyz[:-1], xyz[1:], xy_speed, z_speed)
+    return float(moves.sum() + settle_time * len(moves))
+
+
+def detect_rows(y, tolerance=None):
+    # Label positions with a row number, rows ordered by increasing Y. Positions
+    # whose Y differ by no more than `tolerance` share a row. By default the
+    # tolerance is half the typical row spacing.
+    y = np.asarray(y, dtype=float)
+    order = np.argsort(y, kind="stable")
+    gaps = np.diff(y[order])
+    if tolerance is None:
+        if len(gaps) == 0 or gaps.max() == 0:
+            return np.zeros(len(y), dtype=int)
+        row_gaps = gaps[gaps > 0.1 * gaps.max()]
+        tolerance = 0.5 * np.median(row_gaps)
+    rows = np.empty(len(y), dtype=int)
+    rows[order] = np.concatenate(([0], np.cumsum(gaps > tolerance)))
+    return rows
+
+
+def serpentine_order(xyz, row_tolerance=None):
+    xyz = np.asarray(xyz, dtype=float)
+    rows = detect_rows(xyz[:, 1], row_tolerance)
+    # Alternate the X direction on every other row
+    x = np.where(rows % 2 == 0, xyz[:, 0], -xyz[:, 0])
+    return np.lexsort((x, rows))
+
+
+def nearest_neighbour_order(
+    xyz, start=0, xy_speed=DEFAULT_XY_SPEED, z_speed=DEFAULT_Z_SPEED
+):
+    xyz = np.asarray(xyz, dtype=float)
+    n = len(xyz)
+    remaining = np.ones(n, dtype=bool)
+    order = np.empty(n, dtype=int)
+    current = start
+    for i in range(n):
+        order[i] = current
+        remaining[current] = False
+        if i == n - 1:
+            break
+        candidates = np.flatnonzero(remaining)
+        times = move_times(xyz[current], xyz[candidates], xy_speed, z_speed)
+        current = candidates[np.argmin(times)]
+    return order
+
+
+def two_opt(
+    xyz, order, xy_speed=DEFAULT_XY_SPEED, z_speed=DEFAULT_Z_SPEED, max_passes=10
+):
+    # Improve an open path (fixed start, free end) by segment reversal. For
+    # each i, the gain of reversing order[i..j] is computed for all j at once.
+    xyz = np.asarray(xyz, dtype=float)
+    order = np.array(order)
+    n = len(order)
+    for _ in range(max_passes):
+        improved = False
+        for i in range(1, n - 1):
+            p = xyz[order]
+            before, first = p[i - 1], p[i]
+            js = np.arange(i + 1, n)
+            delta = move_times(before, p[js], xy_speed, z_speed) - move_times(
+                before, first, xy_speed, z_speed
+            )
+            # The edge after the reversed segment (absent when j is the end)
+            inner = js[:-1]
+            delta[:-1] += move_times(first, p[inner + 1], xy_speed, z_speed)
+            delta[:-1] -= move_times(p[inner], p[inner + 1], xy_speed, z_speed)
+            best = np.argmin(delta)
+            if delta[best] < -1e-9:
+                j = js[best]
+                order[i : j + 1] = order[i : j + 1][::-1].copy()
+                improved = True
+        if not improved:
+            break
+    return order
+
+
+def plan_path(
+    xyz,
+    method="csv",
+    xy_speed=DEFAULT_XY_SPEED,
+    z_speed=DEFAULT_Z_SPEED,
+    row_tolerance=None,
+):
+    # Returns the acquisition order as indices into xyz (the original CSV row
+    # numbers), so tiles keep their original numbering.
+    xyz = np.asarray(xyz, dtype=float)
+    if method == "csv" or len(xyz) < 3:
+        return np.arange(len(xyz))
+    if method == "serpentine":
+        return serpentine_order(xyz, row_tolerance)
+    if method == "nearest":
+        order = nearest_neighbour_order(xyz, 0, xy_speed, z_speed)
+        if len(order) <= TWO_OPT_MAX_POSITIONS:
+            order = two_opt(xyz, order, xy_speed, z_speed)
+        return order
+    raise ValueError(f"Unknown path order: {method}")
@@ -0,0 +1,125 @@
+import json
+import os
+
+import numpy as np
+
+
+PLAN_SUFFIX = ".npz"
+PLAN_FORMAT = "tiled-acquisition position plan"
+PLAN_VERSION = 1
+
+
+def is_plan_file(filename):
+    return filename is not None and str(filename).lower().endswith(PLAN_SUFFIX)
+
+
+def validate_positions(xyz, source="Position CSV"):
+    # Checks the whole array at once; errors name the first bad row (1-based)
+    xyz = np.asarray(xyz, dtype=float)
+    if xyz.size == 0:
+        return np.empty((0, 3))
+    if xyz.ndim != 2 or xyz.shape[1] != 3:
+        raise ValueError(f"{source} rows must contain X, Y, Z; found shape {xyz.shape}")
+    bad = np.flatnonzero(~np.isfinite(xyz).all(axis=1))
+    if len(bad):
+        raise ValueError(
+            f"{source} row {bad[0] + 1} is not a finite X, Y, Z: {xyz[bad[0]].tolist()} "
+            f"({len(bad)} bad rows)"
+        )
+    return xyz
+
+
+def read_position_csv(filename):
+    # X, Y, Z rows as an (n, 3) array, parsed in one call
+    try:
+        xyz = np.loadtxt(filename, delimiter=",", ndmin=2, dtype=float)
+    except ValueError as e:
+        raise ValueError(f"Position CSV rows must contain X, Y, Z: {e}") from e
+    return validate_positions(xyz)
+
+
+# Positions to acquire, stored compactly so that large plans load in a few
+# milliseconds: XYZ in the original (CSV or grid) order, which gives the tile
+# numbers, and the acquisition order as indices into it. The stage names the
+# positions were recorded with are kept in a JSON header.
+class PositionPlan:
+    def __init__(self, xyz, order=None, xy_stage="", z_stage=""):
+        self.xyz = validate_positions(xyz, "Position plan")
+        n = len(self.xyz)
+        if order is None:
+            order = np.arange(n)
+        self.order = np.asarray(order, dtype=np.int64)
+        if self.order.ndim != 1 or len(self.order) and (
+            self.order.min() < 0 or self.order.max() >= n
+        ):
+            raise ValueError("Position plan order must be indices of its positions")
+        if len(np.unique(self.order)) != len(self.order):
+            raise ValueError("Position plan order visits a position twice")
+        self.xy_stage = xy_stage
+        self.z_stage = z_stage
+
+    def __len__(self):
+        return len(self.order)
+
+    def header(self):
+        return {
+            "format": PLAN_FORMAT,
+            "version": PLAN_VERSION,
+            "xy_stage": self.xy_stage,
+            "z_stage": self.z_stage,
+        }
+
+
+def save_plan(filename, plan):
+    tmp = f"{filename}.tmp"
+    with open(tmp, "wb") as f:
+        np.savez(
+            f, xyz=plan.xyz, order=plan.order, header=np.array(json.dumps(plan.header()))
+        )
+    os.replace(tmp, filename)
+
+
+def load_plan(filename):
+    with np.load(filename, allow_pickle=False) as data:
+        header = json.loads(str(data["header"]))
+        if header.get("format") != PLAN_FORMAT:
+            raise ValueError(f"{filename} is not a position plan")
+        if header.get("version", 0) > PLAN_VERSION:
+            raise ValueError(
+                f"{filename} is a version {header['version']} position plan; "
+                f"this version reads up to {PLAN_VERSION}"
+            )
+        return PositionPlan(
+            data["xyz"], data["order"], header.get("xy_stage", ""), header.get("z_stage", "")
+        )
+
+
+# The events of an MDASequence with stage_positions xyzs[order], a time plan
+# of `frames` loops at zero interval and axis order "pt", created only as the
+# runner asks for them; building the whole sequence up front (one validated
+# Position per tile) takes seconds for large plans. This is an iterable, not
+# an iterator: the runner passes iterators straight through, bypassing the
+# engine's event_iterator (hardware sequencing and move prefetching). useq is
+# imported only when iterating, to keep planning (--dry-run) quick.
+class PositionEvents:
+    def __init__(self, xyzs, order, frames):
+        self.__xyzs = np.asarray(xyzs, dtype=float)
+        self.__order = np.asarray(order, dtype=np.int64)
+        self.__frames = frames
+
+    def __len__(self):
+        return len(self.__order) * self.__frames
+
+    def __iter__(self):
+        from useq import MDAEvent
+
+        for p, (x, y, z) in enumerate(self.__xyzs[self.__order].tolist()):
+            for t in range(self.__frames):
+                yield MDAEvent(
+                    index={"t": t, "p": p},
+                    min_start_time=0.0,
+                    x_pos=x,
+                    y_pos=y,
+                    z_pos=z,
+                    reset_event_timer=t == 0,
+                )
@@ -0,0 +1,151 @@
+import sys
+import time
+
+
+DCC_DEVICE = "DCCModule2"
+PMT_CONNECTOR = 3
+PMT_POWER_GROUP = "PMT Power (HV)"
+
+DEFAULT_READY_TIMEOUT = 30.0  # s
+DEFAULT_POLL_INTERVAL = 0.01  # s, doubled after each poll up to the maximum
+DEFAULT_MAX_POLL_INTERVAL = 0.25  # s
+# HV readback within this fraction of the gain setting counts as ramped up
+HV_TOLERANCE = 0.98
+# Used between clearing overloads and switching HV back on when the DCC does
+# not report its overload state
+CLEAR_WAIT = 0.1  # s
+
+
+def overload_property(connector=PMT_CONNECTOR):
+    return f"C{connector}_Overloaded"
+
+
+def gain_property(connector=PMT_CONNECTOR):
+    return f"C{connector}_GainHV"
+
+
+def hv_readback_property(connector=PMT_CONNECTOR):
+    return f"C{connector}_GainHVReadback"
+
+
+# Switches the PMT's high voltage through the "PMT Power (HV)" config group
+# and waits until the DCC module reports the detector ready: overload flag
+# clear and HV readback at the gain setting. The state is polled from a short
+# interval with exponential backoff, so a PMT that recovers in 0.3 s costs
+# about 0.3 s rather than a fixed warm-up. If the DCC does not report the HV
+# readback, the ramp cannot be seen, and the fixed `warmup` wait is used for
+# it instead; a reported overload flag is then only polled while clearing it.
+# A PMT that is not ready within `timeout` is reported and used anyway; the
+# shut-off check catches any dark frames.
+#
+# Each reset is recorded with the tile number it happened at and how long the
+# PMT took to become ready again.
+class PMTController:
+    def __init__(
+        self,
+        core,
+        device=DCC_DEVICE,
+        connector=PMT_CONNECTOR,
+        warmup=5.0,
+        timeout=DEFAULT_READY_TIMEOUT,
+        poll_interval=DEFAULT_POLL_INTERVAL,
+        max_poll_interval=DEFAULT_MAX_POLL_INTERVAL,
+    ):
+        self.__core = core
+        self.__device = device
+        self.__overload = overload_property(connector)
+        self.__gain = gain_property(connector)
+        self.__readback = hv_readback_property(connector)
+        self.__warmup = warmup
+        self.__timeout = timeout
+        self.__poll_interval = poll_interval
+        self.__max_poll_interval = max_poll_interval
+        self.resets = []  # (tile number, seconds until ready, ready) per reset
+        self.timeouts = 0
+
+    def __has(self, prop):
+        return self.__core.hasProperty(self.__device, prop)
+
+    @property
+    def reports_state(self):
+        return self.__has(self.__overload) or self.__has(self.__readback)
+
+    def overloaded(self):
+        if not self.__has(self.__overload):
+            return False
+        return self.__core.getProperty(self.__device, self.__overload) == "Yes"
+
+    def hv_ready(self):
+        if not self.__has(self.__readback):
+            return True
+        gain = float(self.__core.getProperty(self.__device, self.__gain))
+        readback = float(self.__core.getProperty(self.__device, self.__readback))
+        return readback >= HV_TOLERANCE * gain
+
+    def is_ready(self):
+        return not self.overloaded() and self.hv_ready()
+
+    def wait_until(self, condition, timeout=None):
+        # Polls with backoff; returns whether the condition became true
+        timeout = self.__timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        interval = self.__poll_interval
+        while not condition():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(interval, remaining))
+            interval = min(2 * interval, self.__max_poll_interval)
+        return True
+
+    def wait_ready(self):
+        # Returns (ready, seconds waited)
+        start = time.monotonic()
+        if not self.__has(self.__readback):
+            time.sleep(self.__warmup)
+            return True, time.monotonic() - start
+        ready = self.wait_until(self.is_ready)
+        if not ready:
+            self.timeouts += 1
+            print(
+                f"Warning: PMT not ready {self.__timeout:.1f} s after switching on "
+                f"(overloaded: {self.overloaded()}); continuing",
+                file=sys.stderr,
+            )
+        return ready, time.monotonic() - start
+
+    def power_on(self):
+        self.__core.setConfig(PMT_POWER_GROUP, "On")
+        return self.wait_ready()
+
+    def power_off(self):
+        self.__core.setConfig(PMT_POWER_GROUP, "Off")
+
+    def reset(self, number=None):
+        # HV off, clear overloads, HV on and wait; returns seconds taken
+        start = time.monotonic()
+        core = self.__core
+        core.setConfig(PMT_POWER_GROUP, "Off")
+        core.setProperty(self.__device, "ClearOverloads", "Clear")
+        if self.__has(self.__overload):
+            self.wait_until(lambda: not self.overloaded())
+        else:
+            time.sleep(CLEAR_WAIT)
+        ready, _ = self.power_on()
+        duration = time.monotonic() - start
+        self.resets.append((number, duration, ready))
+        return duration
+
+    def summary(self):
+        durations = [duration for _, duration, _ in self.resets]
+        by_position = {}
+        for number, _, _ in self.resets:
+            by_position[number] = by_position.get(number, 0) + 1
+        return {
+            "reports_state": self.reports_state,
+            "resets": len(self.resets),
+            "reset_time_s": sum(durations),
+            "max_reset_s": max(durations, default=0.0),
+            "timeouts": self.timeouts,
+            "resets_by_position": {str(k): v for k, v in by_position.items()},
+        }
@@ -0,0 +1,88 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+
+# The original check looked at the last 16384 pixels, which is the bottom
+# quarter of a 256 x 256 frame.
+DEFAULT_CHECKED_PIXELS = 16384
+DEFAULT_CHECKED_FRACTION = 0.25
+
+
+@dataclass
+class FrameStatistics:
+    photons: np.ndarray  # Photons in each (unaccumulated) frame
+    checked_nonzero: np.ndarray  # Nonzero checked pixels in each frame
+    shut_off: np.ndarray  # Whether each frame looks like PMT shut-off
+
+    def rows(self):
+        for i in range(len(self.photons)):
+            yield i, int(self.photons[i]), int(self.checked_nonzero[i]), bool(self.shut_off[i])
+
+
+# Flags a frame as PMT shut-off when no photons arrived in the trailing
+# pixels of the frame (the last part of the raster scan). Frames are accumulated,
+# so "no photons" means the checked pixels are unchanged from the previous
+# frame. A detector provides:
+#   - frame_is_shut_off(stack, index): incremental check of one frame, called
+#     as frames arrive; only touches frames index-1 and index
+#   - shut_off_frames(stack): batched check of a whole TYX stack
+#   - frame_statistics(stack): per-frame counts for export
+# Other detectors can be passed to PMTCheckingEngine as long as they provide
+# the same methods.
+class TailRegionDetector:
+    def __init__(self, n_pixels=DEFAULT_CHECKED_PIXELS, stride=1, chunk=4096):
+        if n_pixels < 1 or stride < 1 or chunk < 1:
+            raise ValueError("n_pixels, stride and chunk must be positive")
+        self.n_pixels = n_pixels
+        self.stride = stride
+        self.chunk = chunk
+
+    @classmethod
+    def for_resolution(cls, resolution, fraction=DEFAULT_CHECKED_FRACTION, stride=1):
+        if not 0 < fraction <= 1:
+            raise ValueError(f"Checked fraction must be in (0, 1]; got {fraction}")
+        return cls(max(1, round(resolution * resolution * fraction)), stride)
+
+    def region(self, frames):
+        # Checked pixels of one frame (YX) or of each frame in a stack (TYX)
+        flat = frames.reshape(-1) if frames.ndim <= 2 else frames.reshape(len(frames), -1)
+        return flat[..., -self.n_pixels :: self.stride]
+
+    def is_shut_off(self, image):
+        return not np.any(self.region(np.asarray(image)))
+
+    def frame_is_shut_off(self, stack, index):
+        current = self.region(stack[index])
+        previous = self.region(stack[index - 1]) if index > 0 else None
+        # Compare a chunk at a time; a frame with photons almost always
+        # differs within the first chunk.
+        for start in range(0, len(current), self.chunk):
+            cur = current[start : start + self.chunk]
+            if previous is None:
+                if np.any(cur):
+                    return False
+            elif not np.array_equal(cur, previous[start : start + self.chunk]):
+                return False
+        return True
+
+    def checked_nonzero_counts(self, stack):
+        # Equivalent to counting nonzero checked pixels in
+        # unaccumulate_images(stack), without materializing the differences
+        region = self.region(stack)
+        counts = np.empty(len(region), dtype=np.int64)
+        counts[0] = np.count_nonzero(region[0])
+        counts[1:] = np.count_nonzero(region[1:] != region[:-1], axis=1)
+        return counts
+
+    def shut_off_frames(self, stack):
+        return self.checked_nonzero_counts(stack) == 0
+
+    def frame_statistics(self, stack):
+        totals = stack.reshape(len(stack), -1).sum(axis=1, dtype=np.int64)
+        nonzero = self.checked_nonzero_counts(stack)
+        return FrameStatistics(
+            photons=np.diff(totals, prepend=0),
+            checked_nonzero=nonzero,
+            shut_off=nonzero == 0,
+        )
@@ -0,0 +1,196 @@
+import csv
+import json
+import re
+
+import numpy as np
+
+
+STAGE_POSITIONS_PATH = ("map", "StagePositions", "array")
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_DECODER = json.JSONDecoder()
+
+
+def _skip(text, i):
+    return _WHITESPACE.match(text, i).end()
+
+
+def _expect(text, i, char):
+    i = _skip(text, i)
+    if text[i : i + 1] != char:
+        raise ValueError(f"Expected {char!r} at offset {i} of position list")
+    return i + 1
+
+
+def find_value(text, path, i=0):
+    # Offset of the JSON value at `path` (a sequence of object keys) in text,
+    # decoding only the keys on the way and the values skipped over
+    for key in path:
+        i = _expect(text, i, "{")
+        while True:
+            i = _skip(text, i)
+            if text[i : i + 1] == "}":
+                raise KeyError(key)
+            name, i = _DECODER.raw_decode(text, i)
+            i = _skip(text, _expect(text, i, ":"))
+            if name == key:
+                break
+            _, i = _DECODER.raw_decode(text, i)
+            i = _skip(text, i)
+            if text[i : i + 1] == ",":
+                i += 1
+    return i
+
+
+# Columns for one device in a position list: values[i] is the device's
+# Position_um at position i (NaN-padded), and present[i] says whether
+# position i has that device at all.
+class DeviceColumn:
+    def __init__(self, n_positions, n_axes):
+        self.values = np.full((n_positions, n_axes), np.nan)
+        self.present = np.zeros(n_positions, dtype=bool)
+
+
+# A Micro-Manager position list (.pos, property map format 2) read in a single
+# pass into NumPy columns: labels, default XY and Z stage names, and one
+# DeviceColumn per device (devices maps each device name to its column).
+# Positions are decoded from the file text one at a time and not kept; only
+# the text and the offsets of each position in it are, so that write() can
+# copy unchanged positions through as they were and re-encode only those
+# that get a new Z.
+class PositionList:
+    def __init__(self, text):
+        self.__text = text
+        i = _expect(text, find_value(text, STAGE_POSITIONS_PATH), "[")
+        starts, ends = [], []
+        labels, xy_stages, z_stages = [], [], []
+        entries = {}  # device -> (position indices, values)
+        i = _skip(text, i)
+        while text[i : i + 1] != "]":
+            if starts:
+                i = _skip(text, _expect(text, i, ","))
+            p, end = _DECODER.raw_decode(text, i)
+            n = len(starts)
+            starts.append(i)
+            ends.append(end)
+            labels.append(p.get("Label", {}).get("scalar", ""))
+            xy_stages.append(p["DefaultXYStage"]["scalar"])
+            z_stages.append(p["DefaultZStage"]["scalar"])
+            for devpos in p["DevicePositions"]["array"]:
+                indices, values = entries.setdefault(devpos["Device"]["scalar"], ([], []))
+                indices.append(n)
+                values.append(devpos["Position_um"]["array"])
+            i = _skip(text, end)
+        self.__starts = np.array(starts, dtype=np.int64)
+        self.__ends = np.array(ends, dtype=np.int64)
+        self.labels = np.array(labels, dtype=object)
+        self.default_xy_stages = np.array(xy_stages, dtype=object)
+        self.default_z_stages = np.array(z_stages, dtype=object)
+        self.devices = {}
+        for device, (indices, values) in entries.items():
+            n_axes = max(len(v) for v in values)
+            column = DeviceColumn(len(starts), n_axes)
+            for k, v in zip(indices, values):
+                column.values[k, : len(v)] = v
+            column.present[indices] = True
+            self.devices[device] = column
+
+    def __len__(self):
+        return len(self.__starts)
+
+    @property
+    def xy_stage(self):
+        return uniform_value(self.default_xy_stages)
+
+    def z_stage(self, allow_blank=False):
+        return uniform_value(self.default_z_stages, "" if allow_blank else None)
+
+    def xy(self, stage=None):
+        column = self.devices.get(stage or self.xy_stage)
+        if column is None or not column.present.all():
+            raise ValueError("Missing xy")
+        if column.values.shape[1] != 2:
+            raise ValueError("XY position not 2D")
+        return column.values
+
+    def z(self, stage=None):
+        # Z of each position, NaN where the position has none
+        column = self.devices.get(stage or self.z_stage(allow_blank=True))
+        if column is None:
+            return np.full(len(self), np.nan)
+        if column.values.shape[1] != 1:
+            raise ValueError("Z position not scalar")
+        return np.where(column.present, column.values[:, 0], np.nan)
+
+    def has_z(self, stage=None):
+        return ~np.isnan(self.z(stage))
+
+    def write(self, filename, z=None, z_stage=None, indent=2):
+        # Writes the position list, with each position's Z set to z[i] on
+        # z_stage if z is given; otherwise the file is written as it was read.
+        # Positions are written one at a time.
+        text = self.__text
+        if z is not None:
+            z = np.asarray(z, dtype=float)
+            if len(z) != len(self):
+                raise ValueError("Length mismatch")
+            z_stage = z_stage or self.z_stage(allow_blank=True)
+        with open(filename, "w") as f:
+            previous_end = 0
+            for k, (start, end) in enumerate(zip(self.__starts.tolist(), self.__ends.tolist())):
+                separator = text[previous_end:start]
+                f.write(separator)
+                if z is None:
+                    f.write(text[start:end])
+                else:
+                    p = with_z(_DECODER.raw_decode(text, start)[0], z_stage, float(z[k]))
+                    f.write(self.__encode(p, separator, indent))
+                previous_end = end
+            f.write(text[previous_end:])
+
+    @staticmethod
+    def __encode(p, separator, indent):
+        # Indented like the position's first line (separator is the text
+        # between it and the previous position), or compact if the position
+        # does not start its own line
+        if "\n" not in separator:
+            return json.dumps(p)
+        leading = separator[separator.rfind("\n") + 1 :]
+        return json.dumps(p, indent=indent).replace("\n", "\n" + leading)
+
+    def write_csv(self, filename, z=None):
+        xyz = np.column_stack((self.xy(), self.z() if z is None else z))
+        with open(filename, "w", newline="") as f:
+            csv.writer(f).writerows(xyz[~np.isnan(xyz[:, 2])].tolist())
+
+
+def uniform_value(values, blank_value=None):
+    unique = set(values.tolist())
+    if len(unique) == 1:
+        return unique.pop()
+    if blank_value is not None and len(unique) == 2 and blank_value in unique:
+        unique.remove(blank_value)
+        return unique.pop()
+    raise ValueError(f"Non-uniform value: {sorted(unique)}")
+
+
+def with_z(p, z_stage, z):
+    # Position p with its default Z stage set and its Z replaced or added
+    p["DefaultZStage"]["scalar"] = z_stage
+    devposs = p["DevicePositions"]["array"]
+    for devpos in devposs:
+        if devpos["Device"]["scalar"] == z_stage:
+            devpos["Position_um"]["array"] = [z]
+            return p
+    devposs.append(
+        {
+            "Device": {"type": "STRING", "scalar": z_stage},
+            "Position_um": {"type": "DOUBLE", "array": [z]},
+        }
+    )
+    return p
+
+
+def read_position_list(filename):
+    with open(filename) as f:
+        return PositionList(f.read())
@@ -0,0 +1,264 @@
+import multiprocessing
+import queue
+import threading
+import time
+import traceback
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class FrameWorkerError(RuntimeError):
+    pass
+
+
+# Preallocated TYX stacks in one block of shared memory, so that worker
+# processes can read a position's frames without copying or pickling them.
+# Slots are handed out only by the process that created the ring: acquire()
+# returns a free slot index, or None when every slot is in use (after waiting
+# up to `timeout` seconds; None waits indefinitely). A slot stays in use until
+# release() is called for it; nothing is reclaimed implicitly. Other processes
+# attach to the same memory with SharedFrameRing.attach(ring.spec()).
+class SharedFrameRing:
+    def __init__(self, n_slots, shape, dtype=np.uint16, name=None):
+        if n_slots < 1:
+            raise ValueError("Need at least one slot")
+        self.__n_slots = n_slots
+        self.__shape = tuple(int(n) for n in shape)
+        self.__dtype = np.dtype(dtype)
+        self.__owner = name is None
+        if self.__owner:
+            size = n_slots * int(np.prod(self.__shape)) * self.__dtype.itemsize
+            self.__shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        else:
+            # Only the creating process may unlink the memory
+            self.__shm = shared_memory.SharedMemory(name=name, track=False)
+        self.__slots = np.ndarray(
+            (n_slots, *self.__shape), dtype=self.__dtype, buffer=self.__shm.buf
+        )
+        self.__free = list(range(n_slots))
+        self.__cond = threading.Condition()
+
+    @classmethod
+    def attach(cls, spec):
+        name, n_slots, shape, dtype = spec
+        return cls(n_slots, shape, dtype, name=name)
+
+    def spec(self):
+        return (self.__shm.name, self.__n_slots, self.__shape, self.__dtype.str)
+
+    @property
+    def n_slots(self):
+        return self.__n_slots
+
+    @property
+    def shape(self):
+        return self.__shape
+
+    @property
+    def in_use(self):
+        return self.__n_slots - len(self.__free)
+
+    def fits(self, shape):
+        # Whether a stack of this shape (with at most the slots' frame count)
+        # can be held in a slot
+        shape = tuple(shape)
+        return len(shape) == 3 and shape[0] <= self.__shape[0] and shape[1:] == self.__shape[1:]
+
+    def slot(self, index):
+        return self.__slots[index]
+
+    def acquire(self, timeout=0):
+        with self.__cond:
+            if not self.__cond.wait_for(lambda: self.__free, timeout):
+                return None
+            return self.__free.pop(0)
+
+    def release(self, index):
+        with self.__cond:
+            if index in self.__free or not 0 <= index < self.__n_slots:
+                raise ValueError(f"Slot {index} is not in use")
+            self.__free.append(index)
+            self.__cond.notify_all()
+
+    def close(self):
+        self.__slots = None
+        try:
+            self.__shm.close()
+        except BufferError:
+            # A view of a slot is still referenced; the mapping goes away
+            # with it
+            pass
+        if self.__owner:
+            self.__shm.unlink()
+            self.__owner = False
+
+
+# Worker processes that save positions from a SharedFrameRing, so that image
+# encoding and frame statistics do not compete with the acquisition thread
+# for the GIL. submit() sends a slot descriptor (slot, tile number, frame
+# count, event) to the workers; a worker writes the stack in that slot with
+# its own output backend (made by calling make_backend, which must be
+# picklable) and computes the detector's frame statistics. A collector thread
+# in this process then calls the descriptor's `done` callback with the files
+# written, the statistics and the worker's trace spans, and releases the slot.
+# Errors, in a worker or a callback, are raised from the next submit(),
+# flush() or close(), as with BackgroundWriter. The pool owns the ring and
+# unlinks it on close().
+class FrameWorkerPool:
+    def __init__(self, ring, make_backend, n_workers=1, detector=None, context="spawn"):
+        if n_workers < 1:
+            raise ValueError("Need at least one worker")
+        ctx = multiprocessing.get_context(context)
+        self.__ring = ring
+        self.__tasks = ctx.Queue()
+        self.__results = ctx.Queue()
+        self.__callbacks = {}
+        self.__errors = []
+        self.__cond = threading.Condition()
+        self.__closed = False
+        self.__worker_died = False
+        self.__workers = [
+            ctx.Process(
+                target=_run_worker,
+                args=(ring.spec(), make_backend, detector, self.__tasks, self.__results),
+                name=f"FrameWorker-{i}",
+                daemon=True,
+            )
+            for i in range(n_workers)
+        ]
+        for worker in self.__workers:
+            worker.start()
+        self.__collector = threading.Thread(
+            target=self.__collect, name="FrameWorkerCollector", daemon=True
+        )
+        self.__collector.start()
+
+    @property
+    def ring(self):
+        return self.__ring
+
+    @property
+    def n_workers(self):
+        return len(self.__workers)
+
+    @property
+    def pending(self):
+        with self.__cond:
+            return len(self.__callbacks)
+
+    def submit(self, slot, number, count, event, done):
+        if self.__closed:
+            raise FrameWorkerError("Frame workers are closed")
+        self.raise_if_failed()
+        with self.__cond:
+            self.__callbacks[slot] = done
+        self.__tasks.put((slot, number, count, event))
+
+    def raise_if_failed(self):
+        with self.__cond:
+            if not self.__errors:
+                return
+            first = self.__errors[0]
+            count = len(self.__errors)
+        raise FrameWorkerError(
+            f"{count} frame worker save(s) failed; first error: {first}"
+        ) from first
+
+    def flush(self):
+        with self.__cond:
+            self.__cond.wait_for(lambda: not self.__callbacks)
+        self.raise_if_failed()
+
+    def close(self):
+        if not self.__closed:
+            try:
+                with self.__cond:
+                    self.__cond.wait_for(lambda: not self.__callbacks)
+            finally:
+                self.__closed = True
+                for _ in self.__workers:
+                    self.__tasks.put(None)
+                for worker in self.__workers:
+                    worker.join()
+                self.__results.put(None)
+                self.__collector.join()
+                self.__ring.close()
+        self.raise_if_failed()
+
+    def __collect(self):
+        while True:
+            try:
+                item = self.__results.get(timeout=0.5)
+            except queue.Empty:
+                self.__check_workers()
+                continue
+            if item is None:
+                return
+            slot, number, result, error = item
+            with self.__cond:
+                if slot not in self.__callbacks:
+                    continue  # Already given up on by __check_workers
+                done = self.__callbacks.pop(slot)
+            try:
+                if error is not None:
+                    raise FrameWorkerError(f"Saving position {number} failed:\n{error}")
+                done(result)
+            except Exception as e:
+                with self.__cond:
+                    self.__errors.append(e)
+            finally:
+                self.__ring.release(slot)
+                with self.__cond:
+                    self.__cond.notify_all()
+
+    def __check_workers(self):
+        # A worker that died (killed, out of memory) never reports back; fail
+        # the outstanding saves instead of waiting for them forever
+        if self.__closed or self.__worker_died:
+            return
+        dead = [w for w in self.__workers if w.exitcode is not None]
+        if not dead:
+            return
+        self.__worker_died = True
+        with self.__cond:
+            lost = list(self.__callbacks)
+            self.__callbacks.clear()
+            self.__errors.append(
+                FrameWorkerError(
+                    f"{dead[0].name} exited with code {dead[0].exitcode}; "
+                    f"{len(lost)} position(s) were not saved"
+                )
+            )
+            self.__cond.notify_all()
+        for slot in lost:
+            self.__ring.release(slot)
+
+
+def _run_worker(spec, make_backend, detector, tasks, results):
+    ring = SharedFrameRing.attach(spec)
+    backend = make_backend()
+    try:
+        while (task := tasks.get()) is not None:
+            slot, number, count, event = task
+            try:
+                stack = ring.slot(slot)[:count]
+                start = time.perf_counter_ns()
+                files = backend.write_position(number, event, stack)
+                written = time.perf_counter_ns()
+                statistics = None if detector is None else detector.frame_statistics(stack)
+                end = time.perf_counter_ns()
+                del stack
+                result = {
+                    "files": files,
+                    "statistics": statistics,
+                    # perf_counter_ns is system-wide, so these line up with
+                    # the acquisition process's spans
+                    "spans": [("image_write", start, written), ("frame_statistics", written, end)],
+                }
+                results.put((slot, number, result, None))
+            except Exception:
+                results.put((slot, number, None, traceback.format_exc()))
+    finally:
+        backend.close()
+        ring.close()
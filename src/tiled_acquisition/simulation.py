@@ -0,0 +1,369 @@
+import os
+import threading
+import time
+
+import numpy as np
+from pymmcore_plus.experimental.unicore import (
+    GenericDevice,
+    ShutterDevice,
+    SimpleCameraDevice,
+    StageDevice,
+    UniMMCore,
+    XYStageDevice,
+    pymm_property,
+)
+
+from .backends import OutputBackend
+
+
+# Stand-in for the SLIM rig built from pymmcore-plus Python devices, so that
+# PMTCheckingEngine can run (in tests and benchmarks) without Micro-Manager
+# or hardware. Device labels and the properties that main.py sets match the
+# real configuration:
+#   OSc-LSM     scanner "camera"; accumulates photon counts over the frames
+#               of a sequence and writes placeholder SDT/SPC/JSON files under
+#               BH-TCSPC-FLIMFileNamePrefix like the BH-TCSPC saving does
+#   DCCModule2  PMT controller; the PMT trips at random (dropout_rate per
+#               frame) and stays dark until overloads are cleared (which
+#               takes pmt_clear_time) and HV is switched back on, plus
+#               pmt_recovery_time while the HV ramps up. The overload flag
+#               and HV readback are reported like the real DCC does
+#   XYStage, ZStage  stages that report busy for move_time after each move
+#               (with focus_surface given, images blur with distance from it)
+#   Shutter     laser shutter
+# and the "PMT Power (HV)" config group.
+
+
+class SimulatedDCC(GenericDevice):
+    def __init__(self, recovery_time=0.0, seed=0, clear_time=0.0):
+        super().__init__()
+        self.recovery_time = recovery_time
+        self.clear_time = clear_time
+        self.overloaded = False
+        self.hv_on = False
+        self.hv_on_at = 0.0
+        self.ready_at = 0.0
+        self.cleared_at = 0.0
+        self.gain = 70.0
+        self.resets = 0
+        self.trips = 0
+        self.__rng = np.random.default_rng(seed)
+        self.__lock = threading.Lock()
+
+    def detecting(self):
+        now = time.monotonic()
+        return self.hv_on and not self.overloaded and now >= max(self.ready_at, self.cleared_at)
+
+    def maybe_trip(self, probability):
+        with self.__lock:
+            if self.detecting() and self.__rng.random() < probability:
+                self.overloaded = True
+                self.trips += 1
+
+    @pymm_property(name="C3_GainHV", limits=(0.0, 100.0))
+    def gain_hv(self) -> float:
+        return self.gain
+
+    @gain_hv.setter
+    def gain_hv(self, value: float):
+        self.gain = float(value)
+
+    @pymm_property(name="C3_HV", allowed_values=["On", "Off"])
+    def hv(self) -> str:
+        return "On" if self.hv_on else "Off"
+
+    @hv.setter
+    def hv(self, value: str):
+        with self.__lock:
+            was_on, self.hv_on = self.hv_on, value == "On"
+            if self.hv_on and not was_on:
+                self.hv_on_at = time.monotonic()
+                self.ready_at = self.hv_on_at + self.recovery_time
+
+    @pymm_property(name="C3_Overloaded", allowed_values=["Yes", "No"])
+    def overload_flag(self) -> str:
+        with self.__lock:
+            flagged = self.overloaded or time.monotonic() < self.cleared_at
+        return "Yes" if flagged else "No"
+
+    @pymm_property(name="C3_GainHVReadback")
+    def gain_hv_readback(self) -> float:
+        # Ramps up over recovery_time and settles at the gain when ready
+        now = time.monotonic()
+        if not self.hv_on:
+            return 0.0
+        if now >= self.ready_at:
+            return self.gain
+        return self.gain * 0.95 * (now - self.hv_on_at) / self.recovery_time
+
+    @pymm_property(name="ClearOverloads", allowed_values=["Clear", "-"])
+    def clear_overloads(self) -> str:
+        return "-"
+
+    @clear_overloads.setter
+    def clear_overloads(self, value: str):
+        if value == "Clear":
+            with self.__lock:
+                if self.overloaded:
+                    self.cleared_at = time.monotonic() + self.clear_time
+                self.overloaded = False
+                self.resets += 1
+
+
+def box_blur(image, radius):
+    # Mean over a (2 * radius + 1)^2 box, with edge pixels repeated
+    if radius < 1:
+        return image
+    k = 2 * radius + 1
+    a = np.pad(image, radius, mode="edge")
+    for axis in (0, 1):
+        c = np.insert(np.cumsum(a, axis=axis), 0, 0, axis=axis)
+        n = c.shape[axis]
+        a = (np.take(c, np.arange(k, n), axis) - np.take(c, np.arange(n - k), axis)) / k
+    return a
+
+
+class SimulatedScanner(SimpleCameraDevice):
+    def __init__(
+        self,
+        dcc,
+        resolution=256,
+        frame_time=0.0,
+        dropout_rate=0.0,
+        photon_rate=0.02,
+        sdt_bytes_per_frame=4096,
+        seed=0,
+    ):
+        super().__init__()
+        self.dcc = dcc
+        self.resolution = resolution
+        self.frame_time = frame_time
+        self.dropout_rate = dropout_rate
+        self.sdt_bytes_per_frame = sdt_bytes_per_frame
+        self.expose_time = 0.0
+        self.readout_time = 0.0
+        self.frames = 0
+        self.__prefix = ""
+        self.__saving = "No"
+        self.__zoom = 1.0
+        self.__exposure = 10.0
+        rng = np.random.default_rng(seed)
+        shape = (8, resolution, resolution)
+        self.__increments = (rng.random(shape) < photon_rate).astype(np.uint16)
+        self.__accumulated = np.zeros((resolution, resolution), dtype=np.uint16)
+        self.__in_sequence = False
+        # Set by make_simulated_core when the sample has a focus surface
+        self.focus_surface = None  # (x, y) -> Z of best focus
+        self.stage_position = None  # () -> (x, y, z)
+        self.depth_of_field = 2.0
+        self.focus_photons = 5.0  # mean photons per pixel per frame in focus
+        self.__rng = rng
+        self.__texture = box_blur((rng.random(shape[1:]) < 0.05).astype(float), 1)
+        self.__texture *= 1 / self.__texture.mean()
+
+    def sensor_shape(self):
+        return (self.resolution, self.resolution)
+
+    def dtype(self):
+        return np.uint16
+
+    def get_exposure(self):
+        return self.__exposure
+
+    def set_exposure(self, exposure):
+        self.__exposure = exposure
+
+    @pymm_property(name="BH-TCSPC-FLIMFileNamePrefix")
+    def file_prefix(self) -> str:
+        return self.__prefix
+
+    @file_prefix.setter
+    def file_prefix(self, value: str):
+        self.__prefix = value
+
+    @pymm_property(name="BH-TCSPC-FLIMFileSaving", allowed_values=["Yes", "No"])
+    def file_saving(self) -> str:
+        return self.__saving
+
+    @file_saving.setter
+    def file_saving(self, value: str):
+        self.__saving = value
+
+    @pymm_property(name="LSM-ZoomFactor")
+    def zoom(self) -> float:
+        return self.__zoom
+
+    @zoom.setter
+    def zoom(self, value: float):
+        self.__zoom = float(value)
+
+    def start_sequence(self, n, get_buffer):
+        # Counts accumulate over the frames of a sequence; a single snap
+        # (e.g. an autofocus scan) starts from zero
+        self.__accumulated[:] = 0
+        self.__in_sequence = True
+        try:
+            yield from super().start_sequence(n, get_buffer)
+        finally:
+            self.__in_sequence = False
+
+    def snap(self, buffer):
+        if not self.__in_sequence:
+            self.__accumulated[:] = 0
+        start = time.perf_counter()
+        if self.frame_time:
+            time.sleep(self.frame_time)
+        exposed = time.perf_counter()
+        self.dcc.maybe_trip(self.dropout_rate)
+        if self.dcc.detecting():
+            if self.focus_surface is None:
+                self.__accumulated += self.__increments[self.frames % len(self.__increments)]
+            else:
+                self.__accumulated += self.__defocused_frame()
+        buffer[:] = self.__accumulated
+        if self.__saving == "Yes" and self.__prefix:
+            self.__write_files()
+        self.frames += 1
+        self.expose_time += exposed - start
+        self.readout_time += time.perf_counter() - exposed
+        return {}
+
+    def __defocused_frame(self):
+        x, y, z = self.stage_position()
+        defocus = abs(z - self.focus_surface(x, y))
+        radius = int(min(defocus / self.depth_of_field, self.resolution // 4))
+        rate = box_blur(self.__texture, radius) * self.focus_photons
+        return self.__rng.poisson(rate).astype(np.uint16)
+
+    def __write_files(self):
+        base = f"{self.__prefix}_0000"
+        if not os.path.exists(f"{base}.sdt"):
+            for ext in ("spc", "json"):
+                with open(f"{base}.{ext}", "wb") as f:
+                    f.write(b"\0" * 64)
+        with open(f"{base}.sdt", "ab") as f:
+            f.write(b"\0" * self.sdt_bytes_per_frame)
+
+
+class _MovingStage:
+    def _start_move(self):
+        self._busy_until = time.monotonic() + self.move_time
+
+    def busy(self):
+        return time.monotonic() < getattr(self, "_busy_until", 0.0)
+
+    def home(self):
+        pass
+
+    def stop(self):
+        self._busy_until = 0.0
+
+
+class SimulatedXYStage(_MovingStage, XYStageDevice):
+    def __init__(self, move_time=0.0):
+        super().__init__()
+        self.move_time = move_time
+        self.__position = (0.0, 0.0)
+
+    def set_position_um(self, x, y):
+        if (x, y) != self.__position:
+            self._start_move()
+        self.__position = (x, y)
+
+    def get_position_um(self):
+        return self.__position
+
+    def set_origin_x(self):
+        pass
+
+    def set_origin_y(self):
+        pass
+
+
+class SimulatedZStage(_MovingStage, StageDevice):
+    def __init__(self, move_time=0.0):
+        super().__init__()
+        self.move_time = move_time
+        self.__position = 0.0
+
+    def set_position_um(self, z):
+        if z != self.__position:
+            self._start_move()
+        self.__position = z
+
+    def get_position_um(self):
+        return self.__position
+
+    def set_origin(self):
+        pass
+
+
+class SimulatedShutter(ShutterDevice):
+    def __init__(self):
+        super().__init__()
+        self.__open = False
+
+    def get_open(self):
+        return self.__open
+
+    def set_open(self, open):
+        self.__open = open
+
+
+def make_simulated_core(
+    resolution=256,
+    frame_time=0.0,
+    move_time=0.0,
+    dropout_rate=0.0,
+    pmt_recovery_time=0.0,
+    photon_rate=0.02,
+    sdt_bytes_per_frame=4096,
+    seed=0,
+    focus_surface=None,
+    pmt_clear_time=0.0,
+):
+    core = UniMMCore()
+    dcc = SimulatedDCC(pmt_recovery_time, seed, pmt_clear_time)
+    scanner = SimulatedScanner(
+        dcc, resolution, frame_time, dropout_rate, photon_rate, sdt_bytes_per_frame, seed
+    )
+    core.loadPyDevice("DCCModule2", dcc)
+    core.loadPyDevice("OSc-LSM", scanner)
+    xy_stage = SimulatedXYStage(move_time)
+    z_stage = SimulatedZStage(move_time)
+    core.loadPyDevice("XYStage", xy_stage)
+    core.loadPyDevice("ZStage", z_stage)
+    if focus_surface is not None:
+        scanner.focus_surface = focus_surface
+        scanner.stage_position = lambda: (*xy_stage.get_position_um(), z_stage.get_position_um())
+    core.loadPyDevice("Shutter", SimulatedShutter())
+    core.initializeAllDevices()
+    core.setCameraDevice("OSc-LSM")
+    core.setXYStageDevice("XYStage")
+    core.setFocusDevice("ZStage")
+    core.setShutterDevice("Shutter")
+    for state in ("On", "Off"):
+        core.defineConfig("PMT Power (HV)", state, "DCCModule2", "C3_HV", state)
+    return core
+
+
+# Wraps another backend and holds each write until the simulated disk, with
+# the given sustained bandwidth, would have finished it. Writes from several
+# threads take turns, as they would on one disk.
+class ThrottledBackend(OutputBackend):
+    def __init__(self, backend, bytes_per_second):
+        self.__backend = backend
+        self.__bytes_per_second = bytes_per_second
+        self.__lock = threading.Lock()
+
+    def write_position(self, number, event, stack):
+        with self.__lock:
+            start = time.perf_counter()
+            files = self.__backend.write_position(number, event, stack)
+            remaining = stack.nbytes / self.__bytes_per_second - (time.perf_counter() - start)
+            if remaining > 0:
+                time.sleep(remaining)
+        return files
+
+    def close(self):
+        self.__backend.close()
@@ -0,0 +1,63 @@
+import time
+
+
+def start_move(core, event):
+    # Issue the stage moves for `event` without waiting for them to finish;
+    # setup_event() for that event re-issues the same target and waits.
+    if event.x_pos is not None and event.y_pos is not None:
+        core.setXYPosition(event.x_pos, event.y_pos)
+    if event.z_pos is not None:
+        core.setPosition(event.z_pos)
+
+
+def describe_stage_sequencing(core):
+    xy_stage, z_stage = core.getXYStageDevice(), core.getFocusDevice()
+    xy = bool(xy_stage) and core.isXYStageSequenceable(xy_stage)
+    z = bool(z_stage) and core.isStageSequenceable(z_stage)
+    return (
+        f"XY stage {xy_stage or '(none)'} sequenceable: {'yes' if xy else 'no'}; "
+        f"focus {z_stage or '(none)'} sequenceable: {'yes' if z else 'no'}"
+    )
+
+
+# Accumulates how long setup_event waited for the stage at each position, and
+# for positions whose move was issued early, how much earlier it was issued.
+# Without prefetching, the whole move and settle time shows up as setup wait;
+# with it, the lead time is the part that overlapped other work.
+class StageMoveTimer:
+    def __init__(self):
+        self.positions = 0
+        self.prefetched = 0
+        self.setup_wait = 0.0
+        self.lead_time = 0.0
+        self.__issued_at = None
+
+    def move_issued(self):
+        self.__issued_at = time.perf_counter()
+
+    def setup_started(self):
+        now = time.perf_counter()
+        if self.__issued_at is not None:
+            self.prefetched += 1
+            self.lead_time += now - self.__issued_at
+            self.__issued_at = None
+        return now
+
+    def setup_finished(self, started):
+        self.positions += 1
+        self.setup_wait += time.perf_counter() - started
+
+    def summary(self):
+        if not self.positions:
+            return "No positions set up"
+        text = (
+            f"Stage setup waited {self.setup_wait:.1f} s over {self.positions} "
+            f"positions ({1000 * self.setup_wait / self.positions:.0f} ms each)"
+        )
+        if self.prefetched:
+            text += (
+                f"; {self.prefetched} moves were issued early, on average "
+                f"{1000 * self.lead_time / self.prefetched:.0f} ms before setup, "
+                f"hiding up to {self.lead_time:.1f} s of move and settle time"
+            )
+        return text
@@ -0,0 +1,74 @@
+import json
+import os
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from .tracing import write_json_atomic
+
+
+STATUS_ENDPOINT_NAME = "status_endpoint.json"
+
+
+# Serves the acquisition's live status as JSON on localhost, so that monitors
+# can read progress without scanning the save directory. GET /status calls
+# provider() on the server thread and returns its result; provider must only
+# read state (the engine's status() does). The URL is written to
+# status_endpoint.json in the save directory for monitors to find, and removed
+# on close().
+class StatusServer:
+    def __init__(self, provider, directory=None, host="127.0.0.1", port=0):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/status"):
+                    self.send_error(404)
+                    return
+                body = json.dumps(provider()).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.__server = ThreadingHTTPServer((host, port), Handler)
+        self.__server.daemon_threads = True
+        self.__thread = threading.Thread(target=self.__server.serve_forever, daemon=True)
+        self.__thread.start()
+        self.__endpoint_file = None
+        if directory is not None:
+            self.__endpoint_file = Path(directory) / STATUS_ENDPOINT_NAME
+            write_json_atomic(self.__endpoint_file, {"url": self.url, "pid": os.getpid()})
+
+    @property
+    def url(self):
+        host, port = self.__server.server_address[:2]
+        return f"http://{host}:{port}/status"
+
+    def close(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+        if self.__endpoint_file is not None:
+            try:
+                os.remove(self.__endpoint_file)
+            except FileNotFoundError:
+                pass
+
+
+def read_status(directory=None, url=None, timeout=1.0):
+    # The live status of the acquisition saving to `directory` (or serving
+    # `url`), or None if it is not running
+    if url is None:
+        try:
+            with open(Path(directory) / STATUS_ENDPOINT_NAME, encoding="utf-8") as f:
+                url = json.load(f)["url"]
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            return None
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            return json.load(response)
+    except (OSError, json.JSONDecodeError):
+        return None
@@ -0,0 +1,234 @@
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from pathlib import Path
+
+from .backends import OutputBackend, tile_name
+
+
+MANIFEST_NAME = "tile_manifest.jsonl"
+PLACEMENTS = ("round-robin", "balanced")
+# A volume is skipped while it has room for fewer than this many more tiles
+MIN_FREE_TILES = 10
+# Weight of the newest write in each volume's bandwidth estimate
+BANDWIDTH_ALPHA = 0.3
+
+
+# Spreads tiles over several output roots (one per volume), so that the SDT,
+# SPC and JSON files and the image of consecutive tiles land on different
+# disks and are written in parallel. Each tile is placed when its acquisition
+# starts, and the placement appended to the manifest before the BH-TCSPC
+# files are written, so the manifest always says where to find a tile.
+#
+# "round-robin" takes the volumes in turn. "balanced" sends each tile to the
+# volume expected to finish it first: tiles placed there but not yet saved,
+# plus this one, divided by the volume's measured write bandwidth. A volume
+# not measured yet counts as being as fast as the fastest one, so that it
+# gets measured. Either way, volumes without room for MIN_FREE_TILES more
+# tiles are skipped while any other has room.
+class VolumePlacer:
+    def __init__(self, roots, strategy="round-robin", manifest=None):
+        if strategy not in PLACEMENTS:
+            raise ValueError(f"Unknown placement {strategy!r}; use one of {PLACEMENTS}")
+        self.__roots = [str(root).rstrip("/\\") for root in roots]
+        if not self.__roots:
+            raise ValueError("Need at least one output root")
+        self.__strategy = strategy
+        self.__lock = threading.Lock()
+        self.__tiles = {}  # tile number -> root
+        self.__outstanding = dict.fromkeys(self.__roots, 0)
+        self.__bandwidth = dict.fromkeys(self.__roots)  # bytes/s, None until measured
+        self.__saved = dict.fromkeys(self.__roots, 0)
+        self.__bytes = dict.fromkeys(self.__roots, 0)
+        self.__last_used = dict.fromkeys(self.__roots, -1)
+        self.__placed = 0
+        self.__file = None
+        if manifest is not None:
+            self.__file = open(manifest, "a", encoding="utf-8")
+            self.__append(roots=self.__roots, placement=strategy)
+
+    @property
+    def roots(self):
+        return list(self.__roots)
+
+    @property
+    def strategy(self):
+        return self.__strategy
+
+    def root_of(self, number):
+        return self.__tiles[number]
+
+    def place(self, number):
+        # Returns the tile's root; a tile placed before (a retry) keeps it
+        with self.__lock:
+            if number in self.__tiles:
+                return self.__tiles[number]
+            root = self.__choose()
+            self.__tiles[number] = root
+            self.__outstanding[root] += 1
+            self.__last_used[root] = self.__placed
+            self.__placed += 1
+            if self.__file is not None:
+                self.__append(tile=tile_name(number), number=number, root=root)
+            return root
+
+    def observe(self, number, nbytes, seconds):
+        # A write of nbytes to the tile's volume that took `seconds`
+        if seconds <= 0 or nbytes <= 0:
+            return
+        with self.__lock:
+            root = self.__tiles[number]
+            rate = nbytes / seconds
+            previous = self.__bandwidth[root]
+            self.__bandwidth[root] = (
+                rate if previous is None else previous + BANDWIDTH_ALPHA * (rate - previous)
+            )
+
+    def finished(self, number, nbytes):
+        # All of the tile's files are written
+        with self.__lock:
+            root = self.__tiles[number]
+            self.__outstanding[root] = max(self.__outstanding[root] - 1, 0)
+            self.__saved[root] += 1
+            self.__bytes[root] += nbytes
+
+    def summary(self):
+        with self.__lock:
+            return {
+                root: {
+                    "tiles": self.__saved[root],
+                    "bytes": self.__bytes[root],
+                    "outstanding": self.__outstanding[root],
+                    "mb_per_s": (
+                        None if self.__bandwidth[root] is None else self.__bandwidth[root] / 1e6
+                    ),
+                }
+                for root in self.__roots
+            }
+
+    def close(self):
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+    def __tile_bytes(self):
+        saved = sum(self.__saved.values())
+        return sum(self.__bytes.values()) / saved if saved else 0
+
+    def __has_room(self, root):
+        try:
+            free = shutil.disk_usage(root).free
+        except OSError:
+            return False
+        return free >= MIN_FREE_TILES * self.__tile_bytes()
+
+    def __choose(self):
+        candidates = [root for root in self.__roots if self.__has_room(root)]
+        if not candidates:
+            print(
+                "Warning: every output root is nearly full; using all of them",
+                file=sys.stderr,
+            )
+            candidates = self.__roots
+        if self.__strategy == "round-robin":
+            return min(candidates, key=self.__last_used.get)
+        fastest = max((b for b in self.__bandwidth.values() if b is not None), default=1.0)
+
+        def finish(root):
+            return (self.__outstanding[root] + 1) / (self.__bandwidth[root] or fastest)
+
+        # Ties go to the volume used least recently
+        return min(candidates, key=lambda root: (finish(root), self.__last_used[root]))
+
+    def __append(self, **record):
+        record["time"] = time.time()
+        self.__file.write(json.dumps(record) + "\n")
+        self.__file.flush()
+        os.fsync(self.__file.fileno())
+
+
+# Reads a manifest as it is written: the roots it lists and where each tile
+# was placed (the latest placement, if a tile was placed again on --resume).
+# poll() reads only lines appended since the last poll.
+class TileLocator:
+    def __init__(self, directory):
+        self.__path = Path(directory) / MANIFEST_NAME
+        self.__offset = 0
+        self.__roots = []
+        self.__tiles = {}
+
+    @property
+    def roots(self):
+        return list(self.__roots)
+
+    @property
+    def tiles(self):
+        return dict(self.__tiles)
+
+    def poll(self):
+        try:
+            f = open(self.__path, "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            f.seek(self.__offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Still being written
+                    break
+                self.__offset += len(line)
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                for root in record.get("roots", ()):
+                    if root not in self.__roots:
+                        self.__roots.append(root)
+                if "tile" in record:
+                    self.__tiles[record["number"]] = record["root"]
+
+    def root_of(self, number):
+        if number not in self.__tiles:
+            self.poll()
+        return self.__tiles[number]
+
+
+def read_manifest(directory):
+    # Returns (roots, {tile number: root}); both empty without a manifest
+    locator = TileLocator(directory)
+    locator.poll()
+    return locator.roots, locator.tiles
+
+
+def acquisition_folders(directory):
+    # Every folder an acquisition saved to wrote SDT files in: its output
+    # roots if it was striped, otherwise just the folder itself
+    roots, _ = read_manifest(directory)
+    return roots or [str(directory)]
+
+
+# Sends each tile's stack to the backend for the root it was placed on, and
+# reports how fast each write went so that "balanced" placement can measure
+# the volumes.
+class StripedBackend(OutputBackend):
+    def __init__(self, backends, locate, observe=None):
+        # backends maps each root to its backend; locate(number) gives a
+        # tile's root
+        self.__backends = dict(backends)
+        self.__locate = locate
+        self.__observe = observe
+
+    def write_position(self, number, event, stack):
+        start = time.perf_counter()
+        files = self.__backends[self.__locate(number)].write_position(number, event, stack)
+        if self.__observe is not None:
+            nbytes = sum(os.path.getsize(f) for f in files)
+            self.__observe(number, nbytes, time.perf_counter() - start)
+        return files
+
+    def close(self):
+        for backend in self.__backends.values():
+            backend.close()
@@ -0,0 +1,104 @@
+import numpy as np
+
+
+# Width of the scan field at zoom 1 with our 20x lens; at the default zoom of
+# 2 and 256 pixels this gives the 0.7 um pixels we have always assumed.
+SCAN_FIELD_UM = 358.4
+DEFAULT_ZOOM = 2.0
+DEFAULT_OVERLAP = 10.0  # percent of the field of view
+
+
+def pixel_size_for(resolution, zoom=DEFAULT_ZOOM, scan_field=SCAN_FIELD_UM):
+    return scan_field / (zoom * resolution)
+
+
+def grid_axis(lo, hi, tile_size, step):
+    # Tile centres along one axis: the fewest tiles, `step` apart, that cover
+    # [lo, hi], centred on the interval
+    n = max(int(np.ceil((hi - lo - tile_size) / step - 1e-9)) + 1, 1)
+    return (lo + hi) / 2 + (np.arange(n) - (n - 1) / 2) * step
+
+
+def points_in_polygon_grid(xs, ys, polygon):
+    # For the grid of points (xs[j], ys[i]), whether each lies inside the
+    # polygon (even-odd rule), as an array of shape (len(ys), len(xs)). The
+    # crossings of each grid row with the polygon edges are found once per
+    # row, so the cost is rows x edges plus a binary search per point.
+    polygon = np.asarray(polygon, dtype=float)
+    px, py = polygon[:, 0], polygon[:, 1]
+    qx, qy = np.roll(px, -1), np.roll(py, -1)
+    y = np.asarray(ys, dtype=float)[:, None]
+    crosses = (py > y) != (qy > y)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        xc = px + (y - py) * (qx - px) / (qy - py)
+    xc = np.sort(np.where(crosses, xc, np.inf), axis=1)
+    inside = np.empty((len(y), len(xs)), dtype=bool)
+    for i, row in enumerate(xc):
+        inside[i] = np.searchsorted(row, xs, side="right") % 2 == 1
+    return inside
+
+
+def tiles_touching_polygon(xs, ys, tile_size, polygon):
+    # Tiles (centred on the grid points) that overlap the polygon: the centre
+    # or a corner of the tile is inside it, or a polygon vertex is inside the
+    # tile
+    h = tile_size / 2
+    keep = points_in_polygon_grid(xs, ys, polygon)
+    for dx in (-h, h):
+        for dy in (-h, h):
+            keep |= points_in_polygon_grid(xs + dx, ys + dy, polygon)
+    for vx, vy in np.asarray(polygon, dtype=float):
+        keep[np.ix_(np.abs(ys - vy) <= h, np.abs(xs - vx) <= h)] = True
+    return keep
+
+
+def tile_grid(bbox=None, polygon=None, tile_size=None, overlap=DEFAULT_OVERLAP):
+    # XY tile centres covering the bounding box (x0, y0, x1, y1) or the
+    # polygon (an array of vertices; tiles that do not touch it are left out),
+    # with adjacent tiles overlapping by `overlap` percent. Tiles are listed
+    # in serpentine order (rows of increasing Y, alternating X direction), so
+    # that the stage only ever moves to a neighbouring tile.
+    if (bbox is None) == (polygon is None):
+        raise ValueError("Give either a bounding box or a polygon")
+    if not 0 <= overlap < 100:
+        raise ValueError(f"Invalid overlap: {overlap}%")
+    if polygon is not None:
+        polygon = np.asarray(polygon, dtype=float)
+        if polygon.ndim != 2 or polygon.shape[1] != 2 or len(polygon) < 3:
+            raise ValueError("A polygon needs at least 3 X, Y vertices")
+        x0, y0 = polygon.min(axis=0)
+        x1, y1 = polygon.max(axis=0)
+    else:
+        x0, y0, x1, y1 = bbox
+        if x0 > x1 or y0 > y1:
+            raise ValueError(f"Invalid bounding box: {bbox}")
+    step = tile_size * (1 - overlap / 100)
+    xs = grid_axis(x0, x1, tile_size, step)
+    ys = grid_axis(y0, y1, tile_size, step)
+    x = np.broadcast_to(xs, (len(ys), len(xs))).copy()
+    y = np.broadcast_to(ys[:, None], (len(ys), len(xs)))
+    if polygon is not None:
+        keep = tiles_touching_polygon(xs, ys, tile_size, polygon)
+    else:
+        keep = np.ones(x.shape, dtype=bool)
+    x[1::2] = x[1::2, ::-1]
+    keep[1::2] = keep[1::2, ::-1]
+    return np.column_stack((x[keep], y[keep]))
+
+
+def apply_focus(xy, focus_map=None, z=None):
+    # XYZ positions with Z from the focus map, or the constant z
+    xy = np.asarray(xy, dtype=float)
+    if focus_map is not None:
+        z = focus_map.predict(xy)
+    elif z is None:
+        raise ValueError("Need a focus map or a Z position")
+    return np.column_stack((xy, np.broadcast_to(z, len(xy))))
+
+
+def read_polygon(filename):
+    # Polygon vertices from a CSV file of X, Y rows
+    polygon = np.loadtxt(filename, delimiter=",", ndmin=2)
+    if polygon.shape[1] != 2:
+        raise ValueError(f"Polygon CSV rows must contain X, Y; found {polygon.shape[1]} columns")
+    return polygon
@@ -0,0 +1,126 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+
+DEFAULT_CAPACITY = 100_000
+SUMMARY_WINDOW = 1000
+
+TRACE_NAME = "trace.jsonl"
+CHROME_TRACE_NAME = "trace.json"
+TRACE_SUMMARY_NAME = "trace_summary.json"
+
+
+# Low-overhead record of what the acquisition spent its time on. Each span is
+# a (phase, start, end, thread, position) tuple of perf_counter_ns times,
+# appended to a bounded ring buffer (the oldest spans are dropped on long
+# runs). Recent durations are also kept per phase for live p50/p95 summaries.
+# Spans can be recorded from any thread; the background writer records the
+# save steps.
+class TraceRecorder:
+    def __init__(self, capacity=DEFAULT_CAPACITY, window=SUMMARY_WINDOW):
+        self.__spans = deque(maxlen=capacity)
+        self.__recent = {}
+        self.__counts = {}
+        self.__totals = {}
+        self.__window = window
+        self.__lock = threading.Lock()
+        self.__origin = time.perf_counter_ns()
+        self.__wall_origin = time.time()
+
+    def record(self, phase, start, end, position=None):
+        self.__spans.append((phase, start, end, threading.get_ident(), position))
+        with self.__lock:
+            recent = self.__recent.get(phase)
+            if recent is None:
+                recent = self.__recent[phase] = deque(maxlen=self.__window)
+                self.__counts[phase] = 0
+                self.__totals[phase] = 0
+            recent.append(end - start)
+            self.__counts[phase] += 1
+            self.__totals[phase] += end - start
+
+    @contextmanager
+    def span(self, phase, position=None):
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.record(phase, start, time.perf_counter_ns(), position)
+
+    def spans(self):
+        return list(self.__spans)
+
+    def summary(self):
+        # {phase: {count, total_s, p50_ms, p95_ms}}, percentiles over the
+        # most recent spans of each phase
+        with self.__lock:
+            recent = {phase: list(d) for phase, d in self.__recent.items()}
+            counts = dict(self.__counts)
+            totals = dict(self.__totals)
+        result = {}
+        for phase, durations in recent.items():
+            p50, p95 = np.percentile(durations, (50, 95)) / 1e6
+            result[phase] = {
+                "count": counts[phase],
+                "total_s": totals[phase] / 1e9,
+                "p50_ms": float(p50),
+                "p95_ms": float(p95),
+            }
+        return result
+
+    def write_summary(self, path, **extra):
+        # Replaced atomically, so monitors can poll it while acquiring
+        write_json_atomic(path, {"time": time.time(), "phases": self.summary(), **extra})
+
+    def write_jsonl(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for phase, start, end, thread, position in self.spans():
+                record = {
+                    "phase": phase,
+                    "start": self.__wall_origin + (start - self.__origin) / 1e9,
+                    "duration_ms": (end - start) / 1e6,
+                    "thread": thread,
+                    "position": position,
+                }
+                f.write(json.dumps(record) + "\n")
+
+    def write_chrome_trace(self, path):
+        # Trace Event Format, for chrome://tracing or ui.perfetto.dev
+        pid = os.getpid()
+        events = []
+        for phase, start, end, thread, position in self.spans():
+            event = {
+                "name": phase,
+                "ph": "X",
+                "ts": (start - self.__origin) / 1e3,
+                "dur": (end - start) / 1e3,
+                "pid": pid,
+                "tid": thread,
+            }
+            if position is not None:
+                event["args"] = {"position": position}
+            events.append(event)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+def write_json_atomic(path, data):
+    path = str(path)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(path + ".tmp", path)
+
+
+def read_trace_summary(path):
+    # For monitors: the latest summary written by write_summary(), or None
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
@@ -0,0 +1,100 @@
+import queue
+import threading
+
+
+class BackgroundWriterError(RuntimeError):
+    pass
+
+
+# Runs per-position save jobs (renaming, tile config, TIFF) on a worker thread
+# so that the next stage move and exposure can overlap with the previous
+# position's disk I/O. At most `max_pending` jobs may be waiting; submit()
+# blocks beyond that, so a slow disk throttles acquisition instead of letting
+# frames pile up in memory. With max_pending=0, jobs run synchronously.
+# With several threads (one per output volume when tiles are striped), each
+# thread has its own queue of up to max_pending jobs: jobs submitted with the
+# same lane run in order on the same thread, jobs without a lane take the
+# threads in turn, and jobs on different threads may finish out of order.
+class BackgroundWriter:
+    def __init__(self, max_pending=2, threads=1):
+        self.__max_pending = max_pending
+        self.__errors = []
+        self.__errors_lock = threading.Lock()
+        self.__closed = False
+        self.__next_lane = 0
+        if max_pending > 0:
+            self.__queues = [queue.Queue(maxsize=max_pending) for _ in range(threads)]
+            self.__threads = [
+                threading.Thread(
+                    target=self.__run, args=(q,), name=f"BackgroundWriter-{i}", daemon=True
+                )
+                for i, q in enumerate(self.__queues)
+            ]
+            for thread in self.__threads:
+                thread.start()
+        else:
+            self.__queues = []
+            self.__threads = []
+
+    @property
+    def max_pending(self):
+        return self.__max_pending
+
+    @property
+    def threads(self):
+        return len(self.__threads)
+
+    @property
+    def pending(self):
+        return sum(q.unfinished_tasks for q in self.__queues)
+
+    def submit(self, func, *args, lane=None):
+        if self.__closed:
+            raise BackgroundWriterError("Writer is closed")
+        self.raise_if_failed()
+        if not self.__queues:
+            func(*args)
+            return
+        if lane is None:
+            lane = self.__next_lane
+            self.__next_lane += 1
+        self.__queues[lane % len(self.__queues)].put((func, args))
+
+    def raise_if_failed(self):
+        with self.__errors_lock:
+            if not self.__errors:
+                return
+            first = self.__errors[0]
+            count = len(self.__errors)
+        raise BackgroundWriterError(
+            f"{count} background write(s) failed; first error: {first!r}"
+        ) from first
+
+    def flush(self):
+        for q in self.__queues:
+            q.join()
+        self.raise_if_failed()
+
+    def close(self):
+        if not self.__closed:
+            self.__closed = True
+            for q in self.__queues:
+                q.put(None)
+            for thread in self.__threads:
+                thread.join()
+        self.raise_if_failed()
+
+    def __run(self, jobs):
+        while True:
+            item = jobs.get()
+            try:
+                if item is None:
+                    return
+                func, args = item
+                try:
+                    func(*args)
+                except Exception as e:
+                    with self.__errors_lock:
+                        self.__errors.append(e)
+            finally:
+                jobs.task_done()
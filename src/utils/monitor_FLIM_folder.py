@@ -1,31 +1,46 @@
 import time
-import pathlib
+from tiled_acquisition.eta import ThroughputEstimator
+from tiled_acquisition.folder_monitor import FolderIndex
 from zulip_channel_updator import warn_zulip_user
 
 total_images=1870
-time_per_image = 90 #sec
-sleep_time = time_per_image * 1.5  # sec
+time_per_image = 90 #sec, initial guess until positions complete
+poll_time = 10  # sec
 
 folder = r'D:\UserData\HelenWilson\20250417_bigfovMN_slim\MN_nras_1tissue_0417'
 
-def _get_number_of_files(folder=folder):
-    return len(list(pathlib.Path(folder).glob('*.sdt')))
+index = FolderIndex.for_acquisition(folder)
+# Learns the time per image; a stall is a gap well outside the usual spread
+estimator = ThroughputEstimator(total_images, initial_interval=time_per_image)
+estimator.follow_index(index)
+
+def _get_number_of_files():
+    index.poll()
+    return index.count
 
 message = f"monitoring {folder}"
 warn_zulip_user(message)
 
-for i in range(90*total_images):
-
-    nfiles = _get_number_of_files()
-    time.sleep(sleep_time)
+nfiles = _get_number_of_files()
+warned = False
+while nfiles < total_images:
+    time.sleep(poll_time)
     nfiles_now = _get_number_of_files()
-    print(nfiles,nfiles_now)
-    if nfiles_now>nfiles:
-        pass
-    else:
+    if nfiles_now != nfiles:
+        print(nfiles,nfiles_now)
+    nfiles = nfiles_now
+    if not estimator.is_stalled():
+        warned = False
+    elif not warned:
+        # Once per stall, not on every check
         percent_completion = nfiles_now*100.0/(total_images)
-        message = f"NO NEW FILES at {nfiles_now} completed {percent_completion:.2f}%"
+        message = (
+            f"NO NEW FILES at {nfiles_now} completed {percent_completion:.2f}% "
+            f"(usually one every {estimator.interval:.0f} s)"
+        )
         warn_zulip_user(message)
+        warned = True
 
+index.close()
 message = "done monitoring"
 warn_zulip_user(message)
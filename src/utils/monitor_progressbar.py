@@ -1,17 +1,32 @@
 import argparse
+import json
 import pandas as pd
 import pathlib
 import time
+from tiled_acquisition.eta import ThroughputEstimator
+from tiled_acquisition.folder_monitor import FolderIndex
+from tiled_acquisition.status_server import read_status
 from rich.progress import Progress
 import humanize
 from rich import print as pprint
 import datetime
 
-def _get_number_of_files(folder, get_files=False):
-    if get_files:
-        return list(pathlib.Path(folder).glob('*.sdt'))
-    else:
-        return len(list(pathlib.Path(folder).glob('*.sdt')))
+def _get_trace_summary(folder):
+    # Written by the acquisition after each position; see tiled_acquisition.tracing
+    try:
+        with open(pathlib.Path(folder) / "trace_summary.json") as f:
+            return json.load(f)["phases"]
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        return None
+
+def _measured_time_per_position(phases):
+    # Time spent on the acquisition thread (stage, frames, PMT resets) per
+    # position so far; saving overlaps with the next position
+    positions = phases.get("setup_event", {}).get("count", 0)
+    if not positions:
+        return None
+    acquiring = sum(phases.get(p, {}).get("total_s", 0.0) for p in ("setup_event", "frame", "pmt_reset"))
+    return acquiring / positions
 
 def main():
     parser = argparse.ArgumentParser()
@@ -22,15 +37,21 @@ def main():
 
     df = pd.read_csv(args.csvfile)
     total = len(df)
-    count = _get_number_of_files(args.folder)
-    files = _get_number_of_files(args.folder,True)
-    oldest_file = min(files, key=lambda f: f.stat().st_ctime)    
-    start_time = datetime.datetime.fromtimestamp(oldest_file.stat().st_ctime)
+    index = FolderIndex.for_acquisition(args.folder)
+    index.poll()
+    count = index.count
+    start_time = datetime.datetime.fromtimestamp(index.first_created or time.time())
     start_str = start_time.strftime("%A, %B %d, %Y at %I:%M %p").lstrip("0")
 
-    eta_per_frame = 105 #sec with saving time
-    remaining = total - count
-    eta_seconds = remaining * eta_per_frame
+    eta_per_frame = 105 #sec with saving time; only until positions complete
+    phases = _get_trace_summary(args.folder)
+    if phases:
+        eta_per_frame = _measured_time_per_position(phases) or eta_per_frame
+        for phase, stats in phases.items():
+            pprint(f"{phase:<18}: p50 {stats['p50_ms']:.0f} ms, p95 {stats['p95_ms']:.0f} ms")
+    estimator = ThroughputEstimator(total, initial_interval=eta_per_frame)
+    estimator.follow_index(index)
+    eta_seconds = estimator.eta_seconds(count)
 
     now = datetime.datetime.now()
     now_str = now.strftime("%A, %B %d, %Y at %I:%M %p").lstrip("0")
@@ -41,15 +62,40 @@ def main():
     pprint(f"Imaging Started  : [cyan]{start_str}[/cyan]")
     pprint(f"Run Estimate     : [bold green]{eta_str}[/bold green]")
     pprint(f"Finish Time      : [bold yellow]{end_str}[/bold yellow]")
+    if estimator.bytes_per_second is not None:
+        pprint(
+            f"Throughput       : {estimator.tiles_per_hour:.1f} tiles/hour, "
+            f"{estimator.bytes_per_second / 1e6:.2f} MB/s"
+        )
 
     with Progress() as progress:
         task = progress.add_task("Waiting for files...", total=total)
         while True:
-            count = _get_number_of_files(args.folder)
-            progress.update(task, completed=count)
+            # Ask the acquisition itself while it is running; count files otherwise
+            status = read_status(args.folder)
+            if status is not None:
+                count = status["previously_completed"] + status["positions_completed"]
+                eta_seconds = status["throughput"]["eta_seconds"]
+                stalled = status["throughput"]["stalled"]
+                detail = (
+                    f", position {status['position']} frame "
+                    f"{status['frames_done']}/{status['frames_per_position']}"
+                )
+            else:
+                index.poll()
+                count = index.count
+                eta_seconds = None
+                stalled = estimator.is_stalled()
+                detail = ""
+            if eta_seconds is None:
+                eta_seconds = estimator.eta_seconds(count)
+            eta = humanize.naturaldelta(eta_seconds)
+            stalled = " [bold red](stalled?)[/bold red]" if stalled else ""
+            progress.update(task, completed=count, description=f"ETA {eta}{detail}{stalled}")
             if count >= total:
                 break
             time.sleep(int(args.frames))
+    index.close()
 
 if __name__ == "__main__":
     main()
@@ -2,5 +2,5 @@ $frames = 90
 $coords = "D:\UserData\HelenWilson\tile-coords\nras_1tissue_zcalc_0421_contd.csv"
 $save_path = "D:\UserData\HelenWilson\20250417_bigfovMN_slim\MN_nras_1tissue_0421_contd"
 
-python .\monitor_progressbar.py $save_path $coords $frames
+uv run --extra monitor python .\monitor_progressbar.py $save_path $coords $frames
   
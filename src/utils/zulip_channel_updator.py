@@ -1,14 +1,22 @@
 #!/usr/bin/env python3
 
-import zulip
+import atexit
+from tiled_acquisition.notify import StatusService, ZulipNotifier
+
+zuliprc_path = "C:/Users/lociuser/Documents/zuliprc"
+stream_name = "SLIM-acquisition-messages"
+
+_service = None
+
+def _get_service():
+    # One persistent client for all messages; they are sent (batched) from a
+    # background thread so a slow server never holds up the caller
+    global _service
+    if _service is None:
+        _service = StatusService(ZulipNotifier(zuliprc_path, stream_name))
+        atexit.register(_service.close)
+    return _service
 
 def warn_zulip_user(message):
-    client = zulip.Client(config_file= "C:/Users/lociuser/Documents/zuliprc")
-    request = {
-        "type": "stream",
-        "to": "SLIM-acquisition-messages",
-        "topic": "Acquisition status",
-        "content": (message),
-    }
-    result = client.send_message(request)
-    print(result)
\ No newline at end of file
+    _get_service().alert(message)
+    print(message)
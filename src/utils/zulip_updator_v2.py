@@ -1,15 +1,17 @@
 import time
-import pathlib
-import zulip
 import threading
 import signal
 import sys
-from datetime import datetime, timedelta
+from datetime import timedelta
+from tiled_acquisition.eta import ThroughputEstimator
+from tiled_acquisition.folder_monitor import FolderIndex
+from tiled_acquisition.notify import StatusService, ZulipNotifier
+from tiled_acquisition.status_server import read_status
 
 # Configuration
 total_images = 1870
-time_per_image = 90  # sec
-sleep_time = time_per_image * 1.5  # sec
+time_per_image = 90  # sec, initial guess until images complete
+sleep_time = 10  # sec between checks
 folder = r'D:\UserData\HelenWilson\20250417_bigfovMN_slim\MN_nras_1tissue_0417'
 zuliprc_path = "C:/Users/lociuser/Documents/zuliprc"
 stream_name = "SLIM-acquisition-messages"
@@ -24,113 +26,52 @@ last_check_time = None
 # Control flag for threads
 running = True
 
-# Create a Zulip client
-client = zulip.Client(config_file=zuliprc_path)
+# Incremental index of completed SDT files, instead of listing the folder (or
+# every output root in its tile manifest, if tiles were spread over volumes)
+index = FolderIndex.for_acquisition(folder)
+# Learns the time per image from the index, for ETAs and stall alerts
+estimator = ThroughputEstimator(total_images, initial_interval=time_per_image)
+estimator.follow_index(index)
 
-def get_number_of_files(folder=folder):
-    return len(list(pathlib.Path(folder).glob('*.sdt')))
+def get_number_of_files():
+    index.poll()
+    return index.count
 
-def send_zulip_message(message, topic=topic_name):
-    request = {
-        "type": "stream",
-        "to": stream_name,
-        "topic": topic,
-        "content": message,
-    }
-    result = client.send_message(request)
-    print(f"Message sent: {message}")
-    return result
+# Created in main(); sends from its own thread and answers status requests
+service = None
 
-def check_for_status_messages():
-    """Poll for messages asking for status."""
-    global current_files, percent_complete, last_check_time, monitoring_active
-    
-    # Calculate a timestamp for 5 minutes ago (increase time window)
-    now = datetime.now()
-    five_min_ago = now - timedelta(minutes=5)
-    # Format as required by Zulip API
-    anchor_timestamp = five_min_ago.strftime('%Y-%m-%d %H:%M:%S')
-    
-    # Get recent messages
-    request = {
-        "anchor": "newest",  # Changed from timestamp to "newest" to get most recent messages
-        "num_before": 20,    # Check more messages to increase chances of finding status requests
-        "num_after": 0,      # We don't need messages after the anchor
-        
-    }
-    
-    try:
-        result = client.get_messages(request)
-        
-        if result["result"] == "success":
-            messages = result["messages"]
-            print(f"Found {len(messages)} messages in the stream")
-            
-            # Process messages from newest to oldest
-            for msg in messages:
-                # Print content for debugging
-                print(f"Message content: '{msg.get('content', '')}'")
-                
-                # Convert timestamp to datetime for comparison
-                msg_time = datetime.fromtimestamp(msg["timestamp"])
-                
-                # Only process messages from the last 5 minutes
-                if now - msg_time > timedelta(minutes=5):
-                    print(f"Message from {msg_time} too old, skipping")
-                    continue
-                
-                # More lenient check for status-related terms
-                content = msg.get('content', '').lower()
-                if "status" in content or "progress" in content or "update" in content:
-                    print(f"Found status request: {msg['content']}")
-                    
-                    # Send status response
-                    status_message = (
-                        f"Current status: {current_files}/{total_images} files processed "
-                        f"({percent_complete:.2f}% complete)\n"
-                    )
-                    
-                    if monitoring_active:
-                        if last_check_time:
-                            time_since_check = time.time() - last_check_time
-                            status_message += f"Last check: {time_since_check:.1f} seconds ago"
-                        else:
-                            status_message += "Monitoring is active but no checks completed yet"
-                    else:
-                        status_message += "Monitoring is currently inactive"
-                    
-                    # Use the topic of the incoming message
-                    incoming_topic = msg.get("topic",topic_name)
-                    send_zulip_message(status_message, topic=incoming_topic)
-                    print("Status response sent!")
-                    
-                    # Only respond to one status request per polling cycle
-                    break
-    except Exception as e:
-        print(f"Error checking messages: {e}")
-        # Print the full exception for debugging
-        import traceback
-        traceback.print_exc()
+def send_zulip_message(message, topic=topic_name):
+    service.alert(message, topic=topic)
+    print(f"Message queued: {message}")
 
-def message_polling_thread():
-    """Thread function that polls for status requests."""
-    global running
-    
-    print("Message polling thread started")
-    while running:
-        try:
-            #print("Checking for status messages...")
-            check_for_status_messages()
-        except Exception as e:
-            print(f"Error in message polling: {e}")
-        
-        # Poll every 5 seconds (reduced from 10) for better responsiveness
-        for _ in range(5):
-            if not running:
-                break
-            time.sleep(1)
-            
-    print("Message polling thread stopped")
+def status_message():
+    """Reply to a message asking for status."""
+    text = (
+        f"Current status: {current_files}/{total_images} files processed "
+        f"({percent_complete:.2f}% complete)\n"
+    )
+    eta_seconds = estimator.eta_seconds(current_files)
+    if eta_seconds is not None:
+        text += (
+            f"{estimator.tiles_per_hour:.1f} images/hour, "
+            f"estimated finish in {timedelta(seconds=round(eta_seconds))}\n"
+        )
+    live = read_status(folder)
+    if live is not None:
+        text += (
+            f"Acquiring position {live['position']} (attempt {live['attempt']}), "
+            f"frame {live['frames_done']}/{live['frames_per_position']}; "
+            f"{live['pmt_resets']} PMT resets, {live['write_queue']} positions waiting to be saved\n"
+        )
+    if monitoring_active:
+        if last_check_time:
+            time_since_check = time.time() - last_check_time
+            text += f"Last check: {time_since_check:.1f} seconds ago"
+        else:
+            text += "Monitoring is active but no checks completed yet"
+    else:
+        text += "Monitoring is currently inactive"
+    return text
 
 def file_monitoring_thread():
     """Thread function that monitors the files."""
@@ -143,8 +84,9 @@ def file_monitoring_thread():
     try:
         current_files = get_number_of_files()
         percent_complete = current_files * 100.0 / total_images
+        warned = False
         
-        for i in range(90 * total_images):
+        while current_files < total_images:
             if not running:
                 break
                 
@@ -162,19 +104,20 @@ def file_monitoring_thread():
             current_files = get_number_of_files()
             percent_complete = current_files * 100.0 / total_images
             
-            print(f"Files: {nfiles} → {current_files} ({percent_complete:.2f}%)")
-            
             if current_files > nfiles:
-                # New files detected, continue silently
-                pass
-            else:
-                # No new files, send alert
-                message = f"NO NEW FILES at {current_files} completed ({percent_complete:.2f}%)"
-                send_zulip_message(message)
+                print(f"Files: {nfiles} → {current_files} ({percent_complete:.2f}%)")
             
-            # Check if acquisition is complete
-            if current_files >= total_images:
-                break
+            if not estimator.is_stalled():
+                # Files arriving at the usual pace, continue silently
+                warned = False
+            elif not warned:
+                # Longer than usual without a new file; alert once per stall
+                message = (
+                    f"NO NEW FILES at {current_files} completed ({percent_complete:.2f}%); "
+                    f"usually one every {estimator.interval:.0f} s"
+                )
+                send_zulip_message(message)
+                warned = True
                 
         if running:  # Only send completion message if not interrupted
             message = f"Monitoring complete. Final count: {current_files}/{total_images} files ({percent_complete:.2f}%)"
@@ -182,6 +125,7 @@ def file_monitoring_thread():
     
     finally:
         monitoring_active = False
+        index.close()
         print("File monitoring thread stopped")
 
 def signal_handler(sig, frame):
@@ -191,16 +135,20 @@ def signal_handler(sig, frame):
     running = False
 
 def main():
-    """Main function to start both threads."""
-    global running
+    """Main function to start the status service and the monitoring thread."""
+    global running, service
     
     # Set up signal handler for graceful exit
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
     
-    # Start the message polling thread
-    polling_thread = threading.Thread(target=message_polling_thread)
-    polling_thread.start()
+    # One persistent Zulip client; status requests arrive through its event
+    # queue (long-poll) and are answered with status_message()
+    service = StatusService(
+        ZulipNotifier(zuliprc_path, stream_name),
+        topic=topic_name,
+        status_provider=status_message,
+    )
     
     # Start the file monitoring thread
     monitor_thread = threading.Thread(target=file_monitoring_thread)
@@ -208,17 +156,16 @@ def main():
     
     # Wait for threads to complete or until interrupted
     try:
-        while running and (polling_thread.is_alive() or monitor_thread.is_alive()):
+        while running and monitor_thread.is_alive():
             time.sleep(0.5)
     except Exception as e:
         print(f"Error in main thread: {e}")
         running = False
     
     # Wait for threads to finish
-    if polling_thread.is_alive():
-        polling_thread.join(timeout=5)
     if monitor_thread.is_alive():
         monitor_thread.join(timeout=5)
+    service.close(timeout=5)
         
     print("Script terminated")
     
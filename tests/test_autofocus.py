@@ -0,0 +1,107 @@
+import numpy as np
+import pytest
+
+from tiled_acquisition.autofocus import (
+    DriftModel,
+    FocusCache,
+    best_focus,
+    brenner,
+    tenengrad,
+)
+from tiled_acquisition.journal import PositionJournal, read_journal
+from tiled_acquisition.main import parse_args, run_acquisition
+from tiled_acquisition.simulation import box_blur, make_simulated_core
+from test_simulation import RecordingBackend
+
+
+def synthetic_sweep(zs, focus_z, resolution=64, seed=0):
+    rng = np.random.default_rng(seed)
+    texture = (rng.random((resolution, resolution)) < 0.05) * 100.0
+    return np.stack(
+        [rng.poisson(box_blur(texture, int(abs(z - focus_z))) + 1) for z in zs]
+    )
+
+
+@pytest.mark.parametrize("metric", [brenner, tenengrad])
+def test_metric_peaks_at_focus(metric):
+    zs = np.arange(-8, 9, 2.0)
+    stack = synthetic_sweep(zs, 0.0)
+    scores = metric(stack)
+    assert scores.shape == (len(zs),)
+    assert np.argmax(scores) == np.flatnonzero(zs == 0)[0]
+    assert scores[3] == pytest.approx(metric(stack[3]))
+
+
+def test_best_focus():
+    zs = np.linspace(-10, 10, 11)
+    assert best_focus(zs, 100 - (zs - 1.3) ** 2) == pytest.approx(1.3)
+    assert best_focus(zs, zs) is None  # peak at the end of the sweep
+    assert best_focus(zs, np.ones(11)) is None
+
+
+def test_drift_model():
+    drift = DriftModel(window=4, max_offset=5.0, prior=1.0, min_span=60)
+    assert drift.predict(0) == 1.0
+    drift.add(0.0, 0.0)
+    assert drift.predict(10) == 0.0
+    drift.add(1.0, 1.0)
+    drift.add(2.0, 0.2)
+    assert drift.predict(3.0) == pytest.approx(0.2)  # no slope from 2 s of data
+    drift.add(60.0, 1.0)
+    drift.add(120.0, 2.0)
+    drift.add(180.0, 3.0)
+    assert drift.predict(210) == pytest.approx(3.5, abs=0.2)
+    assert drift.predict(100000) == 5.0
+
+
+def test_focus_cache(tmp_path):
+    path = tmp_path / "focus_cache.json"
+    cache = FocusCache(path)
+    cache.record(3, 12.0, 10.0, 100.0)
+    cache.record(1, 13.0, 10.0, 200.0)
+    cache = FocusCache(path)
+    assert len(cache) == 2
+    assert cache.get(3)["z"] == 12.0
+    assert cache.latest_offset() == pytest.approx(2.5)
+    assert FocusCache(tmp_path / "missing.json").latest_offset() == 0.0
+
+
+def test_simulated_autofocus_corrects_drift(tmp_path):
+    save = tmp_path / "data"
+    save.mkdir()
+    args = parse_args(
+        [
+            "positions.csv",
+            "--config", "simulated",
+            "--save", str(save),
+            "--frames", "2",
+            "--output", "none",
+            "--pmt-warmup", "0",
+            "--autofocus-every", "2",
+            "--autofocus-range", "16",
+            "--autofocus-steps", "9",
+        ]
+    )
+    # The sample sits 4 um above the planned Z everywhere
+    core = make_simulated_core(resolution=64, focus_surface=lambda x, y: 4.0)
+    core.setProperty("OSc-LSM", "BH-TCSPC-FLIMFileSaving", "Yes")
+    xyzs = [(100.0 * i, 0.0, 0.0) for i in range(5)]
+    backend = RecordingBackend()
+    journal = PositionJournal(save)
+    try:
+        engine = run_acquisition(core, args, xyzs, np.arange(5), journal, backend)
+    finally:
+        journal.close()
+
+    status = engine.status()["autofocus"]
+    assert status["measurements"] == 3
+    assert status["offset_um"] == pytest.approx(4.0, abs=1.0)
+    assert sorted(backend.stacks) == [0, 1, 2, 3, 4]
+    # Autofocus scans are not saved as FLIM data
+    assert sorted(p.name for p in save.glob("*.sdt")) == [f"pos_{i:04d}.sdt" for i in range(5)]
+    cache = FocusCache(save / "focus_cache.json")
+    assert len(cache) == 3
+    assert cache.get(0)["z"] == pytest.approx(4.0, abs=1.0)
+    # The journal has the Z each tile was taken at, not the planned 0
+    _, positions = read_journal(save)
+    assert [positions[i]["z"] for i in range(5)] == pytest.approx([4.0] * 5, abs=1.5)
@@ -0,0 +1,86 @@
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from tiled_acquisition.backends import OMETiffBackend, OMEZarrBackend
+
+
+def make_stack(n_frames=4, size=32):
+    rng = np.random.default_rng(0)
+    return np.cumsum(rng.integers(0, 2, size=(n_frames, size, size)), axis=0).astype(np.uint16)
+
+
+def test_ome_tiff_backend_writes_one_file_per_position(tmp_path):
+    from pyometiff import OMETIFFReader
+
+    backend = OMETiffBackend(tmp_path / "data_tif")
+    stack = make_stack()
+    files = backend.write_position(7, SimpleNamespace(x_pos=1.0, y_pos=2.0, z_pos=3.0), stack)
+    assert files == [str(tmp_path / "data_tif" / "pos_0007.tif")]
+    array, _, _ = OMETIFFReader(fpath=files[0]).read()
+    assert np.array_equal(array, stack)
+
+
+def test_ome_zarr_backend_appends_positions(tmp_path):
+    zarr = pytest.importorskip("zarr")
+    path = tmp_path / "data.ome.zarr"
+    backend = OMEZarrBackend(path, n_positions=5, chunk_yx=16)
+    stacks = {3: make_stack(), 1: make_stack() + 1}
+    for number, stack in stacks.items():
+        event = SimpleNamespace(x_pos=10.0 * number, y_pos=2.0, z_pos=None)
+        backend.write_position(number, event, stack)
+    backend.close()
+
+    # Reopening (as --resume does) keeps what was written
+    OMEZarrBackend(path, n_positions=5).write_position(
+        0, SimpleNamespace(x_pos=0.0, y_pos=0.0, z_pos=0.0), make_stack()
+    )
+    group = zarr.open_group(path, mode="r")
+    images = group["0"]
+    assert images.shape == (5, 4, 32, 32)
+    assert images.chunks == (1, 4, 16, 16)
+    assert np.array_equal(images[3], stacks[3])
+    assert np.array_equal(images[1, 2:], stacks[1][2:])
+    assert not images[4].any()
+    positions = group["stage_positions"][:]
+    assert positions[3, 0] == 30.0 and np.isnan(positions[3, 2])
+    assert group.attrs["ome"]["multiscales"][0]["axes"][0]["name"] == "p"
+
+
+def test_ome_zarr_backend_returns_chunk_files(tmp_path):
+    zarr = pytest.importorskip("zarr")
+    path = tmp_path / "data.ome.zarr"
+    backend = OMEZarrBackend(path, n_positions=3000, chunk_yx=16, n_threads=2)
+    stack = make_stack()
+    stack[:, :16, :16] = 0
+    files = backend.write_position(2, SimpleNamespace(x_pos=1.0, y_pos=2.0, z_pos=3.0), stack)
+    # The all-zero chunk is not stored
+    assert sorted(files) == [
+        str(path / "0" / "c" / "2" / "0" / str(y) / str(x)) for y, x in ((0, 1), (1, 0), (1, 1))
+    ]
+    assert all(os.path.getsize(f) > 0 for f in files)
+    assert zarr.config.get("threading.max_workers") is None
+    backend.close()
+    assert zarr.open_group(path, mode="r")["stage_positions"].chunks == (1024, 3)
+
+
+def test_ome_zarr_backend_writes_positions_cut_short(tmp_path):
+    zarr = pytest.importorskip("zarr")
+    path = tmp_path / "data.ome.zarr"
+    backend = OMEZarrBackend(path, n_positions=2, n_frames=4)
+    event = SimpleNamespace(x_pos=0.0, y_pos=0.0, z_pos=0.0)
+    stack = make_stack()
+    backend.write_position(0, event, stack[:2])
+    backend.write_position(1, event, stack)
+    # A retry cut shorter than the attempt before leaves no stale frames
+    backend.write_position(1, event, stack[:1] + 5)
+    with pytest.raises(ValueError, match="does not fit"):
+        backend.write_position(1, event, make_stack(size=16))
+    backend.close()
+
+    images = zarr.open_group(path, mode="r")["0"]
+    assert images.shape == (2, 4, 32, 32)
+    assert np.array_equal(images[0, :2], stack[:2]) and not images[0, 2:].any()
+    assert np.array_equal(images[1, 0], stack[0] + 5) and not images[1, 1:].any()
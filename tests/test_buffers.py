@@ -0,0 +1,28 @@
+import threading
+
+import numpy as np
+
+from tiled_acquisition.buffers import StackBufferPool
+
+
+def test_stack_buffer_pool_reuses_released_buffers():
+    pool = StackBufferPool(2)
+    a = pool.acquire((3, 4, 4))
+    b = pool.acquire((3, 4, 4))
+    assert a.dtype == np.uint16 and a.shape == (3, 4, 4)
+    assert a is not b
+    pool.release(a)
+    assert pool.acquire((3, 4, 4)) is a
+
+
+def test_stack_buffer_pool_blocks_until_release():
+    pool = StackBufferPool(1)
+    a = pool.acquire((2, 4, 4))
+    got = []
+    thread = threading.Thread(target=lambda: got.append(pool.acquire((2, 4, 4))))
+    thread.start()
+    thread.join(timeout=0.2)
+    assert not got
+    pool.release(a)
+    thread.join(timeout=5)
+    assert got == [a]
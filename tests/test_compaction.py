@@ -0,0 +1,96 @@
+import hashlib
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip("zstandard")
+
+from tiled_acquisition.compaction import (
+    COMPACTION_MANIFEST_NAME,
+    CompactionError,
+    Compactor,
+    compress_file,
+    open_compacted,
+    read_compaction_manifest,
+    verify_compacted,
+)
+from tiled_acquisition.folder_monitor import FolderIndex
+from tiled_acquisition.journal import PositionJournal, completed_positions
+from tiled_acquisition.main import run_acquisition
+from test_simulation import RecordingBackend, simulated_args, simulated_core
+
+
+def sparse_file(path, size=1 << 22):
+    data = np.zeros(size, dtype=np.uint8)
+    data[::4099] = np.arange(len(data[::4099])) % 251 + 1
+    path.write_bytes(data.tobytes())
+    return data.tobytes()
+
+
+def test_compress_file_round_trip(tmp_path):
+    path = tmp_path / "pos_0000.sdt"
+    data = sparse_file(path)
+    record = compress_file(path)
+
+    assert not path.exists()
+    assert not (tmp_path / "pos_0000.sdt.zst.tmp").exists()
+    assert record["compressed"] == f"{path}.zst"
+    assert record["size"] == len(data)
+    assert record["compressed_size"] < len(data) / 20
+    assert record["sha256"] == hashlib.sha256(data).hexdigest()
+    assert verify_compacted(path, record["sha256"])
+
+    # Read through the original name, in pieces and skipping ahead
+    with open_compacted(path) as f:
+        assert f.read(1000) == data[:1000]
+        f.seek(3 << 20)
+        assert f.read() == data[3 << 20:]
+
+
+def test_uncompressed_files_open_as_they_are(tmp_path):
+    path = tmp_path / "pos_0000.spc"
+    data = sparse_file(path, 1000)
+    with open_compacted(path) as f:
+        assert f.read() == data
+
+
+def test_failures_are_raised_on_close(tmp_path):
+    present = tmp_path / "pos_0000.sdt"
+    sparse_file(present)
+    compactor = Compactor(tmp_path / COMPACTION_MANIFEST_NAME)
+    compactor.submit(0, [present, tmp_path / "pos_0001.sdt"])
+    with pytest.raises(CompactionError, match="1 file"):
+        compactor.close()
+    summary = compactor.summary()
+    assert summary["files"] == 1 and summary["failed"] == 1 and summary["pending"] == 0
+    assert list(read_compaction_manifest(tmp_path)) == [str(present)]
+
+
+def test_simulated_acquisition_compresses_raw_files(tmp_path):
+    args = simulated_args(tmp_path, "--compress-raw", "--compress-workers", "2")
+    core = simulated_core()
+    journal = PositionJournal(args.save)
+    journal.record_start(args)
+    try:
+        engine = run_acquisition(core, args, [(100.0 * i, 0, 0) for i in range(3)],
+                                 np.arange(3), journal, RecordingBackend())
+    finally:
+        journal.close()
+
+    save = tmp_path / "data"
+    records = read_compaction_manifest(save)
+    assert sorted(os.path.basename(f) for f in records) == [
+        f"pos_{i:04d}.{ext}" for i in range(3) for ext in ("sdt", "spc")
+    ]
+    for path, record in records.items():
+        assert not os.path.exists(path)
+        assert verify_compacted(path, record["sha256"])
+    assert (save / "pos_0000.json").exists()
+    assert engine.status()["compaction"]["files"] == 6
+    # Compressed files still count as saved, once each
+    assert sorted(completed_positions(save, 4)) == [0, 1, 2]
+    sparse_file(save / "pos_0000.sdt", 10)
+    with FolderIndex(save, settle_time=0, use_watchdog=False) as index:
+        index.poll()
+        assert index.count == 3
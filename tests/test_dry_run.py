@@ -0,0 +1,107 @@
+import subprocess
+import sys
+import time
+from collections import namedtuple
+
+import numpy as np
+import pytest
+
+from tiled_acquisition import dry_run as dry_run_module
+from tiled_acquisition.dry_run import TimingProfile
+from tiled_acquisition.focus_map import check_safe_xy_range
+from tiled_acquisition.journal import PositionJournal
+from tiled_acquisition.main import dry_run, parse_args, run_acquisition
+from test_simulation import RecordingBackend, simulated_args, simulated_core
+
+
+Usage = namedtuple("Usage", "total used free")
+
+
+def write_grid_csv(path, n):
+    side = int(np.ceil(np.sqrt(n)))
+    i = np.arange(n)
+    xyz = np.column_stack((180.0 * (i % side), 180.0 * (i // side), np.full(n, 50.0)))
+    np.savetxt(path, xyz, delimiter=",")
+
+
+def test_check_safe_xy_range():
+    check_safe_xy_range([(0, 0), (10, 5)], 0, 0, 10, 5)
+    with pytest.raises(ValueError, match="1 positions"):
+        check_safe_xy_range([(0, 0), (11, 5)], 0, 0, 10, 5)
+
+
+def test_dry_run_does_not_load_micro_manager(tmp_path):
+    csv = tmp_path / "positions.csv"
+    write_grid_csv(csv, 10)
+    code = (
+        "import sys\n"
+        "from tiled_acquisition.main import dry_run, parse_args\n"
+        f"status = dry_run(parse_args([{str(csv)!r}, '--dry-run', '--config', 'rig.cfg']))\n"
+        "heavy = [m for m in sys.modules if m.split('.')[0] in ('pymmcore_plus', 'useq', 'pyometiff')]\n"
+        "print(status, heavy)\n"
+    )
+    completed = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert completed.stdout.strip() == "0 []"
+    assert "Estimated time" in completed.stderr
+
+
+def test_dry_run_of_large_plan_is_fast(tmp_path, capsys, monkeypatch):
+    csv = tmp_path / "positions.csv"
+    write_grid_csv(csv, 100000)
+    monkeypatch.setattr(dry_run_module.shutil, "disk_usage", lambda path: Usage(0, 0, 1e15))
+    args = parse_args(
+        [str(csv), "--dry-run", "--save", str(tmp_path / "data"), "--frames", "10",
+         "--z-range", "0", "100", "--path-order", "serpentine"]
+    )
+    start = time.perf_counter()
+    assert dry_run(args) == 0
+    assert time.perf_counter() - start < 1.0
+    report = capsys.readouterr().err
+    assert "100000 of 100000 positions" in report
+    assert "tif" in report
+
+
+def test_dry_run_reports_every_problem(tmp_path, capsys, monkeypatch):
+    csv = tmp_path / "positions.csv"
+    write_grid_csv(csv, 100)
+    save = tmp_path / "data"
+    save.mkdir()
+    monkeypatch.setattr(dry_run_module.shutil, "disk_usage", lambda path: Usage(0, 0, 1000))
+    args = parse_args(
+        [str(csv), "--dry-run", "--save", str(save), "--config", "rig.cfg",
+         "--z-range", "0", "10", "--xy-range", "0", "0", "500", "500"]
+    )
+    assert dry_run(args) == 1
+    problems = [line for line in capsys.readouterr().err.splitlines() if line.startswith("Problem")]
+    assert len(problems) == 4
+    assert "already exists" in problems[0]
+    assert "Z out of safe range" in problems[1]
+    assert "XY out of safe range" in problems[2]
+    assert "Not enough space" in problems[3]
+
+
+def test_profile_from_previous_run(tmp_path):
+    args = simulated_args(tmp_path)
+    core = simulated_core(frame_time=0.02)
+    journal = PositionJournal(args.save)
+    journal.record_start(args)
+    xyzs = [(100.0 * i, 0.0, 0.0) for i in range(4)]
+    try:
+        run_acquisition(core, args, xyzs, np.arange(4), journal, RecordingBackend())
+    finally:
+        journal.close()
+
+    profile = TimingProfile.from_run(args.save)
+    assert profile.source == str(args.save)
+    assert profile.frames == 4
+    assert 0.02 <= profile.frame_time < 0.1
+    # Measured sizes at the profile's settings, scaled to others
+    sdt = (tmp_path / "data" / "pos_0000.sdt").stat().st_size
+    assert profile.file_size("sdt", 4, 256) == sdt
+    assert profile.file_size("spc", 8, 512) == pytest.approx(
+        8 * profile.file_size("spc", 4, 256)
+    )
+    with pytest.raises(ValueError):
+        TimingProfile.from_run(tmp_path)
@@ -0,0 +1,64 @@
+import os
+
+import numpy as np
+import pytest
+
+from tiled_acquisition.eta import ThroughputEstimator
+from tiled_acquisition.folder_monitor import FolderIndex
+
+
+def test_learns_interval_and_rejects_outliers():
+    rng = np.random.default_rng(0)
+    estimator = ThroughputEstimator(total=100, initial_interval=105)
+    assert estimator.eta_seconds() == 100 * 105
+
+    t = 0.0
+    for i in range(30):
+        # A 10-minute PMT reset halfway through
+        t += 600.0 if i == 15 else 60.0 + rng.normal(0, 2)
+        estimator.observe(t, nbytes=300e6)
+
+    assert estimator.rejected == 1
+    assert estimator.interval == pytest.approx(60, abs=3)
+    assert estimator.tiles_per_hour == pytest.approx(60, abs=3)
+    assert estimator.bytes_per_second / 1e6 == pytest.approx(5, abs=0.3)
+    assert estimator.eta_seconds() == pytest.approx(70 * estimator.interval)
+
+
+def test_adapts_to_lasting_change_in_pace():
+    estimator = ThroughputEstimator()
+    t = 0.0
+    for _ in range(20):
+        t += 60.0
+        estimator.observe(t)
+    for _ in range(40):
+        t += 200.0
+        estimator.observe(t)
+    assert estimator.interval == pytest.approx(200, rel=0.05)
+
+
+def test_adaptive_stall_threshold():
+    estimator = ThroughputEstimator(initial_interval=90)
+    assert estimator.stall_threshold() == 135
+    t = 1000.0
+    for i in range(20):
+        t += 30.0 + (i % 3)
+        estimator.observe(t)
+    threshold = estimator.stall_threshold()
+    assert 45 <= threshold < 60
+    assert not estimator.is_stalled(t + 40)
+    assert estimator.is_stalled(t + 60)
+
+
+def test_follows_folder_index(tmp_path):
+    for i in range(6):
+        path = tmp_path / f"pos_{i:04d}.sdt"
+        path.write_bytes(b"\0" * 100)
+        os.utime(path, (1000 + 10 * i, 1000 + 10 * i))
+    index = FolderIndex(tmp_path, use_watchdog=False)
+    index.poll()
+    estimator = ThroughputEstimator(total=10)
+    estimator.follow_index(index)
+    assert estimator.count == 6
+    assert estimator.interval == pytest.approx(10)
+    assert estimator.eta_seconds() == pytest.approx(40)
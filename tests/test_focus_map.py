@@ -0,0 +1,92 @@
+import time
+
+import numpy as np
+import pytest
+
+from tiled_acquisition.focus_map import (
+    check_safe_z_range,
+    fit_focus_map,
+)
+
+
+def section_z(xy):
+    x, y = xy[:, 0] / 1000, xy[:, 1] / 1000
+    return 10000 + 0.5 * x - 0.3 * y + 0.04 * (x - 10) ** 2 + 0.03 * (y - 8) ** 2
+
+
+def curved_section(n, rng):
+    xy = rng.uniform(0, 20000, size=(n, 2))
+    return xy, section_z(xy)
+
+
+@pytest.mark.parametrize("model", ["plane", "poly2", "poly3", "tps", "piecewise"])
+def test_models_fit_a_plane(model):
+    if model == "piecewise":
+        pytest.importorskip("scipy")
+    rng = np.random.default_rng(0)
+    xy = rng.uniform(0, 5000, size=(40, 2))
+    z = 100 + 0.01 * xy[:, 0] - 0.02 * xy[:, 1]
+    focus_map = fit_focus_map(xy, z, model=model, robust="none")
+    grid = rng.uniform(500, 4500, size=(100, 2))
+    expected = 100 + 0.01 * grid[:, 0] - 0.02 * grid[:, 1]
+    assert np.allclose(focus_map.predict(grid), expected, atol=0.05)
+
+
+def test_auto_prefers_curved_model_and_rejects_outliers():
+    rng = np.random.default_rng(1)
+    xy, z = curved_section(200, rng)
+    z = z + rng.normal(0, 0.3, len(z))
+    bad = rng.choice(len(z), 10, replace=False)
+    z[bad] += rng.choice([-40, 40], len(bad))
+
+    focus_map = fit_focus_map(xy, z)
+    assert focus_map.model_name != "plane"
+    assert focus_map.cv_errors["plane"] > focus_map.cv_errors[focus_map.model_name]
+    assert not focus_map.inliers[bad].any()
+
+    positions, truth = curved_section(1000, rng)
+    assert np.abs(focus_map.predict(positions) - truth).max() < 2.0
+
+
+def test_piecewise_drops_outliers():
+    pytest.importorskip("scipy")
+    rng = np.random.default_rng(4)
+    xy, z = curved_section(150, rng)
+    bad = np.argmin(np.abs(xy - 10000).sum(axis=1))
+    z[bad] += 40
+    focus_map = fit_focus_map(xy, z, model="piecewise")
+    assert focus_map.weights[bad] == 0
+    assert not focus_map.inliers[bad]
+    assert focus_map.inliers.sum() == 149
+    # The surface near the bad point follows its neighbours
+    nearby = xy[bad] + rng.uniform(-200, 200, size=(20, 2))
+    assert np.abs(focus_map.predict(nearby) - section_z(nearby)).max() < 1.0
+
+
+def test_ransac_ignores_bad_points():
+    rng = np.random.default_rng(2)
+    xy = rng.uniform(0, 5000, size=(30, 2))
+    z = 50 + 0.002 * xy[:, 0]
+    z[:5] += 100
+    focus_map = fit_focus_map(xy, z, model="plane", robust="ransac")
+    assert np.allclose(focus_map.predict(xy[5:]), z[5:], atol=1e-6)
+    assert not focus_map.inliers[:5].any()
+
+
+@pytest.mark.parametrize("model", ["tps", "auto"])
+def test_large_map_is_fast(model):
+    rng = np.random.default_rng(3)
+    xy, z = curved_section(300, rng)
+    positions = rng.uniform(0, 20000, size=(50000, 2))
+    start = time.perf_counter()
+    focus_map = fit_focus_map(xy, z, model=model)
+    focus_map.predict(positions)
+    assert time.perf_counter() - start < 1.0
+
+
+def test_check_safe_z_range():
+    check_safe_z_range(np.array([1.0, 2.0]), 0.0, 3.0)
+    with pytest.raises(ValueError, match="1 positions"):
+        check_safe_z_range(np.array([1.0, 4.0]), 0.0, 3.0)
+    with pytest.raises(ValueError):
+        check_safe_z_range(np.array([np.nan]), 0.0, 3.0)
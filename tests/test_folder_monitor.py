@@ -0,0 +1,79 @@
+import os
+import time
+
+import pytest
+
+from tiled_acquisition.folder_monitor import FolderIndex, is_partial_name
+
+
+def write(path, size=10, age=0.0):
+    path.write_bytes(b"\0" * size)
+    if age:
+        t = time.time() - age
+        os.utime(path, (t, t))
+
+
+def wait_for(index, count, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while index.poll() is not None and index.count < count:
+        if time.monotonic() > deadline:
+            break
+        time.sleep(0.05)
+    return index.count
+
+
+def test_partial_names():
+    assert is_partial_name("pos_0001_0000.sdt")
+    assert is_partial_name("pos_0001_aborted0.sdt")
+    assert is_partial_name("pos_0001_incomplete2.sdt")
+    assert not is_partial_name("pos_0001.sdt")
+    assert not is_partial_name("pos_0000.sdt")
+
+
+def test_partial_names_past_tile_9999(tmp_path):
+    assert is_partial_name("pos_12345_0000.sdt")
+    assert is_partial_name("pos_12345_aborted0.sdt")
+    assert not is_partial_name("pos_12345.sdt")
+    assert not is_partial_name("pos_10000.sdt")
+
+    write(tmp_path / "pos_10000.sdt", 100, age=30)
+    write(tmp_path / "pos_10001_0000.sdt", 50, age=30)
+    with FolderIndex(tmp_path, settle_time=0, use_watchdog=False) as index:
+        index.poll()
+        assert index.count == 1
+
+
+@pytest.mark.parametrize("use_watchdog", [False, True])
+def test_counts_completed_files(tmp_path, use_watchdog):
+    write(tmp_path / "pos_0000.sdt", 100, age=60)
+    write(tmp_path / "pos_0001.sdt", 200, age=30)
+    write(tmp_path / "pos_0002_0000.sdt", 50, age=30)
+    write(tmp_path / "pos_0002_aborted0.sdt", 50, age=30)
+    write(tmp_path / "tile_config.txt", 10, age=30)
+
+    with FolderIndex(tmp_path, settle_time=0.2, use_watchdog=use_watchdog) as index:
+        index.poll()
+        assert index.count == 2
+        assert index.bytes_completed == 300
+        assert index.rate() == pytest.approx(1 / 30, rel=0.01)
+
+        # Being written: seen, but not counted until it stops changing
+        write(tmp_path / "pos_0002.sdt", 10)
+        assert wait_for(index, 3, timeout=0.1) == 2
+        assert wait_for(index, 3) == 3
+        assert index.bytes_completed == 310
+        assert index.pending == 0
+
+
+def test_listeners_and_missing_folder(tmp_path):
+    folder = tmp_path / "data"
+    index = FolderIndex(folder, settle_time=0.0)
+    assert not index.watching
+    seen = []
+    index.add_listener(lambda name, size, t: seen.append((name, size)))
+    folder.mkdir()
+    write(folder / "pos_0000.sdt", 5, age=10)
+    assert index.poll() == 1
+    assert index.poll() == 0
+    assert seen == [("pos_0000.sdt", 5)]
+    index.close()
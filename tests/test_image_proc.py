@@ -1,4 +1,8 @@
-from tiled_acquisition.main import looks_like_pmt_shut_off, unaccumulate_images
+from tiled_acquisition.main import (
+    frame_looks_like_pmt_shut_off,
+    looks_like_pmt_shut_off,
+    unaccumulate_images,
+)
 import numpy as np
 
 
@@ -20,3 +24,14 @@ def test_looks_like_pmt_shut_off_detects_when_last_16K_pixels_are_zero():
     assert looks_like_pmt_shut_off(img)
     img.ravel()[-16384] = 1
     assert not looks_like_pmt_shut_off(img)
+
+
+def test_frame_looks_like_pmt_shut_off_matches_unaccumulated_check():
+    rng = np.random.default_rng(0)
+    stack = np.cumsum(rng.integers(0, 3, size=(6, 256, 256)), axis=0).astype(np.uint16)
+    stack[3] = stack[2]  # No new photons in frame 3
+    stack[0].ravel()[-16384:] = 0
+    expected = [looks_like_pmt_shut_off(im) for im in unaccumulate_images(stack)]
+    actual = [frame_looks_like_pmt_shut_off(stack, i) for i in range(len(stack))]
+    assert actual == expected
+    assert actual == [True, False, False, True, False, False]
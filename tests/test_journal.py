@@ -0,0 +1,92 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from tiled_acquisition.journal import (
+    JOURNAL_NAME,
+    PositionJournal,
+    completed_positions,
+    read_journal,
+)
+
+
+def make_args(**kwargs):
+    defaults = dict(position_csv="positions.csv", frames=90, resolution=256, resume=False)
+    return SimpleNamespace(**(defaults | kwargs))
+
+
+def write_position(journal, tmp_path, number, size=10, frames=None):
+    sdt = tmp_path / f"pos_{number:04d}.sdt"
+    sdt.write_bytes(b"x" * size)
+    event = SimpleNamespace(x_pos=1.0 * number, y_pos=2.0, z_pos=3.0)
+    journal.record_position(
+        number, str(tmp_path / f"pos_{number:04d}"), event, {sdt: size}, frames
+    )
+    return sdt
+
+
+def test_completed_positions_skips_truncated_and_incomplete(tmp_path):
+    journal = PositionJournal(tmp_path)
+    journal.record_start(make_args())
+    write_position(journal, tmp_path, 0)
+    sdt = write_position(journal, tmp_path, 1)
+    write_position(journal, tmp_path, 2)
+    journal.close()
+    sdt.write_bytes(b"short")  # Position 1 was overwritten by a partial file
+    with open(tmp_path / JOURNAL_NAME, "a") as f:
+        f.write('{"type": "position", "number": 3, "pre')  # Crash mid-record
+
+    completed = completed_positions(tmp_path, frames=90, resolution=256)
+    assert sorted(completed) == [0, 2]
+    assert completed[2]["prefix"] == "pos_0002"
+    assert completed[2]["x"] == 2.0
+
+
+def test_completed_positions_rejects_changed_settings(tmp_path):
+    journal = PositionJournal(tmp_path)
+    journal.record_start(make_args(frames=90))
+    journal.close()
+    with pytest.raises(ValueError):
+        completed_positions(tmp_path, frames=30)
+
+
+def test_completed_positions_rejects_other_positions(tmp_path):
+    xyzs = np.array([[0.0, 0.0, 1.0], [100.0, 0.0, 2.0]])
+    journal = PositionJournal(tmp_path)
+    journal.record_start(make_args(), xyzs)
+    write_position(journal, tmp_path, 0)
+    journal.close()
+    # Re-planned Z still resumes; moved or reordered tiles do not
+    refocused = xyzs + [0.0, 0.0, 5.0]
+    assert sorted(completed_positions(tmp_path, frames=90, xyzs=refocused)) == [0]
+    with pytest.raises(ValueError, match="positions differ"):
+        completed_positions(tmp_path, frames=90, xyzs=xyzs[::-1])
+    with pytest.raises(ValueError, match="positions differ"):
+        completed_positions(tmp_path, frames=90, xyzs=xyzs[:1])
+
+
+def test_position_cut_short_is_not_complete(tmp_path):
+    journal = PositionJournal(tmp_path)
+    journal.record_start(make_args())
+    write_position(journal, tmp_path, 0, frames=90)
+    write_position(journal, tmp_path, 1, frames=6)
+    journal.close()
+    assert sorted(completed_positions(tmp_path, frames=90)) == [0]
+
+
+def test_records_after_a_crash_start_on_a_new_line(tmp_path):
+    journal = PositionJournal(tmp_path)
+    journal.record_start(make_args())
+    write_position(journal, tmp_path, 0)
+    journal.close()
+    with open(tmp_path / JOURNAL_NAME, "a") as f:
+        f.write('{"type": "position", "number": 1, "pre')  # Crash mid-record
+
+    journal = PositionJournal(tmp_path)
+    journal.record_start(make_args(resume=True))
+    write_position(journal, tmp_path, 2)
+    journal.close()
+    starts, positions = read_journal(tmp_path)
+    assert [start["resume"] for start in starts] == [False, True]
+    assert sorted(positions) == [0, 2]
@@ -0,0 +1,77 @@
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from tiled_acquisition.mosaic import MosaicBackend, tile_offsets
+
+
+def constant_stack(value, n_frames=3, size=4):
+    return np.full((n_frames, size, size), value, dtype=np.uint16)
+
+
+def test_tile_offsets_from_stage_coordinates():
+    xys = [(100.0, 50.0), (102.0, 50.0), (100.0, 53.0)]
+    assert tile_offsets(xys, 0.5).tolist() == [[0, 0], [0, 4], [6, 0]]
+    assert tile_offsets(xys, 0.5, invert_x=True).tolist() == [[0, 4], [0, 0], [6, 4]]
+
+
+def test_mosaic_last_wins(tmp_path):
+    # Two 4x4 tiles overlapping by 2 columns
+    xys = [(0.0, 0.0), (2.0, 0.0)]
+    backend = MosaicBackend(tmp_path / "m.npy", xys, (4, 4), 1.0, n_frames=3)
+    backend.write_position(0, None, constant_stack(10))
+    backend.write_position(1, None, constant_stack(20))
+    backend.close()
+    mosaic = np.load(tmp_path / "m.npy", mmap_mode="r")
+    assert mosaic.shape == (1, 4, 6)
+    assert mosaic[0, 0].tolist() == [10, 10, 20, 20, 20, 20]
+
+
+def test_mosaic_average_and_blend(tmp_path):
+    xys = [(0.0, 0.0), (2.0, 0.0)]
+    backend = MosaicBackend(tmp_path / "a.npy", xys, (4, 4), 1.0, 3, "average", "all")
+    backend.write_position(0, None, constant_stack(10))
+    backend.write_position(1, None, constant_stack(20))
+    backend.close()
+    mosaic = np.load(tmp_path / "a.npy")
+    assert mosaic.shape == (3, 4, 6)
+    assert mosaic[2, 1].tolist() == [10, 10, 15, 15, 20, 20]
+    assert not (tmp_path / "a.npy.sum.npy").exists()
+
+    backend = MosaicBackend(tmp_path / "b.npy", xys, (4, 4), 1.0, 3, "blend")
+    backend.write_position(0, None, constant_stack(10))
+    backend.write_position(1, None, constant_stack(20))
+    backend.close()
+    row = np.load(tmp_path / "b.npy")[0, 1].tolist()
+    assert row[:2] == [10, 10] and row[-2:] == [20, 20]
+    assert 10 < row[2] < row[3] < 20
+
+
+def test_mosaic_close_takes_one_frame_at_a_time(tmp_path):
+    n_frames, shape = 16, (256, 2048)
+    backend = MosaicBackend(tmp_path / "a.npy", [(0.0, 0.0)], shape, 1.0, n_frames,
+                            "average", "all")
+    backend.write_position(0, None, np.full((n_frames, *shape), 7, dtype=np.uint16))
+    tracemalloc.start()
+    try:
+        backend.close()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    band = shape[0] * shape[1] * 4  # one float32 frame of a 256-row band
+    assert peak < 6 * band
+    assert (np.load(tmp_path / "a.npy") == 7).all()
+
+
+def test_mosaic_writes_from_several_threads(tmp_path):
+    # A row of tiles, each overlapping the next by half, written by as many
+    # threads as there are tiles
+    n = 16
+    xys = [(2.0 * i, 0.0) for i in range(n)]
+    backend = MosaicBackend(tmp_path / "m.npy", xys, (4, 4), 1.0, 1, "average")
+    with ThreadPoolExecutor(n) as pool:
+        for _ in pool.map(lambda i: backend.write_position(i, None, constant_stack(10)), range(n)):
+            pass
+    backend.close()
+    assert np.all(np.load(tmp_path / "m.npy") == 10)
@@ -0,0 +1,46 @@
+import time
+
+from tiled_acquisition.notify import StatusService, StubNotifier
+
+
+def test_alerts_are_batched_and_deduplicated():
+    notifier = StubNotifier()
+    service = StatusService(notifier, batch_interval=0.2)
+    service.alert("NO NEW FILES at 10")
+    service.alert("NO NEW FILES at 10")
+    service.alert("Position 3 failed", topic="Errors")
+    time.sleep(0.4)
+    service.alert("NO NEW FILES at 10")
+    service.alert("Done")
+    service.close()
+
+    assert notifier.sent == [
+        ("Acquisition status", "NO NEW FILES at 10 (x2)"),
+        ("Errors", "Position 3 failed"),
+        ("Acquisition status", "Done"),
+    ]
+
+
+def test_alert_never_blocks_on_slow_server():
+    notifier = StubNotifier(send_delay=1.0)
+    service = StatusService(notifier, batch_interval=0.0, max_pending=5)
+    start = time.perf_counter()
+    for i in range(20):
+        service.alert(f"message {i}")
+    assert time.perf_counter() - start < 0.1
+    assert service.dropped > 0
+    service.close(timeout=0.1)
+
+
+def test_status_requests_get_replies():
+    notifier = StubNotifier()
+    service = StatusService(
+        notifier, batch_interval=0.0, status_provider=lambda: "12/100 positions"
+    )
+    notifier.add_request("Acquisition status", "hello")
+    notifier.add_request("Questions", "Status?")
+    deadline = time.monotonic() + 5
+    while not notifier.sent and time.monotonic() < deadline:
+        time.sleep(0.05)
+    service.close()
+    assert notifier.sent == [("Questions", "12/100 positions")]
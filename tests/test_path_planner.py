@@ -0,0 +1,47 @@
+import numpy as np
+
+from tiled_acquisition.path_planner import (
+    detect_rows,
+    path_travel_time,
+    plan_path,
+    serpentine_order,
+)
+
+
+def grid(n_rows, n_cols, pitch=500.0):
+    yy, xx = np.mgrid[0:n_rows, 0:n_cols] * pitch
+    return np.column_stack((xx.ravel(), yy.ravel(), np.zeros(xx.size)))
+
+
+def test_detect_rows_tolerates_jitter():
+    xyz = grid(3, 4)
+    xyz[:, 1] += np.random.default_rng(0).uniform(-5, 5, len(xyz))
+    assert detect_rows(xyz[:, 1]).tolist() == [0] * 4 + [1] * 4 + [2] * 4
+
+
+def test_serpentine_order_alternates_direction():
+    xyz = grid(2, 3)
+    shuffled = np.random.default_rng(1).permutation(len(xyz))
+    order = serpentine_order(xyz[shuffled])
+    assert xyz[shuffled][order][:, :2].tolist() == [
+        [0, 0], [500, 0], [1000, 0], [1000, 500], [500, 500], [0, 500],
+    ]
+
+
+def test_plan_path_returns_permutation_and_reduces_travel():
+    xyz = grid(6, 6)
+    # Shuffled grid, so the CSV order wanders back and forth
+    rng = np.random.default_rng(2)
+    xyz = xyz[rng.permutation(len(xyz))]
+    for method in ("serpentine", "nearest"):
+        order = plan_path(xyz, method)
+        assert sorted(order.tolist()) == list(range(len(xyz)))
+        assert path_travel_time(xyz, order) < path_travel_time(xyz)
+
+
+def test_z_aware_cost_avoids_focus_jumps():
+    # Two interleaved rows at different focus heights
+    xyz = np.array([[0, 0, 0], [0, 1, 100], [10, 0, 0], [10, 1, 100]], dtype=float)
+    order = plan_path(xyz, "nearest", xy_speed=1000.0, z_speed=10.0)
+    assert np.count_nonzero(np.diff(xyz[order][:, 2])) == 1
+    assert plan_path(xyz, "csv").tolist() == [0, 1, 2, 3]
@@ -0,0 +1,93 @@
+import time
+
+import numpy as np
+import pytest
+from useq import MDASequence, TIntervalLoops
+
+from tiled_acquisition.main import parse_args, plan_positions, read_poslist
+from tiled_acquisition.plan import (
+    PositionPlan,
+    load_plan,
+    PositionEvents,
+    read_position_csv,
+    save_plan,
+)
+
+
+def test_read_position_csv(tmp_path):
+    path = tmp_path / "positions.csv"
+    path.write_text("0,0,1\n100.5,-2,3e2\n")
+    xyz = read_position_csv(path)
+    assert xyz.tolist() == [[0.0, 0.0, 1.0], [100.5, -2.0, 300.0]]
+
+    path.write_text("0,0,1\n100,0\n")
+    with pytest.raises(ValueError, match="X, Y, Z"):
+        read_position_csv(path)
+    path.write_text("0,0\n1,1\n")
+    with pytest.raises(ValueError, match="X, Y, Z"):
+        read_position_csv(path)
+    path.write_text("0,0,1\n1,nan,1\n")
+    with pytest.raises(ValueError, match="row 2"):
+        read_position_csv(path)
+
+
+def test_plan_round_trip(tmp_path):
+    xyz = np.random.default_rng(0).uniform(0, 1000, size=(50, 3))
+    order = np.random.default_rng(1).permutation(50)[:40]
+    path = tmp_path / "plan.npz"
+    save_plan(path, PositionPlan(xyz, order, "XY", "Z"))
+    plan = load_plan(path)
+    assert np.array_equal(plan.xyz, xyz)
+    assert np.array_equal(plan.order, order)
+    assert (plan.xy_stage, plan.z_stage) == ("XY", "Z")
+    assert np.array_equal(read_poslist(path), xyz)
+
+    with pytest.raises(ValueError):
+        PositionPlan(xyz, [0, 0])
+    with pytest.raises(ValueError):
+        PositionPlan(xyz, [50])
+
+
+def test_plan_keeps_its_order(tmp_path):
+    xyz = np.array([[0.0, 0, 0], [300, 0, 0], [100, 0, 0], [200, 0, 0]])
+    path = tmp_path / "plan.npz"
+    save_plan(path, PositionPlan(xyz, [3, 1, 2, 0]))
+    assert plan_positions(parse_args([str(path)])).order.tolist() == [3, 1, 2, 0]
+    reordered = plan_positions(parse_args([str(path), "--path-order", "serpentine"]))
+    assert reordered.order.tolist() == [0, 2, 3, 1]
+
+    out = tmp_path / "saved.npz"
+    csv = tmp_path / "positions.csv"
+    np.savetxt(csv, xyz, delimiter=",")
+    plan = plan_positions(parse_args([str(csv), "--path-order", "serpentine"]))
+    save_plan(out, plan)
+    assert load_plan(out).order.tolist() == [0, 2, 3, 1]
+
+
+def test_events_match_sequence():
+    xyz = [(1.0, 2.0, 3.0), (4.0, 5.0, 6.0), (7.0, 8.0, 9.0)]
+    order = [2, 0]
+    sequence = MDASequence(
+        stage_positions=[xyz[i] for i in order],
+        time_plan=TIntervalLoops(interval=0, loops=3),
+        axis_order="pt",
+    )
+    # Identical apart from the reference back to the sequence
+    events = PositionEvents(xyz, order, 3)
+    assert len(events) == 6
+    assert [e.model_dump(exclude={"sequence"}) for e in events] == [
+        e.model_dump(exclude={"sequence"}) for e in sequence
+    ]
+
+
+def test_large_plan_starts_fast(tmp_path):
+    n = 200000
+    xyz = np.random.default_rng(0).uniform(0, 50000, size=(n, 3))
+    path = tmp_path / "plan.npz"
+    save_plan(path, PositionPlan(xyz))
+    start = time.perf_counter()
+    plan = load_plan(path)
+    events = PositionEvents(plan.xyz, plan.order, 4)
+    first = next(iter(events))
+    assert time.perf_counter() - start < 0.5
+    assert first.x_pos == xyz[0, 0]
@@ -0,0 +1,123 @@
+import time
+
+import numpy as np
+from pymmcore_plus.experimental.unicore import GenericDevice, UniMMCore, pymm_property
+
+from tiled_acquisition.main import run_acquisition
+from tiled_acquisition.pmt_control import PMTController
+from tiled_acquisition.simulation import make_simulated_core
+from test_simulation import RecordingBackend, simulated_args, simulated_core
+
+
+def timed(f):
+    start = time.monotonic()
+    result = f()
+    return result, time.monotonic() - start
+
+
+def test_power_on_returns_once_hv_has_ramped_up():
+    core = make_simulated_core(resolution=32, pmt_recovery_time=0.3)
+    pmt = PMTController(core, warmup=5.0, timeout=2.0)
+    assert pmt.reports_state
+    (ready, waited), elapsed = timed(pmt.power_on)
+    assert ready
+    assert 0.3 <= elapsed < 0.6
+    assert core._pydevices["DCCModule2"].detecting()
+
+
+def test_reset_waits_for_overload_to_clear_and_records_it():
+    core = make_simulated_core(resolution=32, pmt_recovery_time=0.1, pmt_clear_time=0.2)
+    dcc = core._pydevices["DCCModule2"]
+    pmt = PMTController(core, timeout=2.0)
+    pmt.power_on()
+    dcc.maybe_trip(1.0)
+    assert not pmt.is_ready()
+
+    duration, elapsed = timed(lambda: pmt.reset(7))
+    assert 0.3 <= elapsed < 0.7
+    assert dcc.detecting()
+    summary = pmt.summary()
+    assert summary["resets"] == 1
+    assert summary["resets_by_position"] == {"7": 1}
+    assert summary["reset_time_s"] == duration
+
+
+def test_timeout_when_pmt_never_becomes_ready():
+    core = make_simulated_core(resolution=32, pmt_recovery_time=10.0)
+    pmt = PMTController(core, timeout=0.2)
+    (ready, waited), _ = timed(pmt.power_on)
+    assert not ready
+    assert 0.2 <= waited < 0.5
+    assert pmt.summary()["timeouts"] == 1
+
+
+class SilentDCC(GenericDevice):
+    # A DCC that reports neither its overload state nor its HV
+    @pymm_property(name="C3_HV", allowed_values=["On", "Off"])
+    def hv(self) -> str:
+        return "Off"
+
+    @hv.setter
+    def hv(self, value: str):
+        pass
+
+    @pymm_property(name="ClearOverloads", allowed_values=["Clear", "-"])
+    def clear_overloads(self) -> str:
+        return "-"
+
+    @clear_overloads.setter
+    def clear_overloads(self, value: str):
+        pass
+
+
+def test_fixed_warmup_without_state_reporting():
+    core = UniMMCore()
+    core.loadPyDevice("DCCModule2", SilentDCC())
+    core.initializeAllDevices()
+    for state in ("On", "Off"):
+        core.defineConfig("PMT Power (HV)", state, "DCCModule2", "C3_HV", state)
+    pmt = PMTController(core, warmup=0.2)
+    assert not pmt.reports_state
+    (ready, _), elapsed = timed(pmt.power_on)
+    assert ready and elapsed >= 0.2
+    _, elapsed = timed(pmt.reset)
+    assert elapsed >= 0.3
+
+
+def test_retries_wait_for_recovery(tmp_path):
+    # Without the readiness check, a retry would start while the PMT is still
+    # dark, look like another shut-off and cost another reset
+    args = simulated_args(tmp_path, "--pmt-retries", "5")
+    core = simulated_core(dropout_rate=0.1, pmt_recovery_time=0.1, seed=3)
+    dcc = core._pydevices["DCCModule2"]
+    backend = RecordingBackend()
+    xyzs = [(100.0 * i, 0.0, 0.0) for i in range(6)]
+    engine = run_acquisition(core, args, xyzs, np.arange(6), backend=backend)
+
+    assert sorted(backend.stacks) == list(range(6))
+    status = engine.status()
+    assert dcc.trips > 0
+    assert dcc.resets == dcc.trips == status["pmt"]["resets"] == status["pmt_resets"]
+    assert status["pmt"]["timeouts"] == 0
+    assert status["pmt"]["max_reset_s"] >= 0.1
+
+
+class OverloadOnlyDCC(SilentDCC):
+    # Reports overloads but not the HV readback
+    @pymm_property(name="C3_Overloaded", allowed_values=["Yes", "No"])
+    def overloaded(self) -> str:
+        return "No"
+
+
+def test_fixed_warmup_without_hv_readback():
+    core = UniMMCore()
+    core.loadPyDevice("DCCModule2", OverloadOnlyDCC())
+    core.initializeAllDevices()
+    for state in ("On", "Off"):
+        core.defineConfig("PMT Power (HV)", state, "DCCModule2", "C3_HV", state)
+    pmt = PMTController(core, warmup=0.2)
+    assert pmt.reports_state
+    (ready, _), elapsed = timed(pmt.power_on)
+    assert ready and elapsed >= 0.2
+    _, elapsed = timed(pmt.reset)
+    assert elapsed >= 0.2
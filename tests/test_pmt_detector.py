@@ -0,0 +1,43 @@
+import numpy as np
+
+from tiled_acquisition.main import looks_like_pmt_shut_off, unaccumulate_images
+from tiled_acquisition.pmt_detector import TailRegionDetector
+
+
+def make_stack(n_frames=8, size=256, dropouts=(3, 6)):
+    rng = np.random.default_rng(1)
+    increments = rng.integers(0, 2, size=(n_frames, size, size))
+    for t in dropouts:
+        increments[t].ravel()[-(size * size // 4) :] = 0
+    return np.cumsum(increments, axis=0).astype(np.uint16)
+
+
+def test_detector_region_scales_with_resolution():
+    assert TailRegionDetector.for_resolution(256).n_pixels == 16384
+    assert TailRegionDetector.for_resolution(1024).n_pixels == 1024 * 1024 // 4
+    assert TailRegionDetector.for_resolution(512, fraction=0.5).n_pixels == 512 * 256
+
+
+def test_batched_check_matches_per_frame_check():
+    stack = make_stack()
+    detector = TailRegionDetector.for_resolution(256)
+    expected = [looks_like_pmt_shut_off(im) for im in unaccumulate_images(stack)]
+    incremental = [detector.frame_is_shut_off(stack, i) for i in range(len(stack))]
+    batched = detector.shut_off_frames(stack)
+    assert incremental == expected
+    assert list(batched) == expected
+    assert np.flatnonzero(batched).tolist() == [3, 6]
+
+
+def test_strided_detector_still_finds_dropouts():
+    stack = make_stack(size=512)
+    detector = TailRegionDetector.for_resolution(512, stride=16)
+    assert np.flatnonzero(detector.shut_off_frames(stack)).tolist() == [3, 6]
+
+
+def test_frame_statistics_counts_unaccumulated_photons():
+    stack = make_stack()
+    stats = TailRegionDetector.for_resolution(256).frame_statistics(stack)
+    expected = [im.astype(np.int64).sum() for im in unaccumulate_images(stack.astype(np.int64))]
+    assert stats.photons.tolist() == expected
+    assert stats.shut_off.tolist() == [t in (3, 6) for t in range(len(stack))]
@@ -0,0 +1,123 @@
+import csv
+import json
+import time
+
+import numpy as np
+import pytest
+
+from tiled_acquisition.poslist import read_position_list
+
+
+def make_position(label, x, y, z=None, xy_stage="XY", z_stage="Z"):
+    devposs = [
+        {
+            "Device": {"type": "STRING", "scalar": xy_stage},
+            "Position_um": {"type": "DOUBLE", "array": [x, y]},
+        }
+    ]
+    if z is not None:
+        devposs.append(
+            {
+                "Device": {"type": "STRING", "scalar": z_stage},
+                "Position_um": {"type": "DOUBLE", "array": [z]},
+            }
+        )
+    return {
+        "DefaultXYStage": {"type": "STRING", "scalar": xy_stage},
+        "DefaultZStage": {"type": "STRING", "scalar": z_stage if z is not None else ""},
+        "DevicePositions": {"type": "PROPERTY_MAP", "array": devposs},
+        "GridCol": {"type": "INTEGER", "scalar": 0},
+        "Label": {"type": "STRING", "scalar": label},
+    }
+
+
+def make_document(positions):
+    return {
+        "encoding": "UTF-8",
+        "format": "Micro-Manager Property Map",
+        "major_version": 2,
+        "minor_version": 0,
+        "map": {"StagePositions": {"type": "PROPERTY_MAP", "array": positions}},
+    }
+
+
+def write_document(path, positions):
+    with open(path, "w") as f:
+        json.dump(make_document(positions), f, indent=2)
+
+
+def test_columns(tmp_path):
+    path = tmp_path / "in.pos"
+    write_document(
+        path,
+        [
+            make_position("Pos0", 0.0, 1.0, 10.0),
+            make_position("Pos1", 2.0, 3.0),
+            make_position("Pos2", 4.0, 5.0, 12.5),
+        ],
+    )
+    poslist = read_position_list(path)
+    assert len(poslist) == 3
+    assert poslist.xy_stage == "XY"
+    assert poslist.z_stage(allow_blank=True) == "Z"
+    with pytest.raises(ValueError):
+        poslist.z_stage()
+    assert np.array_equal(poslist.xy(), [[0, 1], [2, 3], [4, 5]])
+    assert np.array_equal(poslist.has_z(), [True, False, True])
+    assert np.array_equal(poslist.z()[poslist.has_z()], [10.0, 12.5])
+    assert list(poslist.labels) == ["Pos0", "Pos1", "Pos2"]
+    assert list(poslist.devices) == ["XY", "Z"]
+
+
+def test_write_round_trip_is_identical(tmp_path):
+    path = tmp_path / "in.pos"
+    write_document(path, [make_position(f"Pos{i}", i, -i, i / 2) for i in range(5)])
+    out = tmp_path / "out.pos"
+    read_position_list(path).write(out)
+    assert out.read_text() == path.read_text()
+
+
+def test_write_new_z(tmp_path):
+    path = tmp_path / "in.pos"
+    positions = [make_position("Pos0", 0.0, 0.0, 1.0), make_position("Pos1", 1.0, 1.0)]
+    write_document(path, positions)
+    poslist = read_position_list(path)
+    out = tmp_path / "out.pos"
+    poslist.write(out, [5.0, 6.0], "Z")
+
+    written = read_position_list(out)
+    assert written.z_stage() == "Z"
+    assert np.array_equal(written.z(), [5.0, 6.0])
+    assert np.array_equal(written.xy(), poslist.xy())
+    # Positions are re-encoded only in the file being written
+    unchanged = tmp_path / "unchanged.pos"
+    poslist.write(unchanged)
+    assert unchanged.read_text() == path.read_text()
+
+    csv_path = tmp_path / "out.csv"
+    poslist.write_csv(csv_path, [5.0, 6.0])
+    with open(csv_path, newline="") as f:
+        assert [list(map(float, row)) for row in csv.reader(f)] == [
+            [0.0, 0.0, 5.0],
+            [1.0, 1.0, 6.0],
+        ]
+
+
+def test_large_list_is_fast(tmp_path):
+    path = tmp_path / "in.pos"
+    n = 50000
+    # Compact, as written by other tools; built one position at a time
+    header, footer = json.dumps(make_document([None])).split("null")
+    with open(path, "w") as f:
+        f.write(header)
+        for i in range(n):
+            f.write(("," if i else "") + json.dumps(make_position(f"Pos{i}", i, 2 * i, 100.0)))
+        f.write(footer)
+    out = tmp_path / "out.pos"
+    start = time.perf_counter()
+    poslist = read_position_list(path)
+    poslist.write(out, poslist.z() + 1)
+    assert time.perf_counter() - start < 10.0
+    written = read_position_list(out)
+    assert np.array_equal(written.z(), np.full(n, 101.0))
+    assert np.array_equal(written.xy(), poslist.xy())
@@ -0,0 +1,176 @@
+import csv
+import functools
+import json
+
+import numpy as np
+import pytest
+
+from tiled_acquisition.backends import OutputBackend
+from tiled_acquisition.journal import PositionJournal, read_journal
+from tiled_acquisition.main import parse_args, run_acquisition
+from tiled_acquisition.pmt_detector import TailRegionDetector
+from tiled_acquisition.shared_frames import FrameWorkerError, FrameWorkerPool, SharedFrameRing
+from tiled_acquisition.simulation import make_simulated_core
+from tiled_acquisition.writer import BackgroundWriterError
+
+
+# Made in the worker process; writes each stack to an .npy file
+class NpyBackend(OutputBackend):
+    def __init__(self, directory, fail_on=None):
+        self.__directory = directory
+        self.__fail_on = fail_on
+
+    def write_position(self, number, event, stack):
+        if number == self.__fail_on:
+            raise OSError("disk full")
+        path = f"{self.__directory}/pos_{number:04d}.npy"
+        np.save(path, stack)
+        return [path]
+
+
+def test_ring_hands_out_each_slot_once():
+    ring = SharedFrameRing(2, (3, 4, 4))
+    try:
+        a, b = ring.acquire(), ring.acquire()
+        assert {a, b} == {0, 1}
+        assert ring.acquire() is None
+        assert ring.acquire(timeout=0.05) is None
+        assert ring.in_use == 2
+        ring.release(a)
+        with pytest.raises(ValueError):
+            ring.release(a)
+        assert ring.acquire() == a
+        assert ring.fits((2, 4, 4)) and not ring.fits((4, 4, 4)) and not ring.fits((3, 8, 8))
+    finally:
+        ring.close()
+
+
+def test_attached_ring_shares_memory():
+    ring = SharedFrameRing(2, (3, 4, 4))
+    other = SharedFrameRing.attach(ring.spec())
+    try:
+        ring.slot(1)[:] = 7
+        assert other.slot(1).sum() == 7 * 3 * 16
+        assert other.slot(0).sum() == 0
+    finally:
+        other.close()
+        ring.close()
+
+
+def test_workers_save_slots_and_release_them(tmp_path):
+    ring = SharedFrameRing(2, (3, 8, 8))
+    pool = FrameWorkerPool(
+        ring, functools.partial(NpyBackend, tmp_path), 2, TailRegionDetector(16)
+    )
+    results = {}
+    for number in range(5):
+        slot = ring.acquire(timeout=None)
+        ring.slot(slot)[:] = np.arange(3)[:, None, None] * (number + 1)
+        pool.submit(slot, number, 2, None, lambda result, n=number: results.update({n: result}))
+    pool.close()
+
+    assert sorted(results) == [0, 1, 2, 3, 4]
+    for number, result in results.items():
+        saved = np.load(result["files"][0])
+        assert saved.shape == (2, 8, 8)
+        assert np.all(saved[1] == number + 1)
+        assert result["statistics"].photons.tolist() == [0, 64 * (number + 1)]
+        assert [span[0] for span in result["spans"]] == ["image_write", "frame_statistics"]
+    assert ring.in_use == 0
+
+
+def test_worker_errors_reach_the_submitter(tmp_path):
+    ring = SharedFrameRing(1, (1, 4, 4))
+    pool = FrameWorkerPool(ring, functools.partial(NpyBackend, tmp_path, fail_on=3), 1)
+    pool.submit(ring.acquire(), 3, 1, None, lambda result: None)
+    with pytest.raises(FrameWorkerError, match="disk full"):
+        pool.flush()
+    assert ring.in_use == 0
+    with pytest.raises(FrameWorkerError):
+        pool.close()
+
+
+def test_simulated_acquisition_with_frame_workers(tmp_path):
+    save = tmp_path / "data"
+    save.mkdir()
+    args = parse_args(
+        [
+            "positions.csv",
+            "--config", "simulated",
+            "--save", str(save),
+            "--frames", "3",
+            "--resolution", "256",
+            "--output", "ome-tiff",
+            "--pmt-warmup", "0",
+            "--frame-workers", "1",
+            # One slot: the next position is acquired before the worker has
+            # released it, exercising the fallback
+            "--frame-slots", "1",
+        ]
+    )
+    core = make_simulated_core(resolution=256, photon_rate=0.5)
+    core.setProperty("OSc-LSM", "BH-TCSPC-FLIMFileSaving", "Yes")
+    xyzs = [(100.0 * i, 0.0, 0.0) for i in range(4)]
+    journal = PositionJournal(save)
+    try:
+        engine = run_acquisition(core, args, xyzs, np.arange(4), journal)
+    finally:
+        journal.close()
+
+    tifs = sorted(p.name for p in (tmp_path / "data_tif").glob("*.tif"))
+    assert tifs == [f"pos_{i:04d}.tif" for i in range(4)]
+    _, positions = read_journal(save)
+    assert sorted(positions) == [0, 1, 2, 3]
+    assert all(any(f.endswith(".tif") for f in p["files"]) for p in positions.values())
+    with open(save / "frame_stats.csv", newline="") as f:
+        assert len(list(csv.DictReader(f))) == 4 * 3
+    status = engine.status()
+    assert status["ring_slots_in_use"] == 0
+    assert status["ring_fallbacks"] >= 1
+    assert engine.tracer.summary()["image_write"]["count"] == 4
+    summary = json.loads((save / "trace_summary.json").read_text())
+    assert summary["throughput"]["completed"] == 4
+
+
+def run_with_frame_workers(tmp_path, core):
+    save = tmp_path / "data"
+    save.mkdir()
+    args = parse_args(
+        [
+            "positions.csv",
+            "--config", "simulated",
+            "--save", str(save),
+            "--frames", "2",
+            "--resolution", "256",
+            "--pmt-warmup", "0",
+            "--frame-workers", "1",
+        ]
+    )
+    core.setProperty("OSc-LSM", "BH-TCSPC-FLIMFileSaving", "Yes")
+    xyzs = [(100.0 * i, 0.0, 0.0) for i in range(3)]
+    journal = PositionJournal(save)
+    try:
+        run_acquisition(core, args, xyzs, np.arange(3), journal)
+    finally:
+        journal.close()
+
+
+def test_frame_workers_with_image_size_other_than_resolution(tmp_path):
+    # The shared memory is sized from the camera, not --resolution
+    run_with_frame_workers(tmp_path, make_simulated_core(resolution=64))
+    tifs = sorted(p.name for p in (tmp_path / "data_tif").glob("*.tif"))
+    assert tifs == [f"pos_{i:04d}.tif" for i in range(3)]
+    _, positions = read_journal(tmp_path / "data")
+    assert sorted(positions) == [0, 1, 2]
+
+
+# The error is also raised on the MDA runner's thread, at the next submit
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_stack_that_does_not_fit_is_not_journaled(tmp_path):
+    core = make_simulated_core(resolution=64)
+    # As if the image size changed after the shared memory was made
+    core.getImageWidth = lambda: 16
+    with pytest.raises(BackgroundWriterError, match="does not fit"):
+        run_with_frame_workers(tmp_path, core)
+    _, positions = read_journal(tmp_path / "data")
+    assert positions == {}
@@ -0,0 +1,184 @@
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from tiled_acquisition.backends import OutputBackend
+from tiled_acquisition.journal import PositionJournal, completed_positions, read_journal
+from tiled_acquisition.main import parse_args, run_acquisition
+from tiled_acquisition.simulation import make_simulated_core
+from tiled_acquisition.status_server import read_status
+from tiled_acquisition.writer import BackgroundWriterError
+
+
+class RecordingBackend(OutputBackend):
+    def __init__(self, save=None):
+        self.stacks = {}
+        self.statuses = []
+        self.__save = save
+
+    def write_position(self, number, event, stack):
+        self.stacks[number] = stack.copy()
+        if self.__save is not None:
+            self.statuses.append(read_status(self.__save))
+        return []
+
+
+def simulated_core(**kwargs):
+    core = make_simulated_core(resolution=32, photon_rate=0.5, **kwargs)
+    core.setProperty("OSc-LSM", "BH-TCSPC-FLIMFileSaving", "Yes")
+    return core
+
+
+def simulated_args(tmp_path, *extra):
+    save = tmp_path / "data"
+    save.mkdir()
+    return parse_args(
+        [
+            "positions.csv",
+            "--config", "simulated",
+            "--save", str(save),
+            "--frames", "4",
+            "--output", "none",
+            "--pmt-warmup", "0",
+            *extra,
+        ]
+    )
+
+
+def test_simulated_acquisition_saves_every_position(tmp_path):
+    args = simulated_args(tmp_path)
+    xyzs = [(0.0, 0.0, 0.0), (100.0, 0.0, 0.0), (200.0, 0.0, 1.0)]
+    core = simulated_core()
+    backend = RecordingBackend(args.save)
+    engine = run_acquisition(core, args, xyzs, np.array([2, 0, 1]), backend=backend)
+
+    assert sorted(backend.stacks) == [0, 1, 2]
+    for stack in backend.stacks.values():
+        assert stack.shape == (4, 32, 32)
+        assert np.all(np.diff(stack.astype(int), axis=0) >= 0)
+        assert stack[-1].sum() > 0
+    for number in range(3):
+        for ext in ("sdt", "spc", "json"):
+            assert (tmp_path / "data" / f"pos_{number:04d}.{ext}").exists()
+    rows = (tmp_path / "data" / "tile_config.txt").read_text().splitlines()
+    assert [row.split(".")[0] for row in rows] == ["pos_0002", "pos_0000", "pos_0001"]
+    assert engine.stage_timer.positions == 3
+
+    phases = engine.tracer.summary()
+    assert phases["frame"]["count"] == 12
+    for phase in ("setup_event", "stage_move", "rename_sdt_files", "image_write"):
+        assert phases[phase]["count"] == 3
+    for name in ("trace.jsonl", "trace.json", "trace_summary.json"):
+        assert (tmp_path / "data" / name).exists()
+    status = json.loads((tmp_path / "data" / "trace_summary.json").read_text())
+    assert status["throughput"]["completed"] == 3
+    assert status["throughput"]["eta_seconds"] == 0
+
+    # Live status, as served while the first position was being saved
+    live = backend.statuses[0]
+    assert live["total_positions"] == 3
+    assert live["frames_per_position"] == 4
+    assert live["positions_completed"] == 0
+    assert live["buffers_in_use"] >= 1
+    assert "frame" in live["phases"]
+    assert not (tmp_path / "data" / "status_endpoint.json").exists()
+    assert engine.status()["positions_completed"] == 3
+
+
+def test_simulated_pmt_dropout_is_retried(tmp_path):
+    args = simulated_args(tmp_path, "--pmt-retries", "3")
+    core = simulated_core(dropout_rate=1.0)
+    dcc = core._pydevices["DCCModule2"]
+    backend = RecordingBackend()
+    engine = run_acquisition(
+        core, args, [(0.0, 0.0, 0.0)], np.array([0]), backend=backend
+    )
+
+    # The PMT trips on the first frame of every attempt
+    assert dcc.trips == 4
+    assert dcc.resets == 4
+    assert list(backend.stacks) == [0]
+    for attempt in range(3):
+        assert (tmp_path / "data" / f"pos_0000_aborted{attempt}.sdt").exists()
+    assert (tmp_path / "data" / "pos_0000.sdt").exists()
+    assert engine.tracer.summary()["pmt_reset"]["count"] == 4
+
+
+class SlowBackend(RecordingBackend):
+    def write_position(self, number, event, stack):
+        time.sleep(0.1)
+        return super().write_position(number, event, stack)
+
+
+def test_retry_while_writer_is_behind(tmp_path):
+    # The failed attempt's files must be set aside before the retry writes
+    # files of the same names, not whenever the writer gets to it
+    args = simulated_args(tmp_path, "--pmt-retries", "5")
+    core = simulated_core(dropout_rate=0.1, seed=3)
+    backend = SlowBackend()
+    xyzs = [(100.0 * i, 0.0, 0.0) for i in range(6)]
+    engine = run_acquisition(core, args, xyzs, np.arange(6), backend=backend)
+
+    assert sorted(backend.stacks) == list(range(6))
+    assert engine.status()["pmt_resets"] > 0
+    for number in range(6):
+        assert (tmp_path / "data" / f"pos_{number:04d}.sdt").exists()
+
+
+def test_cancelled_position_is_acquired_again_on_resume(tmp_path):
+    args = simulated_args(tmp_path, "--frames", "10")
+    core = simulated_core(frame_time=0.05)
+    journal = PositionJournal(args.save)
+    journal.record_start(args)
+    cancel = threading.Timer(0.3, core.mda.cancel)
+    cancel.start()
+    try:
+        run_acquisition(core, args, [(0.0, 0.0, 0.0), (100.0, 0.0, 0.0)], np.arange(2),
+                        journal, RecordingBackend())
+    finally:
+        cancel.cancel()
+        journal.close()
+
+    _, positions = read_journal(args.save)
+    assert 0 < positions[0]["frames"] < 10
+    assert completed_positions(args.save, 10) == {}
+
+
+def test_ome_zarr_tiles_are_checked_on_resume(tmp_path):
+    pytest.importorskip("zarr")
+    args = simulated_args(tmp_path, "--output", "ome-zarr")
+    journal = PositionJournal(args.save)
+    journal.record_start(args)
+    try:
+        run_acquisition(simulated_core(), args, [(0.0, 0.0, 0.0), (100.0, 0.0, 0.0)],
+                        np.arange(2), journal)
+    finally:
+        journal.close()
+
+    completed = completed_positions(args.save, 4)
+    assert sorted(completed) == [0, 1]
+    chunks = [f for f in completed[1]["files"] if ".ome.zarr" in f]
+    assert chunks
+    os.remove(chunks[0])
+    assert sorted(completed_positions(args.save, 4)) == [0]
+
+
+class FailingBackend(OutputBackend):
+    def write_position(self, number, event, stack):
+        raise OSError("disk full")
+
+
+# The error is raised on the MDA runner's thread, at the next submit
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_stack_is_released_when_the_writer_refuses_it(tmp_path):
+    args = simulated_args(tmp_path)
+    core = simulated_core(frame_time=0.02)
+    with pytest.raises(BackgroundWriterError, match="disk full"):
+        run_acquisition(core, args, [(100.0 * i, 0.0, 0.0) for i in range(3)],
+                        np.arange(3), backend=FailingBackend())
+    assert core.mda.engine.status()["buffers_in_use"] == 0
+
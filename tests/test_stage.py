@@ -0,0 +1,34 @@
+import time
+from types import SimpleNamespace
+
+from tiled_acquisition.stage import StageMoveTimer, start_move
+
+
+class RecordingCore:
+    def __init__(self):
+        self.calls = []
+
+    def setXYPosition(self, x, y):
+        self.calls.append(("xy", x, y))
+
+    def setPosition(self, z):
+        self.calls.append(("z", z))
+
+
+def test_start_move_issues_xy_and_z():
+    core = RecordingCore()
+    start_move(core, SimpleNamespace(x_pos=1.0, y_pos=2.0, z_pos=3.0))
+    start_move(core, SimpleNamespace(x_pos=4.0, y_pos=5.0, z_pos=None))
+    assert core.calls == [("xy", 1.0, 2.0), ("z", 3.0), ("xy", 4.0, 5.0)]
+
+
+def test_stage_move_timer_accounts_for_prefetched_moves():
+    timer = StageMoveTimer()
+    timer.setup_finished(timer.setup_started())
+    timer.move_issued()
+    time.sleep(0.02)
+    timer.setup_finished(timer.setup_started())
+    assert timer.positions == 2
+    assert timer.prefetched == 1
+    assert timer.lead_time >= 0.02
+    assert "1 moves were issued early" in timer.summary()
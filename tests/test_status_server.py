@@ -0,0 +1,25 @@
+import urllib.error
+import urllib.request
+
+import pytest
+
+from tiled_acquisition.status_server import StatusServer, read_status
+
+
+def test_serves_provider_status(tmp_path):
+    calls = []
+
+    def provider():
+        calls.append(1)
+        return {"position": 5, "frames_done": len(calls)}
+
+    server = StatusServer(provider, tmp_path)
+    try:
+        assert read_status(tmp_path) == {"position": 5, "frames_done": 1}
+        assert read_status(url=server.url)["frames_done"] == 2
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(server.url.replace("/status", "/other"), timeout=1)
+    finally:
+        server.close()
+    assert read_status(tmp_path) is None
+    assert read_status(url=server.url, timeout=0.2) is None
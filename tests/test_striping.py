@@ -0,0 +1,130 @@
+from collections import namedtuple
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from tiled_acquisition import striping
+from tiled_acquisition.folder_monitor import FolderIndex
+from tiled_acquisition.journal import PositionJournal, completed_positions
+from tiled_acquisition.main import (
+    parse_args,
+    rewrite_tile_config,
+    run_acquisition,
+    sort_tile_config,
+)
+from tiled_acquisition.striping import MANIFEST_NAME, TileLocator, VolumePlacer, read_manifest
+from tiled_acquisition.simulation import make_simulated_core
+
+
+Usage = namedtuple("Usage", "total used free")
+
+
+def test_round_robin_placement_and_manifest(tmp_path):
+    roots = [str(tmp_path / name) for name in ("a", "b", "c")]
+    locator = TileLocator(tmp_path)
+    placer = VolumePlacer(roots, "round-robin", tmp_path / MANIFEST_NAME)
+    try:
+        placed = [placer.place(number) for number in range(7)]
+        # A retry stays where the tile was placed
+        assert placer.place(4) == placed[4]
+        assert locator.root_of(6) == placed[6]
+    finally:
+        placer.close()
+    assert placed == roots * 2 + roots[:1]
+
+    manifest_roots, tiles = read_manifest(tmp_path)
+    assert manifest_roots == roots
+    assert tiles == dict(enumerate(placed))
+    assert read_manifest(tmp_path / "elsewhere") == ([], {})
+
+
+def test_balanced_placement_follows_bandwidth():
+    placer = VolumePlacer(["fast", "slow"], "balanced")
+    # Unmeasured volumes are tried in turn
+    assert [placer.place(0), placer.place(1)] == ["fast", "slow"]
+    placer.observe(0, 300e6, 1.0)
+    placer.observe(1, 100e6, 1.0)
+    placer.finished(0, 300e6)
+    placer.finished(1, 300e6)
+    # Three times the bandwidth takes three times the tiles
+    placed = [placer.place(number) for number in range(2, 10)]
+    assert placed.count("fast") == 6 and placed.count("slow") == 2
+    summary = placer.summary()
+    assert summary["fast"]["mb_per_s"] == pytest.approx(300)
+    assert summary["fast"]["outstanding"] == 6
+    assert summary["slow"]["tiles"] == 1
+
+
+def test_full_volumes_are_skipped(monkeypatch):
+    free = {"a": 1e12, "b": 1e6}
+    monkeypatch.setattr(striping.shutil, "disk_usage", lambda root: Usage(0, 0, free[root]))
+    for strategy in striping.PLACEMENTS:
+        placer = VolumePlacer(["a", "b"], strategy)
+        placer.place(0)
+        placer.finished(0, 1e6)
+        assert {placer.place(number) for number in range(1, 5)} == {"a"}
+
+
+def test_simulated_acquisition_over_two_volumes(tmp_path):
+    save, other = tmp_path / "data", tmp_path / "other"
+    save.mkdir()
+    args = parse_args(
+        [
+            "positions.csv",
+            "--config", "simulated",
+            "--save", str(save),
+            "--output-roots", str(other),
+            "--placement", "round-robin",
+            "--frames", "2",
+            "--pmt-warmup", "0",
+        ]
+    )
+    core = make_simulated_core(resolution=32, photon_rate=0.5)
+    core.setProperty("OSc-LSM", "BH-TCSPC-FLIMFileSaving", "Yes")
+    xyzs = [(100.0 * i, 0.0, 0.0) for i in range(4)]
+    journal = PositionJournal(save)
+    try:
+        engine = run_acquisition(core, args, xyzs, np.arange(4), journal)
+    finally:
+        journal.close()
+
+    roots, tiles = read_manifest(save)
+    assert roots == [str(save), str(other)]
+    assert tiles == {0: str(save), 1: str(other), 2: str(save), 3: str(other)}
+    for number, root in tiles.items():
+        for ext in ("sdt", "spc", "json"):
+            assert Path(f"{root}/pos_{number:04d}.{ext}").exists()
+        assert Path(f"{root}_tif/pos_{number:04d}.tif").exists()
+    assert engine.status()["volumes"][str(other)]["tiles"] == 2
+
+    # Tiles on the other volume are found relative to the main image folder
+    # Rows are in acquisition order, whichever writer thread finished first
+    rows = (save / "tile_config.txt").read_text().splitlines()
+    assert [row.split(";")[0][-8:-4] for row in rows] == ["0000", "0001", "0002", "0003"]
+    rows = sorted(rows)
+    assert rows[:2] == ["../other_tif/pos_0001.tif; ; (100.0,0.0)",
+                        "../other_tif/pos_0003.tif; ; (300.0,0.0)"]
+    assert rows[2] == "pos_0000.tif; ; (0.0,0.0)"
+    completed = completed_positions(save, 2, 256)
+    assert sorted(completed) == [0, 1, 2, 3]
+    rewrite_tile_config(args, completed.values())
+    assert sorted((save / "tile_config.txt").read_text().splitlines()) == rows
+
+    with FolderIndex.for_acquisition(save, settle_time=0, use_watchdog=False) as index:
+        index.poll()
+        assert index.folders == [str(save), str(other)]
+        assert index.count == 4
+
+
+def test_tile_config_is_sorted_into_acquisition_order(tmp_path):
+    args = parse_args(["positions.csv", "--save", str(tmp_path)])
+    # pos_0005 was kept from before a --resume; the others finished out of order
+    rows = ["pos_0005.tif; ; (5,0)", "../other_tif/pos_0002.tif; ; (2,0)",
+            "pos_0007.tif; ; (7,0)", "pos_0003.tif; ; (3,0)"]
+    (tmp_path / "tile_config.txt").write_text("\n".join(rows) + "\n")
+    sort_tile_config(args, np.array([3, 7, 2]))
+    assert (tmp_path / "tile_config.txt").read_text().splitlines() == [
+        rows[0], rows[3], rows[2], rows[1]
+    ]
+
@@ -0,0 +1,93 @@
+import time
+
+import numpy as np
+import pytest
+
+from tiled_acquisition.main import load_positions, parse_args
+from tiled_acquisition.tile_grid import (
+    apply_focus,
+    pixel_size_for,
+    points_in_polygon_grid,
+    tile_grid,
+)
+
+
+def test_default_pixel_size():
+    assert pixel_size_for(256, 2) == pytest.approx(0.7)
+    assert pixel_size_for(512, 2) == pytest.approx(0.35)
+
+
+def test_bbox_grid_covers_region_in_serpentine_order():
+    xy = tile_grid(bbox=(0, 0, 1000, 450), tile_size=100, overlap=10)
+    xs, ys = np.unique(xy[:, 0]), np.unique(xy[:, 1])
+    assert np.allclose(np.diff(xs), 90) and np.allclose(np.diff(ys), 90)
+    assert xs.min() - 50 <= 0 and xs.max() + 50 >= 1000
+    assert ys.min() - 50 <= 0 and ys.max() + 50 >= 450
+    assert len(xy) == len(xs) * len(ys)
+    # Every move is to a neighbouring tile
+    steps = np.abs(np.diff(xy, axis=0)).max(axis=1)
+    assert np.allclose(steps, 90)
+
+
+def test_polygon_grid_covers_polygon():
+    # An L shape; tiles in its missing corner are left out
+    polygon = [(0, 0), (2000, 0), (2000, 800), (800, 800), (800, 2000), (0, 2000)]
+    xy = tile_grid(polygon=polygon, tile_size=200, overlap=0)
+    full = tile_grid(bbox=(0, 0, 2000, 2000), tile_size=200, overlap=0)
+    assert len(xy) < len(full)
+    assert not ((xy[:, 0] > 1000) & (xy[:, 1] > 1000)).any()
+
+    rng = np.random.default_rng(0)
+    points = rng.uniform(0, 2000, size=(5000, 2))
+    points = points[(points[:, 0] < 800) | (points[:, 1] < 800)]
+    covered = (np.abs(points[:, None, :] - xy[None, :, :]) <= 100).all(axis=2).any(axis=1)
+    assert covered.all()
+
+
+def test_points_in_polygon():
+    square = [(0, 0), (10, 0), (10, 10), (0, 10)]
+    inside = points_in_polygon_grid(np.array([-1.0, 5.0, 11.0]), np.array([5.0, 20.0]), square)
+    assert inside.tolist() == [[False, True, False], [False, False, False]]
+
+
+def test_apply_focus():
+    class Tilted:
+        def predict(self, xy):
+            return 100 + 0.01 * xy[:, 0]
+
+    xy = tile_grid(bbox=(0, 0, 1000, 1000), tile_size=250)
+    assert np.allclose(apply_focus(xy, Tilted())[:, 2], 100 + 0.01 * xy[:, 0])
+    assert np.all(apply_focus(xy, z=5.0)[:, 2] == 5.0)
+
+
+def test_large_grid_is_fast():
+    start = time.perf_counter()
+    xy = tile_grid(bbox=(0, 0, 61000, 61000), tile_size=200, overlap=5)
+    assert time.perf_counter() - start < 0.5
+    assert len(xy) > 100000
+
+    circle = 30000 + 30000 * np.column_stack(
+        (np.cos(np.linspace(0, 2 * np.pi, 200)), np.sin(np.linspace(0, 2 * np.pi, 200)))
+    )
+    start = time.perf_counter()
+    xy = tile_grid(polygon=circle, tile_size=200, overlap=5)
+    assert time.perf_counter() - start < 2.0
+    assert len(xy) > 75000
+
+
+def test_grid_from_command_line(tmp_path):
+    focus = tmp_path / "focus.csv"
+    focus.write_text("0,0,100\n1000,0,110\n0,1000,100\n1000,1000,110\n")
+    args = parse_args(
+        [str(focus), "--grid-bbox", "0", "0", "1000", "1000", "--resolution", "256"]
+    )
+    xyzs = load_positions(args)
+    assert np.allclose(xyzs[:, 2], 100 + 0.01 * xyzs[:, 0])
+
+    with pytest.raises(SystemExit):
+        parse_args(["--grid-bbox", "0", "0", "1000", "1000"])
+    args = parse_args(
+        ["--grid-bbox", "0", "0", "1000", "1000", "--grid-z", "50", "--z-range", "0", "40"]
+    )
+    with pytest.raises(ValueError):
+        load_positions(args)
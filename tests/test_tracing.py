@@ -0,0 +1,64 @@
+import json
+import threading
+
+from tiled_acquisition.tracing import TraceRecorder, read_trace_summary
+
+
+def test_summary_percentiles_per_phase():
+    tracer = TraceRecorder()
+    for i in range(1, 101):
+        tracer.record("frame", 0, i * 1_000_000, position=0)
+    tracer.record("pmt_reset", 0, 5_000_000_000)
+
+    summary = tracer.summary()
+    assert summary["frame"]["count"] == 100
+    assert summary["frame"]["p50_ms"] == 50.5
+    assert 95 <= summary["frame"]["p95_ms"] <= 96
+    assert summary["pmt_reset"]["total_s"] == 5.0
+
+
+def test_ring_buffer_keeps_most_recent_spans():
+    tracer = TraceRecorder(capacity=10, window=5)
+    for i in range(25):
+        tracer.record("frame", i, i + 1, position=i)
+    assert [span[4] for span in tracer.spans()] == list(range(15, 25))
+    assert tracer.summary()["frame"]["count"] == 25
+
+
+def test_spans_from_several_threads(tmp_path):
+    tracer = TraceRecorder()
+
+    def work():
+        for _ in range(100):
+            with tracer.span("image_write", 3):
+                pass
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert tracer.summary()["image_write"]["count"] == 400
+
+    tracer.write_jsonl(tmp_path / "trace.jsonl")
+    records = [json.loads(line) for line in open(tmp_path / "trace.jsonl")]
+    assert len(records) == 400
+    assert {r["phase"] for r in records} == {"image_write"}
+    assert len({r["thread"] for r in records}) == 4
+
+
+def test_chrome_trace_and_summary_files(tmp_path):
+    tracer = TraceRecorder()
+    with tracer.span("setup_event", 7):
+        pass
+    tracer.write_chrome_trace(tmp_path / "trace.json")
+    trace = json.loads((tmp_path / "trace.json").read_text())
+    (event,) = trace["traceEvents"]
+    assert event["name"] == "setup_event"
+    assert event["ph"] == "X"
+    assert event["dur"] >= 0
+    assert event["args"] == {"position": 7}
+
+    assert read_trace_summary(tmp_path / "summary.json") is None
+    tracer.write_summary(tmp_path / "summary.json")
+    assert read_trace_summary(tmp_path / "summary.json")["phases"]["setup_event"]["count"] == 1
@@ -0,0 +1,84 @@
+import threading
+
+import pytest
+
+from tiled_acquisition.writer import BackgroundWriter, BackgroundWriterError
+
+
+def test_background_writer_runs_jobs_in_order_and_flushes():
+    done = []
+    writer = BackgroundWriter(max_pending=2)
+    for i in range(5):
+        writer.submit(done.append, i)
+    writer.close()
+    assert done == [0, 1, 2, 3, 4]
+
+
+def test_background_writer_blocks_when_queue_is_full():
+    release = threading.Event()
+    writer = BackgroundWriter(max_pending=1)
+    writer.submit(release.wait)  # Occupies the worker
+    writer.submit(lambda: None)  # Fills the queue
+
+    submitted = threading.Event()
+
+    def submit_third():
+        writer.submit(lambda: None)
+        submitted.set()
+
+    thread = threading.Thread(target=submit_third)
+    thread.start()
+    assert not submitted.wait(timeout=0.2)
+    release.set()
+    assert submitted.wait(timeout=5)
+    thread.join()
+    writer.close()
+
+
+def test_background_writer_reports_errors_to_submitter():
+    def fail():
+        raise OSError("disk full")
+
+    writer = BackgroundWriter(max_pending=2)
+    writer.submit(fail)
+    with pytest.raises(BackgroundWriterError):
+        writer.flush()
+    with pytest.raises(BackgroundWriterError):
+        writer.submit(lambda: None)
+    with pytest.raises(BackgroundWriterError):
+        writer.close()
+
+
+def test_background_writer_synchronous_mode():
+    done = []
+    writer = BackgroundWriter(max_pending=0)
+    writer.submit(done.append, 1)
+    assert done == [1]
+    writer.close()
+
+
+def test_background_writer_threads_run_jobs_concurrently():
+    # Each job waits for the other; one thread would never finish them
+    barrier = threading.Barrier(2, timeout=5)
+    writer = BackgroundWriter(max_pending=2, threads=2)
+    assert writer.threads == 2
+    writer.submit(barrier.wait)
+    writer.submit(barrier.wait)
+    writer.close()
+
+
+def test_background_writer_lanes_keep_jobs_on_one_thread():
+    seen = {0: [], 1: []}
+    writer = BackgroundWriter(max_pending=2, threads=2)
+    for i in range(6):
+        lane = i % 2
+        writer.submit(
+            lambda lane, i: seen[lane].append((threading.current_thread().name, i)), lane, i,
+            lane=lane,
+        )
+    writer.close()
+    for lane, jobs in seen.items():
+        assert [i for _, i in jobs] == [lane, lane + 2, lane + 4]
+        assert len({name for name, _ in jobs}) == 1
+    assert seen[0][0][0] != seen[1][0][0]
+